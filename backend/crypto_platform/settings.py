@@ -3,6 +3,7 @@ Django settings for crypto_platform project.
 """
 
 from pathlib import Path
+from decimal import Decimal
 from decouple import config
 import os
 
@@ -170,6 +171,25 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Seconds between folds of the trading fee postings into the exchange
+# fee account balances
+FEE_FOLD_INTERVAL = config('FEE_FOLD_INTERVAL', default=60, cast=int)
+
+# Seconds between consistency checks of the order books against the database
+ORDER_BOOK_CHECK_INTERVAL = config('ORDER_BOOK_CHECK_INTERVAL', default=3600, cast=int)
+
+# Periodic tasks, run by "celery -A crypto_platform beat"
+CELERY_BEAT_SCHEDULE = {
+    'fold-fee-postings': {
+        'task': 'wallet.fold_fee_postings',
+        'schedule': FEE_FOLD_INTERVAL,
+    },
+    'check-order-books': {
+        'task': 'trading.check_order_books',
+        'schedule': ORDER_BOOK_CHECK_INTERVAL,
+    },
+}
+
 # Channels Configuration
 CHANNEL_LAYERS = {
     'default': {
@@ -180,6 +200,58 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Matching Engine Configuration
+# Each trading pair is owned by one matching shard. A shard is the Celery
+# queue "matching.<n>" consumed by a single worker process, started with
+# "python manage.py run_matching_worker <n>".
+# Order books are resident in the memory of the process matching them, so
+# every pair must have a single writer. With 0 shards, orders are matched in
+# the process that receives them, which is only correct when one process
+# serves every request (development server, tests): each web worker would
+# keep its own diverging copy of the books. That mode is refused unless
+# MATCHING_IN_PROCESS is set.
+# With DEBUG both default to in-process matching, so "runserver" works
+# without a matching worker. Otherwise one shard is used, whose worker must
+# be running: without it every order times out.
+MATCHING_SHARDS = config('MATCHING_SHARDS', default=0 if DEBUG else 1, cast=int)
+MATCHING_IN_PROCESS = config('MATCHING_IN_PROCESS', default=DEBUG, cast=bool)
+MATCHING_COMMAND_TIMEOUT = config('MATCHING_COMMAND_TIMEOUT', default=10, cast=int)
+
+# Largest number of orders accepted by the batch order endpoint
+MAX_BATCH_ORDERS = config('MAX_BATCH_ORDERS', default=50, cast=int)
+
+# Largest number of open orders a user may have on one trading pair,
+# checked by the matching engine; 0 disables the limit
+MAX_OPEN_ORDERS_PER_PAIR = config('MAX_OPEN_ORDERS_PER_PAIR', default=200, cast=int)
+
+# Directory of the per-pair matching journals and book snapshots. Empty
+# disables journaling and books are always loaded from the database.
+MATCHING_JOURNAL_DIR = config('MATCHING_JOURNAL_DIR', default='')
+# Journal records written between two snapshots of a book
+MATCHING_SNAPSHOT_INTERVAL = config('MATCHING_SNAPSHOT_INTERVAL', default=10000, cast=int)
+
+# Price steps, in quote currency, at which the matching engine keeps the
+# order book grouped for depth views
+ORDER_BOOK_TICK_SIZES = config(
+    'ORDER_BOOK_TICK_SIZES',
+    default='1,10,100',
+    cast=lambda v: [Decimal(s.strip()) for s in v.split(',') if s.strip()]
+)
+
+# Seconds a process keeps its cached trading pairs and cryptocurrencies.
+# Edits invalidate the editing process and the matching shards at once;
+# other processes see them after at most this long.
+REFERENCE_DATA_TTL = config('REFERENCE_DATA_TTL', default=60, cast=int)
+
+# Push order updates and fills to the owners' private WebSocket channel
+# (ws/orders/) after every match pass
+PUSH_ORDER_UPDATES = config('PUSH_ORDER_UPDATES', default=True, cast=bool)
+
+# Seconds between the expiry passes a matching worker queues for itself.
+# Every pass over a book also expires its due good-til-date orders first,
+# which is all that expires them when matching runs without shards.
+ORDER_EXPIRY_INTERVAL = config('ORDER_EXPIRY_INTERVAL', default=1, cast=float)
+
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
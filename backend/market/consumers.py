@@ -1,8 +1,14 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 from .models import MarketData
 from trading.models import TradingPair, OrderBook, Trade
+from trading.reports import order_updates_group
+from trading.sharding import dispatch
 
 class MarketDataConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for real-time market data"""
@@ -74,6 +80,9 @@ class OrderBookConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.trading_pair_id = self.scope['url_route']['kwargs']['trading_pair_id']
         self.room_group_name = f'orderbook_{self.trading_pair_id}'
+        # Optional price grouping, e.g. ws/orderbook/1/?tick=10
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.tick = query.get('tick', [None])[0]
         
         # Join room group
         await self.channel_layer.group_add(
@@ -111,6 +120,13 @@ class OrderBookConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_order_book(self):
         try:
+            if self.tick:
+                # Grouped depth is maintained by the matching engine
+                return dispatch(int(self.trading_pair_id), 'order_book_depth', {
+                    'trading_pair_id': int(self.trading_pair_id),
+                    'tick': self.tick,
+                })
+            
             # Get bids and asks
             bids = list(OrderBook.objects.filter(
                 trading_pair_id=self.trading_pair_id,
@@ -197,4 +213,59 @@ class TradesConsumer(AsyncWebsocketConsumer):
             
             return trades
         except Exception as e:
-            return []
\ No newline at end of file
+            return []
+
+class UserOrdersConsumer(AsyncWebsocketConsumer):
+    """WebSocket consumer for the updates and fills of the user's own orders"""
+    
+    async def connect(self):
+        user = await self.get_user()
+        if user is None:
+            await self.close()
+            return
+        
+        self.room_group_name = order_updates_group(user.id)
+        
+        # Join the user's private group
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+        
+        await self.accept()
+    
+    async def disconnect(self, close_code):
+        # Connections refused in connect never joined a group
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
+    
+    async def receive(self, text_data):
+        # Handle incoming messages (if needed)
+        pass
+    
+    async def order_update(self, event):
+        """Send order updates to WebSocket"""
+        await self.send(text_data=json.dumps({
+            'type': 'order_update',
+            'data': event['data']
+        }))
+    
+    @database_sync_to_async
+    def get_user(self):
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            return user
+        
+        # API clients authenticate with their access token, e.g.
+        # ws/orders/?token=<access token>
+        token = parse_qs(self.scope['query_string'].decode()).get('token')
+        if not token:
+            return None
+        authentication = JWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(token[0]))
+        except (InvalidToken, AuthenticationFailed):
+            return None
@@ -5,4 +5,5 @@ websocket_urlpatterns = [
     re_path(r'ws/market/(?P<trading_pair_id>\w+)/$', consumers.MarketDataConsumer.as_asgi()),
     re_path(r'ws/orderbook/(?P<trading_pair_id>\w+)/$', consumers.OrderBookConsumer.as_asgi()),
     re_path(r'ws/trades/(?P<trading_pair_id>\w+)/$', consumers.TradesConsumer.as_asgi()),
+    re_path(r'ws/orders/$', consumers.UserOrdersConsumer.as_asgi()),
 ]
\ No newline at end of file
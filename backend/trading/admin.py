@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cryptocurrency, TradingPair, Order, Trade, OrderBook, PriceHistory
+from .models import Cryptocurrency, TradingPair, Order, Trade, OrderAmendment, OrderBook, PriceHistory
 
 @admin.register(Cryptocurrency)
 class CryptocurrencyAdmin(admin.ModelAdmin):
@@ -29,9 +29,11 @@ class OrderAdmin(admin.ModelAdmin):
         'id', 'user', 'trading_pair', 'order_type', 'side', 'status',
         'quantity', 'price', 'filled_quantity', 'created_at'
     ]
-    list_filter = ['order_type', 'side', 'status', 'trading_pair', 'created_at']
+    list_filter = [
+        'order_type', 'side', 'status', 'time_in_force', 'post_only', 'trading_pair', 'created_at'
+    ]
     search_fields = ['user__email', 'id']
-    readonly_fields = ['id', 'created_at', 'updated_at', 'executed_at']
+    readonly_fields = ['id', 'created_at', 'updated_at', 'executed_at', 'triggered_at']
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related(
@@ -54,6 +56,16 @@ class TradeAdmin(admin.ModelAdmin):
         )
 
 
+@admin.register(OrderAmendment)
+class OrderAmendmentAdmin(admin.ModelAdmin):
+    list_display = [
+        'order', 'previous_quantity', 'previous_price', 'quantity', 'price', 'created_at'
+    ]
+    list_filter = ['created_at']
+    search_fields = ['order__id', 'order__user__email']
+    readonly_fields = ['created_at']
+
+
 @admin.register(OrderBook)
 class OrderBookAdmin(admin.ModelAdmin):
     list_display = ['trading_pair', 'side', 'price', 'quantity', 'order_count', 'updated_at']
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 class TradingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trading'
-    verbose_name = 'معاملات'
\ No newline at end of file
+    verbose_name = 'معاملات'
+    
+    def ready(self):
+        # Connect the reference data invalidation handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,225 @@
+"""
+Matching commands executed by the process owning a trading pair.
+
+Payloads and results are plain JSON data so the same commands can run
+in-process or inside a matching shard worker.
+"""
+
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_datetime
+from . import consistency
+from .engine import format_amount, order_books
+from .models import Order
+from .reference import reference_data
+from .reports import publish_order_rejection
+from .serializers import OrderSerializer
+from .services import OrderService
+
+User = get_user_model()
+
+COMMANDS = {}
+
+
+def command(name):
+    """Register a function as a matching command"""
+    def decorator(func):
+        COMMANDS[name] = func
+        return func
+    return decorator
+
+
+def execute(name, payload):
+    try:
+        handler = COMMANDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown matching command: {name}")
+    return handler(payload)
+
+
+def _decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+def _datetime(value):
+    return parse_datetime(value) if value is not None else None
+
+
+def _order_id(value):
+    # Payload ids are strings; the book is keyed by the UUIDs orders
+    # loaded from the database carry
+    return Order._meta.pk.to_python(value) if value is not None else None
+
+
+def _create_order(payload):
+    user = User.objects.get(id=payload['user_id'])
+    trading_pair = reference_data.trading_pair(payload['trading_pair_id'])
+
+    return OrderService().create_order(
+        user=user,
+        trading_pair=trading_pair,
+        order_type=payload['order_type'],
+        side=payload['side'],
+        quantity=Decimal(payload['quantity']),
+        price=_decimal(payload.get('price')),
+        stop_price=_decimal(payload.get('stop_price')),
+        time_in_force=payload.get('time_in_force', 'gtc'),
+        post_only=payload.get('post_only', False),
+        expires_at=_datetime(payload.get('expires_at')),
+        display_quantity=_decimal(payload.get('display_quantity')),
+        order_id=_order_id(payload.get('order_id'))
+    )
+
+
+@command('create_order')
+def create_order(payload):
+    """Validate, reserve and match a new order"""
+    return OrderSerializer(_create_order(payload)).data
+
+
+@command('submit_order')
+def submit_order(payload):
+    """Create an order whose id was acknowledged before it was matched.
+
+    Nobody waits for the result, so a refused order is recorded as rejected
+    and the refusal pushed to its user. A redelivered command finds the
+    order made by the first delivery, accepted or rejected, and does nothing.
+    """
+    order_id = _order_id(payload['order_id'])
+    # Commands of a pair run one at a time, so nothing can create the
+    # order between this check and the create below
+    if Order.objects.filter(id=order_id).exists():
+        return {'id': payload['order_id']}
+
+    try:
+        _create_order(payload)
+    except ValueError as error:
+        quantity = Decimal(payload['quantity'])
+        order = Order.objects.create(
+            id=order_id,
+            user_id=payload['user_id'],
+            trading_pair_id=payload['trading_pair_id'],
+            order_type=payload['order_type'],
+            side=payload['side'],
+            status='rejected',
+            quantity=quantity,
+            price=_decimal(payload.get('price')),
+            stop_price=_decimal(payload.get('stop_price')),
+            time_in_force=payload.get('time_in_force', 'gtc'),
+            post_only=payload.get('post_only', False),
+            expires_at=_datetime(payload.get('expires_at')),
+            display_quantity=_decimal(payload.get('display_quantity')),
+            remaining_quantity=quantity
+        )
+        publish_order_rejection(order, str(error))
+    return {'id': payload['order_id']}
+
+
+@command('create_orders')
+def create_orders(payload):
+    """Validate, reserve and match a batch of orders for one trading pair"""
+    user = User.objects.get(id=payload['user_id'])
+    trading_pair = reference_data.trading_pair(payload['trading_pair_id'])
+
+    orders = OrderService().create_orders(
+        user=user,
+        trading_pair=trading_pair,
+        orders=[
+            {
+                'order_type': order['order_type'],
+                'side': order['side'],
+                'quantity': Decimal(order['quantity']),
+                'price': _decimal(order.get('price')),
+                'stop_price': _decimal(order.get('stop_price')),
+                'time_in_force': order.get('time_in_force', 'gtc'),
+                'post_only': order.get('post_only', False),
+                'expires_at': _datetime(order.get('expires_at')),
+                'display_quantity': _decimal(order.get('display_quantity')),
+                'order_id': _order_id(order.get('order_id')),
+            }
+            for order in payload['orders']
+        ]
+    )
+    return OrderSerializer(orders, many=True).data
+
+
+@command('cancel_order')
+def cancel_order(payload):
+    """Cancel a resting order"""
+    order = Order.objects.get(id=payload['order_id'])
+    order.trading_pair = reference_data.trading_pair(order.trading_pair_id)
+
+    OrderService().cancel_order(order)
+    return OrderSerializer(order).data
+
+
+@command('amend_order')
+def amend_order(payload):
+    """Change the quantity or price of a resting limit order"""
+    order = Order.objects.get(id=payload['order_id'])
+    order.trading_pair = reference_data.trading_pair(order.trading_pair_id)
+
+    order = OrderService().amend_order(
+        order,
+        quantity=_decimal(payload.get('quantity')),
+        price=_decimal(payload.get('price'))
+    )
+    return OrderSerializer(order).data
+
+
+@command('cancel_orders')
+def cancel_orders(payload):
+    """Cancel all open orders of a user on one trading pair"""
+    user = User.objects.get(id=payload['user_id'])
+    trading_pair = reference_data.trading_pair(payload['trading_pair_id'])
+
+    cancelled = OrderService().cancel_orders(user, trading_pair, side=payload.get('side'))
+    return {'cancelled': cancelled}
+
+
+@command('expire_orders')
+def expire_orders(payload):
+    """Expire the due good-til-date orders of every book loaded here"""
+    service = OrderService()
+    for book in order_books.loaded():
+        # Read without the lock, so idle books without good-til-date orders
+        # cost no lock or transaction; one scheduled meanwhile is expired
+        # by the next run at the latest
+        if not book.expiries:
+            continue
+        service.expire_orders(book.trading_pair)
+    return {}
+
+
+@command('check_order_book')
+def check_order_book(payload):
+    """Compare a pair's book and OrderBook rows with its open orders"""
+    trading_pair = reference_data.trading_pair(payload['trading_pair_id'])
+
+    return consistency.check_order_book(trading_pair, repair=payload.get('repair', False))
+
+
+@command('reload_reference_data')
+def reload_reference_data(payload):
+    """Drop the cached pairs and currencies after an edit"""
+    reference_data.invalidate()
+    return {}
+
+
+@command('order_book_depth')
+def order_book_depth(payload):
+    """Read the order book grouped at one of the engine's tick sizes"""
+    trading_pair = reference_data.trading_pair(payload['trading_pair_id'])
+
+    tick = Decimal(payload['tick'])
+    depth = OrderService().get_grouped_depth(trading_pair, tick, payload.get('depth', 20))
+    return {
+        'tick': payload['tick'],
+        **{
+            side: [
+                {'price': format_amount(price), 'quantity': format_amount(quantity), 'order_count': order_count}
+                for price, quantity, order_count in buckets
+            ]
+            for side, buckets in depth.items()
+        },
+    }
@@ -0,0 +1,207 @@
+"""
+Consistency check of a resident order book against the database.
+
+The open orders of a pair are streamed from the database with a
+server-side cursor and folded into one digest per price level: the order
+count, the resting and the shown quantity, which differ by the hidden
+reserves of iceberg orders, and a checksum over the order ids and their
+remaining quantities. The same digests are built from the resident book
+and from the OrderBook table, and every level where they disagree is
+reported. Only the digests are held in memory, one per price level, so
+books with millions of resting orders are never loaded whole.
+
+The book's lock is held while its digests are built and the database
+queries are started, which pins the database snapshot they read to the
+same point between two match passes. Streaming the rows happens after the
+lock is released.
+
+Order rows are the source of truth. Repairing drops a diverged book and
+its journal snapshot, reloads it from the database and rewrites the
+OrderBook table from it.
+"""
+
+import hashlib
+import logging
+from contextlib import nullcontext
+from django.db import transaction
+from .engine import (
+    order_books, pending_stops_query, resting_orders_query, from_units, split_display, to_units
+)
+from .models import OrderBook
+from .services import OrderService
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip of the server-side cursor
+STREAM_CHUNK_SIZE = 5000
+
+# Key of the digest of the pending stop orders
+STOPS = ('stops', None)
+
+
+class LevelDigest:
+    """Order count, resting and shown quantity and checksum of one price level"""
+
+    __slots__ = ('count', 'lots', 'shown', 'checksum')
+
+    def __init__(self):
+        self.count = 0
+        self.lots = 0
+        self.shown = 0
+        self.checksum = 0
+
+    def add(self, order_id, lots, shown):
+        digest = hashlib.blake2b(
+            order_id.bytes + lots.to_bytes(16, 'big', signed=True), digest_size=8
+        ).digest()
+        self.count += 1
+        self.lots += lots
+        self.shown += shown
+        # A sum does not depend on the order the rows arrive in
+        self.checksum = (self.checksum + int.from_bytes(digest, 'big')) & 0xFFFFFFFFFFFFFFFF
+
+    def __eq__(self, other):
+        return (
+            (self.count, self.lots, self.shown, self.checksum)
+            == (other.count, other.lots, other.shown, other.checksum)
+        )
+
+    def summary(self):
+        return {
+            'order_count': self.count,
+            'quantity': str(from_units(self.lots)),
+            'shown_quantity': str(from_units(self.shown)),
+        }
+
+
+def book_digests(book):
+    """Digests of the resting orders and pending stops of a resident book"""
+    digests = {}
+    for book_side in (book.bids, book.asks):
+        for level in book_side.iter_levels():
+            digest = digests[(book_side.side, level.price)] = LevelDigest()
+            for entry in level.orders:
+                digest.add(entry.order.id, entry.lots + entry.hidden, entry.lots)
+
+    stops = digests[STOPS] = LevelDigest()
+    for order in book.stops.orders.values():
+        lots = to_units(order.remaining_quantity)
+        stops.add(order.id, lots, lots)
+    return digests
+
+
+def _stream_digests(digests, rows, side=None):
+    for row in rows:
+        if side is None:
+            key, (order_id, remaining, filled, display) = STOPS, row
+        else:
+            price, order_id, remaining, filled, display = row
+            key = (side, price)
+        digest = digests.get(key)
+        if digest is None:
+            digest = digests[key] = LevelDigest()
+        lots = to_units(remaining)
+        shown, _ = split_display(lots, to_units(display) if display else 0, to_units(filled))
+        digest.add(order_id, lots, shown)
+
+
+def check_order_book(trading_pair, repair=False):
+    """Compare the open orders of a pair with its book and OrderBook rows.
+
+    Returns JSON data with the number of orders read and the diverged
+    levels. A book that is not loaded in this process is skipped, only the
+    OrderBook table is checked then.
+    """
+    book = order_books.find(trading_pair.id)
+    database = {STOPS: LevelDigest()}
+
+    with transaction.atomic():
+        streams = [
+            (side, resting_orders_query(trading_pair, side).values_list(
+                'price', 'id', 'remaining_quantity', 'filled_quantity', 'display_quantity'
+            ).iterator(chunk_size=STREAM_CHUNK_SIZE))
+            for side in ('buy', 'sell')
+        ]
+        streams.append((None, pending_stops_query(trading_pair).values_list(
+            'id', 'remaining_quantity', 'filled_quantity', 'display_quantity'
+        ).iterator(chunk_size=STREAM_CHUNK_SIZE)))
+
+        with book.lock if book is not None else nullcontext():
+            # A book discarded while waiting for its lock is no longer used
+            if book is not None and order_books.find(trading_pair.id) is not book:
+                book = None
+            engine = book_digests(book) if book is not None else None
+            table = {
+                (side, price): (to_units(quantity), order_count)
+                for side, price, quantity, order_count in OrderBook.objects.filter(
+                    trading_pair=trading_pair
+                ).values_list('side', 'price', 'quantity', 'order_count')
+            }
+            # Start every query before the lock is released so they all
+            # read the state the book is in now
+            for side, rows in streams:
+                first = next(rows, None)
+                if first is not None:
+                    _stream_digests(database, [first], side)
+
+        for side, rows in streams:
+            _stream_digests(database, rows, side)
+
+    divergences = []
+    if engine is not None:
+        for key in sorted(database.keys() | engine.keys(), key=str):
+            expected = database.get(key)
+            found = engine.get(key)
+            if expected is None or found is None or expected != found:
+                divergences.append(_divergence('book', key, expected, found))
+
+    for key in sorted((database.keys() | table.keys()) - {STOPS}, key=str):
+        expected = database.get(key)
+        row = table.get(key)
+        # The table shows what the book shows, without hidden reserves
+        if expected is None or row is None or row != (expected.shown, expected.count):
+            found = {'order_count': row[1], 'shown_quantity': str(from_units(row[0]))} if row is not None else None
+            divergences.append(_divergence('table', key, expected, found))
+
+    result = {
+        'trading_pair_id': trading_pair.id,
+        'loaded': book is not None,
+        'orders': sum(digest.count for digest in database.values()),
+        'levels': len(database) - 1,
+        'divergences': divergences,
+        'repaired': False,
+    }
+    if divergences:
+        logger.warning(
+            f"Order book of pair {trading_pair.id} diverges from the database at "
+            f"{len(divergences)} levels"
+        )
+        if repair:
+            repair_order_book(trading_pair, reload=any(item['kind'] == 'book' for item in divergences))
+            result['repaired'] = True
+    return result
+
+
+def repair_order_book(trading_pair, reload=True):
+    """Reload a pair's book from the database and rewrite its OrderBook rows"""
+    if reload:
+        book = order_books.find(trading_pair.id)
+        if book is not None:
+            with book.lock:
+                if order_books.find(trading_pair.id) is book:
+                    # Keep the next load from recovering the same state
+                    if book.journal is not None:
+                        book.journal.invalidate()
+                    order_books.discard(trading_pair.id)
+    OrderService().resync_order_book(trading_pair)
+
+
+def _divergence(kind, key, expected, found):
+    side, price = key
+    return {
+        'kind': kind,
+        'side': side,
+        'price': str(price) if price is not None else None,
+        'database': expected.summary() if expected is not None else None,
+        'found': found.summary() if isinstance(found, LevelDigest) else found,
+    }
@@ -0,0 +1,835 @@
+"""
+In-memory matching engine.
+
+Each trading pair gets a resident order book made of sorted price levels,
+every level holding a FIFO queue of resting limit orders. Matching walks the
+best levels of the opposite side directly, so the database is only used to
+persist the results of a match pass.
+
+Inside the book, prices and quantities are integers counting units of
+10^-8, the scale of the decimal fields they are stored in, so comparisons
+and depth sums in the match loop are plain integer arithmetic. Decimals are
+converted on the way in and out of the book's methods.
+
+Iceberg orders show only a slice of their quantity, counted in whole
+display quantities from the start of the order. The rest is a hidden
+reserve that refills the slice, at the back of its level's queue, each time
+the slice is filled. Depth views and the OrderBook table count shown
+quantity only, while matching and the depth sums used to price and check
+incoming orders count the hidden reserves as well.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from decimal import Decimal
+from django.conf import settings
+from .models import (
+    Order, Trade, OPEN_ORDER_STATUSES, RESTING_ORDER_TYPES, STOP_ORDER_TYPES
+)
+
+# Decimal places of the price and quantity fields of Order
+AMOUNT_PLACES = 8
+AMOUNT_SCALE = Decimal(1).scaleb(-AMOUNT_PLACES)
+
+
+def to_units(value):
+    """Convert a price or quantity to integer units, rounding toward zero"""
+    return int(value.scaleb(AMOUNT_PLACES))
+
+
+def from_units(units, places=AMOUNT_PLACES):
+    """Convert integer units back to a decimal with a fixed number of places"""
+    return Decimal(units).scaleb(-places)
+
+
+def format_amount(value):
+    """String of a price or quantity at the scale of the model fields"""
+    return format(value.quantize(AMOUNT_SCALE), 'f') if value is not None else None
+
+
+def split_display(lots, display, filled=0):
+    """Split an iceberg's remaining units into its shown slice and hidden reserve.
+
+    Slices are cut every ``display`` units from the start of the order, so
+    the shown slice is what is left of the current one and only depends on
+    the filled and remaining quantity, which the database has as well.
+    """
+    if not display or lots <= 0:
+        return lots, 0
+    shown = min(display - filled % display, lots)
+    return shown, lots - shown
+
+
+class BookEntry:
+    """A resting order queued at a price level.
+
+    ``lots`` is the quantity shown on the book; for iceberg orders the rest
+    is held in ``hidden`` and shown ``display`` units at a time. ``filled``
+    counts the units traded so far, which place the slices.
+    """
+
+    __slots__ = ('order', 'side', 'price', 'ticks', 'lots', 'hidden', 'display', 'filled')
+
+    def __init__(self, order, price, ticks, lots, display=0, filled=0):
+        self.order = order
+        self.side = order.side
+        self.price = price
+        self.ticks = ticks
+        self.display = display
+        self.filled = filled
+        self.lots, self.hidden = split_display(lots, display, filled)
+
+    @property
+    def remaining(self):
+        return from_units(self.lots + self.hidden)
+
+
+class Fill:
+    """A single execution produced by a match pass"""
+
+    __slots__ = ('maker', 'lots', 'level')
+
+    def __init__(self, maker, lots, level):
+        self.maker = maker
+        self.lots = lots
+        self.level = level
+
+    @property
+    def quantity(self):
+        return from_units(self.lots)
+
+    @property
+    def price(self):
+        return self.level.price
+
+
+class PriceLevel:
+    """FIFO queue of resting orders sharing one price"""
+
+    __slots__ = ('price', 'ticks', 'orders', 'lots', 'hidden')
+
+    def __init__(self, ticks):
+        self.price = from_units(ticks)
+        self.ticks = ticks
+        self.orders = deque()
+        # Shown quantity, and the hidden reserves of its iceberg orders
+        self.lots = 0
+        self.hidden = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    @property
+    def quantity(self):
+        return from_units(self.lots)
+
+
+class GroupedDepth:
+    """Depth of one book side aggregated into buckets of a coarser tick.
+
+    Bids are grouped down and asks up to the tick, so a grouped view never
+    shows a better price than the book actually has.
+    """
+
+    def __init__(self, side, tick):
+        self.side = side
+        self.tick = tick
+        self._tick_units = to_units(tick)
+        # Bucket price units -> [quantity units, order count]
+        self.buckets = {}
+        # Sort keys in ascending order with the best bucket at the end
+        self._keys = []
+
+    def _key(self, ticks):
+        return ticks if self.side == 'buy' else -ticks
+
+    def bucket_ticks(self, ticks):
+        if self.side == 'buy':
+            return ticks // self._tick_units * self._tick_units
+        return -(-ticks // self._tick_units) * self._tick_units
+
+    def bucket_price(self, price):
+        return from_units(self.bucket_ticks(to_units(price)))
+
+    def apply(self, ticks, lots, order_count):
+        """Add the quantity and order count change of a price level"""
+        bucket_ticks = self.bucket_ticks(ticks)
+        bucket = self.buckets.get(bucket_ticks)
+        if bucket is None:
+            bucket = self.buckets[bucket_ticks] = [0, 0]
+            insort(self._keys, self._key(bucket_ticks))
+
+        bucket[0] += lots
+        bucket[1] += order_count
+        if bucket[1] <= 0:
+            del self.buckets[bucket_ticks]
+            del self._keys[bisect_left(self._keys, self._key(bucket_ticks))]
+
+    def top(self, depth=None):
+        """Return (price, quantity, order count) of the best buckets"""
+        keys = reversed(self._keys)
+        if depth is not None:
+            keys = itertools.islice(keys, depth)
+        top = []
+        for key in keys:
+            ticks = key if self.side == 'buy' else -key
+            lots, order_count = self.buckets[ticks]
+            top.append((from_units(ticks), from_units(lots), order_count))
+        return top
+
+
+class BookSide:
+    """One side of an order book with its price levels kept sorted"""
+
+    def __init__(self, side, tick_sizes=()):
+        self.side = side
+        # Price units -> level
+        self.levels = {}
+        # Sort keys in ascending order with the best price at the end, so
+        # consuming the top of the book never shifts the rest of the list
+        self._keys = []
+        # Cumulative quantity and notional from the worst level up to each
+        # index, hidden reserves included. They are recomputed lazily from
+        # the lowest changed index, which is usually close to the best price.
+        self._cum_quantity = []
+        self._cum_notional = []
+        self._dirty_from = 0
+        # Grouped depth per tick size, updated with the change of each level
+        # since it was last counted
+        self.grouped = {tick: GroupedDepth(side, tick) for tick in tick_sizes}
+        self._grouped_levels = {}
+
+    def _key(self, ticks):
+        return ticks if self.side == 'buy' else -ticks
+
+    def __len__(self):
+        return len(self._keys)
+
+    def best_level(self):
+        """Return the best price level or None when the side is empty"""
+        if not self._keys:
+            return None
+        key = self._keys[-1]
+        return self.levels[key if self.side == 'buy' else -key]
+
+    def level_at(self, price):
+        return self.levels.get(to_units(price))
+
+    def get_or_create_level(self, ticks):
+        level = self.levels.get(ticks)
+        if level is None:
+            level = PriceLevel(ticks)
+            self.levels[ticks] = level
+            key = self._key(ticks)
+            index = bisect_left(self._keys, key)
+            self._keys.insert(index, key)
+            self._dirty_from = min(self._dirty_from, index)
+        return level
+
+    def remove_level(self, ticks):
+        del self.levels[ticks]
+        key = self._key(ticks)
+        index = bisect_left(self._keys, key)
+        del self._keys[index]
+        self._dirty_from = min(self._dirty_from, index)
+
+    def mark_changed(self, ticks):
+        """Invalidate the depth sums from the level at this price upwards"""
+        index = bisect_left(self._keys, self._key(ticks))
+        self._dirty_from = min(self._dirty_from, index)
+        if self.grouped:
+            self._regroup(ticks)
+
+    def _regroup(self, ticks):
+        level = self.levels.get(ticks)
+        lots, order_count = self._grouped_levels.pop(ticks, (0, 0))
+        if level is not None and level.orders:
+            self._grouped_levels[ticks] = (level.lots, len(level))
+            lots, order_count = level.lots - lots, len(level) - order_count
+        else:
+            lots, order_count = -lots, -order_count
+
+        if lots or order_count:
+            for grouped_depth in self.grouped.values():
+                grouped_depth.apply(ticks, lots, order_count)
+
+    def _refresh_depth(self):
+        start = self._dirty_from
+        if start >= len(self._keys) and len(self._cum_quantity) == len(self._keys):
+            return
+
+        del self._cum_quantity[start:]
+        del self._cum_notional[start:]
+        quantity = self._cum_quantity[-1] if start else 0
+        notional = self._cum_notional[-1] if start else 0
+        for key in self._keys[start:]:
+            level = self.levels[key if self.side == 'buy' else -key]
+            lots = level.lots + level.hidden
+            quantity += lots
+            notional += lots * level.ticks
+            self._cum_quantity.append(quantity)
+            self._cum_notional.append(notional)
+        self._dirty_from = len(self._keys)
+
+    def total_quantity(self):
+        self._refresh_depth()
+        return from_units(self._cum_quantity[-1] if self._cum_quantity else 0)
+
+    def quantity_within(self, limit_price):
+        """Total quantity resting at the limit price or better.
+
+        Levels at or better than the limit are the top of the sorted keys,
+        so this is one binary search in the cumulative quantities.
+        """
+        self._refresh_depth()
+        if not self._cum_quantity:
+            return from_units(0)
+        index = bisect_left(self._keys, self._key(to_units(limit_price)))
+        if not index:
+            return from_units(self._cum_quantity[-1])
+        return from_units(self._cum_quantity[-1] - self._cum_quantity[index - 1])
+
+    def cost_to_fill(self, quantity):
+        """Return the fillable quantity and its cost when taking from the best price.
+
+        Uses the cumulative depth sums, so the boundary level is found with
+        a binary search instead of walking the levels.
+        """
+        self._refresh_depth()
+        if not self._keys:
+            return from_units(0), from_units(0)
+
+        lots = to_units(quantity)
+        total_quantity = self._cum_quantity[-1]
+        total_notional = self._cum_notional[-1]
+        if lots >= total_quantity:
+            return from_units(total_quantity), from_units(total_notional, 2 * AMOUNT_PLACES)
+
+        # Levels above the boundary index are taken in full, the boundary
+        # level only partially
+        boundary = bisect_right(self._cum_quantity, total_quantity - lots)
+        full_quantity = total_quantity - self._cum_quantity[boundary]
+        full_notional = total_notional - self._cum_notional[boundary]
+        key = self._keys[boundary]
+        boundary_ticks = key if self.side == 'buy' else -key
+        notional = full_notional + (lots - full_quantity) * boundary_ticks
+        return from_units(lots), from_units(notional, 2 * AMOUNT_PLACES)
+
+    def iter_levels(self):
+        """Iterate price levels from the best price outwards"""
+        for key in reversed(self._keys):
+            yield self.levels[key if self.side == 'buy' else -key]
+
+
+class StopIndex:
+    """Untriggered stop orders, one heap per trigger direction.
+
+    Buy stops trigger when the price rises to their stop price, so they sit
+    in a min-heap; sell stops trigger when it falls to it and sit in a
+    max-heap. Evaluating a new trade price only pops the crossed stops.
+    """
+
+    def __init__(self):
+        self._buy_heap = []
+        self._sell_heap = []
+        self._sequence = itertools.count()
+        self.orders = {}
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def add(self, order):
+        sequence = next(self._sequence)
+        if order.side == 'buy':
+            heapq.heappush(self._buy_heap, (order.stop_price, sequence, order.id))
+        else:
+            heapq.heappush(self._sell_heap, (-order.stop_price, sequence, order.id))
+        self.orders[order.id] = order
+
+    def remove(self, order_id):
+        # Heap entries of removed orders are skipped lazily when popped
+        return self.orders.pop(order_id, None)
+
+    def pop_triggered(self, last_price):
+        """Remove and return the stops crossed by a trade price, oldest first"""
+        triggered = []
+        while self._buy_heap and self._buy_heap[0][0] <= last_price:
+            _, sequence, order_id = heapq.heappop(self._buy_heap)
+            if order_id in self.orders:
+                triggered.append((sequence, self.orders.pop(order_id)))
+        while self._sell_heap and -self._sell_heap[0][0] >= last_price:
+            _, sequence, order_id = heapq.heappop(self._sell_heap)
+            if order_id in self.orders:
+                triggered.append((sequence, self.orders.pop(order_id)))
+
+        triggered.sort(key=lambda item: item[0])
+        return [order for _, order in triggered]
+
+
+class TimerWheel:
+    """Hierarchical timing wheel of order expiries.
+
+    Level 0 has one slot per tick of ``resolution`` seconds, and each level
+    above covers ``slots`` slots of the one below. Deadlines are placed in
+    the lowest level that reaches them and moved down a level as the wheel
+    turns, so scheduling and expiring are constant time per order however
+    many are waiting. Deadlines beyond the top level wait in an overflow
+    list that is placed again every turn of the top level.
+
+    Items come out in the tick their deadline falls in, so the caller
+    checks the exact time. Orders that leave the book earlier are not
+    unscheduled; their ids come out of ``advance`` like any other and the
+    caller skips them.
+    """
+
+    def __init__(self, resolution=1, slots=64, levels=4, now=None):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow = []
+        self.due = []
+        self.current = int((time.time() if now is None else now) // resolution)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, deadline, item):
+        """Schedule an item for a POSIX timestamp"""
+        tick = int(deadline // self.resolution)
+        self._place(tick, item)
+        self.count += 1
+
+    def _place(self, tick, item):
+        if tick <= self.current:
+            self.due.append(item)
+            return
+        if tick - self.current < self.slots:
+            self.levels[0][tick % self.slots].append((tick, item))
+            return
+
+        span = self.slots
+        for level in self.levels[1:]:
+            if tick // span - self.current // span < self.slots:
+                level[tick // span % self.slots].append((tick, item))
+                return
+            span *= self.slots
+        self.overflow.append((tick, item))
+
+    def advance(self, now=None):
+        """Turn the wheel to a POSIX timestamp and return the items now due"""
+        target = int((time.time() if now is None else now) // self.resolution)
+        expired, self.due = self.due, []
+
+        while self.current < target:
+            if not self.count - len(expired):
+                # Nothing left to move down, so jump straight there
+                self.current = target
+                break
+
+            self.current += 1
+            self._cascade()
+            slot = self.levels[0][self.current % self.slots]
+            expired.extend(item for _, item in slot)
+            slot.clear()
+
+        self.count -= len(expired)
+        return expired
+
+    def _cascade(self):
+        """Move the deadlines of the slots reached on upper levels down"""
+        top_span = self.slots ** (len(self.levels) - 1)
+        if self.overflow and self.current % top_span == 0:
+            waiting, self.overflow = self.overflow, []
+            self._replace(waiting)
+
+        for depth in range(len(self.levels) - 1, 0, -1):
+            span = self.slots ** depth
+            if self.current % span == 0:
+                slot = self.levels[depth][self.current // span % self.slots]
+                waiting = slot[:]
+                slot.clear()
+                self._replace(waiting)
+
+    def _replace(self, waiting):
+        for tick, item in waiting:
+            if tick <= self.current:
+                # Due at this very tick: picked up with the level 0 slot
+                self.levels[0][tick % self.slots].append((tick, item))
+            else:
+                self._place(tick, item)
+
+
+class PairOrderBook:
+    """Resident price-time priority order book for one trading pair"""
+
+    def __init__(self, trading_pair, quantity_step=AMOUNT_SCALE, tick_sizes=()):
+        self.trading_pair = trading_pair
+        self.trading_pair_id = trading_pair.id
+        self.quantity_step = quantity_step
+        # Steps finer than the stored scale cannot occur in stored amounts
+        self.quantity_step_units = max(to_units(quantity_step), 1)
+        self.bids = BookSide('buy', tick_sizes)
+        self.asks = BookSide('sell', tick_sizes)
+        self.entries = {}
+        self.stops = StopIndex()
+        self.last_price = None
+        # Open order ids per user, resting or waiting for a stop trigger
+        self.user_orders = {}
+        # Ids of good-til-date orders by expiry time
+        self.expiries = TimerWheel()
+        # Bumped on every mutation so callers can tell whether a failed
+        # database transaction left the book out of sync
+        self.version = 0
+        self.lock = threading.RLock()
+        # Price levels changed since the OrderBook table was last written.
+        # A freshly loaded book has to be written out in full once.
+        self.touched_levels = set()
+        self.needs_full_sync = True
+        # Journal of this pair, if enabled, and the records of the current
+        # pass, written once its transaction commits
+        self.journal = None
+        self.journal_events = []
+        # Orders changed by the current pass and their fills, pushed to
+        # their owners once the pass commits
+        self.order_reports = {}
+        # Wallet changes of the current pass, settled together before it
+        # commits
+        self.settlement = None
+
+    def side(self, side):
+        return self.bids if side == 'buy' else self.asks
+
+    def opposite(self, side):
+        return self.asks if side == 'buy' else self.bids
+
+    def __contains__(self, order_id):
+        return order_id in self.entries
+
+    def add(self, order, price, remaining):
+        """Queue a resting order at the back of its price level"""
+        ticks = to_units(price)
+        display = to_units(order.display_quantity) if order.display_quantity else 0
+        entry = BookEntry(order, price, ticks, to_units(remaining), display, to_units(order.filled_quantity))
+        book_side = self.side(order.side)
+        level = book_side.get_or_create_level(ticks)
+        level.orders.append(entry)
+        level.lots += entry.lots
+        level.hidden += entry.hidden
+        book_side.mark_changed(ticks)
+        self.entries[order.id] = entry
+        self._index_user_order(order)
+        self._schedule_expiry(order)
+        self.touched_levels.add((order.side, ticks))
+        self.version += 1
+        return entry
+
+    def remove(self, order_id):
+        """Remove a resting order, returning its entry if it was on the book"""
+        entry = self.entries.pop(order_id, None)
+        if entry is None:
+            return None
+        self._unindex_user_order(entry.order)
+
+        book_side = self.side(entry.side)
+        level = book_side.levels[entry.ticks]
+        level.orders.remove(entry)
+        level.lots -= entry.lots
+        level.hidden -= entry.hidden
+        book_side.mark_changed(entry.ticks)
+        if not level.orders:
+            book_side.remove_level(entry.ticks)
+        self.touched_levels.add((entry.side, entry.ticks))
+        self.version += 1
+        return entry
+
+    def reduce(self, order_id, quantity, traded=False):
+        """Take quantity off a resting order, keeping its queue position.
+
+        Quantity ``traded`` by the order counts toward its filled slices:
+        an iceberg whose slice is traded up and refilled from its reserve
+        moves to the back of the queue, as it does when matched. A slice
+        that does not grow keeps its place.
+        """
+        entry = self.entries[order_id]
+        book_side = self.side(entry.side)
+        level = book_side.levels[entry.ticks]
+        lots_taken = to_units(quantity)
+        shown = entry.lots
+        if traded:
+            entry.filled += lots_taken
+            shown -= lots_taken
+        lots, hidden = split_display(entry.lots + entry.hidden - lots_taken, entry.display, entry.filled)
+        level.lots += lots - entry.lots
+        level.hidden += hidden - entry.hidden
+        entry.lots, entry.hidden = lots, hidden
+        if entry.lots <= 0:
+            level.orders.remove(entry)
+            del self.entries[order_id]
+            self._unindex_user_order(entry.order)
+        elif entry.lots > shown:
+            level.orders.remove(entry)
+            level.orders.append(entry)
+
+        book_side.mark_changed(entry.ticks)
+        if not level.orders:
+            book_side.remove_level(entry.ticks)
+        self.touched_levels.add((entry.side, entry.ticks))
+        self.version += 1
+        return entry
+
+    def add_stop(self, order):
+        """Park a stop order until the trade price crosses its stop price"""
+        self.stops.add(order)
+        self._index_user_order(order)
+        self._schedule_expiry(order)
+        self.version += 1
+
+    def remove_stop(self, order_id):
+        order = self.stops.remove(order_id)
+        if order is not None:
+            self._unindex_user_order(order)
+            self.version += 1
+        return order
+
+    def pop_triggered_stops(self):
+        """Return the stop orders triggered by the last trade price"""
+        if self.last_price is None or not self.stops:
+            return []
+        triggered = self.stops.pop_triggered(self.last_price)
+        for order in triggered:
+            self._unindex_user_order(order)
+        if triggered:
+            self.version += 1
+        return triggered
+
+    def pop_expired(self, now):
+        """Return the open orders whose expiry time has passed"""
+        expired = {}
+        for order_id in self.expiries.advance(now.timestamp()):
+            entry = self.entries.get(order_id)
+            order = entry.order if entry is not None else self.stops.orders.get(order_id)
+            # Orders filled or cancelled in the meantime are skipped
+            if order is None:
+                continue
+            if order.expires_at <= now:
+                expired[order_id] = order
+            else:
+                # Later in the current tick, so due again on the next call
+                self._schedule_expiry(order)
+        return list(expired.values())
+
+    def _schedule_expiry(self, order):
+        if order.expires_at is not None:
+            self.expiries.schedule(order.expires_at.timestamp(), order.id)
+
+    def open_orders_for_user(self, user_id, side=None):
+        """Return a user's resting and pending stop orders on this book"""
+        orders = []
+        for order_id in self.user_orders.get(user_id, ()):
+            entry = self.entries.get(order_id)
+            order = entry.order if entry is not None else self.stops.orders[order_id]
+            if side is None or order.side == side:
+                orders.append(order)
+        return orders
+
+    def _index_user_order(self, order):
+        self.user_orders.setdefault(order.user_id, set()).add(order.id)
+
+    def _unindex_user_order(self, order):
+        order_ids = self.user_orders.get(order.user_id)
+        if order_ids is not None:
+            order_ids.discard(order.id)
+            if not order_ids:
+                del self.user_orders[order.user_id]
+
+    def pop_touched_levels(self):
+        """Return and reset the set of (side, price) levels changed so far"""
+        touched = self.touched_levels
+        self.touched_levels = set()
+        return {(side, from_units(ticks)) for side, ticks in touched}
+
+    def match(self, side, quantity, limit_price=None, budget=None):
+        """Match an incoming order against the opposite side of the book.
+
+        ``budget`` caps the quote amount a buy order may spend. Returns the
+        list of fills in execution order. Resting orders that are fully
+        filled are removed from the book.
+        """
+        book_side = self.opposite(side)
+        fills = []
+        remaining = to_units(quantity)
+        limit = to_units(limit_price) if limit_price is not None else None
+        if budget is not None:
+            # In price units times quantity units, rounded down so the
+            # order never spends more than it was given
+            budget = int(budget.scaleb(2 * AMOUNT_PLACES))
+        step = self.quantity_step_units
+
+        while remaining > 0 and budget != 0:
+            level = book_side.best_level()
+            if level is None:
+                break
+            if limit is not None:
+                if side == 'buy' and level.ticks > limit:
+                    break
+                if side == 'sell' and level.ticks < limit:
+                    break
+
+            while remaining > 0 and level.orders:
+                entry = level.orders[0]
+                trade_lots = min(remaining, entry.lots)
+                if budget is not None:
+                    affordable = budget // level.ticks
+                    affordable -= affordable % step
+                    trade_lots = min(trade_lots, affordable)
+                    if trade_lots <= 0:
+                        budget = 0
+                        break
+                    budget -= trade_lots * level.ticks
+
+                entry.lots -= trade_lots
+                entry.filled += trade_lots
+                level.lots -= trade_lots
+                remaining -= trade_lots
+                fills.append(Fill(entry, trade_lots, level))
+
+                if entry.lots <= 0:
+                    level.orders.popleft()
+                    if entry.hidden:
+                        # Next slice of an iceberg, queued behind the
+                        # orders already waiting at this price
+                        entry.lots, entry.hidden = split_display(entry.hidden, entry.display, entry.filled)
+                        level.lots += entry.lots
+                        level.hidden -= entry.lots
+                        level.orders.append(entry)
+                    else:
+                        del self.entries[entry.order.id]
+                        self._unindex_user_order(entry.order)
+
+            self.touched_levels.add((book_side.side, level.ticks))
+            book_side.mark_changed(level.ticks)
+            if not level.orders:
+                book_side.remove_level(level.ticks)
+
+        if fills:
+            self.last_price = fills[-1].price
+            self.version += 1
+        return fills
+
+
+class OrderBookRegistry:
+    """Process-wide registry of resident order books, loaded on first use"""
+
+    def __init__(self):
+        self._books = {}
+        self._lock = threading.Lock()
+
+    def get(self, trading_pair):
+        book = self._books.get(trading_pair.id)
+        if book is not None:
+            return book
+
+        with self._lock:
+            book = self._books.get(trading_pair.id)
+            if book is None:
+                book = self._load(trading_pair)
+                self._books[trading_pair.id] = book
+            return book
+
+    def find(self, trading_pair_id):
+        """Return the book of a pair if it is loaded in this process"""
+        return self._books.get(trading_pair_id)
+
+    def loaded(self):
+        """Return the books loaded in this process"""
+        with self._lock:
+            return list(self._books.values())
+
+    def discard(self, trading_pair_id):
+        """Drop a book so that it is reloaded from the database on next use"""
+        with self._lock:
+            self._books.pop(trading_pair_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._books.clear()
+
+    def _load(self, trading_pair):
+        journal = None
+        if settings.MATCHING_JOURNAL_DIR:
+            from .journal import PairJournal
+
+            # Restart from the last snapshot and the journal tail when they
+            # agree with the database, instead of reading every open order
+            journal = PairJournal(trading_pair.id)
+            book = journal.recover(self._new_book(trading_pair))
+            if book is not None:
+                return book
+
+        book = self._new_book(trading_pair)
+
+        for side in ('buy', 'sell'):
+            for order in resting_orders_query(trading_pair, side).iterator():
+                # Share the pair instance so fills never lazy-load it per order
+                order.trading_pair = trading_pair
+                book.add(order, order.price, order.remaining_quantity)
+
+        for order in pending_stops_query(trading_pair).iterator():
+            order.trading_pair = trading_pair
+            book.add_stop(order)
+
+        book.last_price = Trade.objects.filter(
+            trading_pair=trading_pair
+        ).order_by('-created_at').values_list('price', flat=True).first()
+
+        if journal is not None:
+            journal.write_snapshot(book)
+            book.journal = journal
+        return book
+
+    @staticmethod
+    def _new_book(trading_pair):
+        # Only ticks that are whole multiples of the pair's price step
+        price_step = Decimal(1).scaleb(-trading_pair.price_precision)
+        return PairOrderBook(
+            trading_pair,
+            quantity_step=Decimal(1).scaleb(-trading_pair.quantity_precision),
+            tick_sizes=[
+                tick for tick in settings.ORDER_BOOK_TICK_SIZES
+                if tick >= price_step and tick % price_step == 0
+            ]
+        )
+
+
+def resting_orders_query(trading_pair, side):
+    """Open orders resting on one side of the book, in price-time priority"""
+    return Order.objects.filter(
+        trading_pair=trading_pair,
+        side=side,
+        status__in=OPEN_ORDER_STATUSES,
+        order_type__in=RESTING_ORDER_TYPES
+    ).exclude(
+        # Stop-limit orders only rest on the book once triggered
+        order_type='stop_limit', triggered_at__isnull=True
+    ).order_by('-price' if side == 'buy' else 'price', 'created_at')
+
+
+def pending_stops_query(trading_pair):
+    """Open stop orders still waiting for their trigger price"""
+    return Order.objects.filter(
+        trading_pair=trading_pair,
+        status__in=OPEN_ORDER_STATUSES,
+        order_type__in=STOP_ORDER_TYPES,
+        triggered_at__isnull=True
+    ).order_by('created_at')
+
+
+order_books = OrderBookRegistry()
@@ -0,0 +1,268 @@
+"""
+Append-only matching journal and book snapshots.
+
+Every committed match pass appends its records (accepted orders, fills,
+resting orders, stop parks and triggers, amends, cancels) to a per-pair
+journal file, each with the next sequence number. Every
+``MATCHING_SNAPSHOT_INTERVAL`` records the whole book is written to a
+snapshot file, replaced atomically, and the journal is truncated.
+
+On restart a pair is rebuilt from its snapshot plus the journal records
+that follow it, then checked against the open orders in the database. When
+anything is missing or disagrees, the book is loaded from the database.
+Each journal must have a single writer, so it is only safe with sharded
+matching or a single process.
+"""
+
+import json
+import logging
+import os
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Count, Sum
+from .engine import resting_orders_query, pending_stops_query
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+
+def order_state(order):
+    """Current values of all concrete fields of an order"""
+    return {field.attname: getattr(order, field.attname) for field in Order._meta.concrete_fields}
+
+
+def _encode(value):
+    """JSON encoding of decimals, UUIDs and datetimes"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def restore_order(state, trading_pair):
+    """Rebuild an order instance as if it had been loaded from the database"""
+    fields = Order._meta.concrete_fields
+    order = Order.from_db(
+        Order.objects.db,
+        [field.attname for field in fields],
+        # Snapshots written before a field existed leave it at its default
+        [field.to_python(state.get(field.attname, field.get_default())) for field in fields]
+    )
+    order.trading_pair = trading_pair
+    return order
+
+
+def _decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+class PairJournal:
+    """Sequenced journal and snapshot files of one trading pair"""
+
+    def __init__(self, trading_pair_id, directory=None):
+        directory = directory or settings.MATCHING_JOURNAL_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, f'pair-{trading_pair_id}.journal')
+        self.snapshot_path = os.path.join(directory, f'pair-{trading_pair_id}.snapshot')
+        self.sequence = 0
+        self.snapshot_sequence = 0
+
+    def append(self, book, events, version):
+        """Append the records of a committed pass.
+
+        ``version`` is the book version at the end of the pass. A snapshot
+        is only taken while the book is still at that version, so it never
+        includes changes the journal has not recorded yet.
+        """
+        try:
+            with open(self.journal_path, 'a') as journal_file:
+                for event in events:
+                    self.sequence += 1
+                    event['seq'] = self.sequence
+                    journal_file.write(json.dumps(event, default=_encode, separators=(',', ':')) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+            due = self.sequence - self.snapshot_sequence >= settings.MATCHING_SNAPSHOT_INTERVAL
+            if due and book.version == version:
+                self.write_snapshot(book)
+        except OSError:
+            # The pass is already committed. Without its records the journal
+            # cannot be trusted, so force the next restart to use the database.
+            logger.exception(f"Failed to write matching journal {self.journal_path}")
+            self.invalidate()
+
+    def write_snapshot(self, book):
+        """Atomically replace the snapshot with the current book state"""
+        resting = []
+        for book_side in (book.bids, book.asks):
+            for level in book_side.iter_levels():
+                for entry in level.orders:
+                    resting.append({
+                        'order': order_state(entry.order),
+                        'price': str(entry.price),
+                        'remaining': str(entry.remaining),
+                    })
+
+        snapshot = {
+            'seq': self.sequence,
+            'last_price': str(book.last_price) if book.last_price is not None else None,
+            'resting': resting,
+            'stops': [order_state(order) for order in book.stops.orders.values()],
+        }
+
+        temporary_path = f'{self.snapshot_path}.tmp'
+        try:
+            with open(temporary_path, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file, default=_encode, separators=(',', ':'))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temporary_path, self.snapshot_path)
+
+            # Every record so far is covered by the snapshot
+            open(self.journal_path, 'w').close()
+            self.snapshot_sequence = self.sequence
+        except OSError:
+            logger.exception(f"Failed to write matching snapshot {self.snapshot_path}")
+            self.invalidate()
+
+    def recover(self, book):
+        """Rebuild a book from the snapshot and the journal tail.
+
+        Returns None if there is no usable snapshot, the journal has a gap,
+        or the result disagrees with the open orders in the database.
+        """
+        try:
+            with open(self.snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+
+        trading_pair = book.trading_pair
+        for item in snapshot['resting']:
+            order = restore_order(item['order'], trading_pair)
+            book.add(order, Decimal(item['price']), Decimal(item['remaining']))
+        for state in snapshot['stops']:
+            book.add_stop(restore_order(state, trading_pair))
+        book.last_price = _decimal(snapshot['last_price'])
+        self.sequence = self.snapshot_sequence = snapshot['seq']
+
+        # Orders accepted in the tail that are not on the book (yet)
+        in_flight = {}
+        offset = 0
+        try:
+            with open(self.journal_path, 'rb') as journal_file:
+                for line in journal_file:
+                    if not line.endswith(b'\n'):
+                        # Torn final write, cut so new records start on a fresh line
+                        os.truncate(self.journal_path, offset)
+                        break
+                    offset += len(line)
+                    event = json.loads(line)
+                    if event['seq'] <= self.sequence:
+                        continue
+                    if event['seq'] != self.sequence + 1:
+                        logger.warning(f"Gap in matching journal {self.journal_path}")
+                        return None
+                    self._apply(book, in_flight, event)
+                    self.sequence = event['seq']
+        except FileNotFoundError:
+            pass
+        except (KeyError, ValueError):
+            logger.exception(f"Unreadable matching journal {self.journal_path}")
+            return None
+
+        if not self._matches_database(book):
+            logger.warning(f"Matching journal of pair {trading_pair.id} is behind the database")
+            return None
+
+        book.journal = self
+        return book
+
+    def _apply(self, book, in_flight, event):
+        """Re-apply one journal record to a recovering book"""
+        event_type = event['type']
+        order_id = event.get('order_id')
+
+        if event_type == 'accept':
+            order = restore_order(event['order'], book.trading_pair)
+            in_flight[order.id] = order
+        elif event_type == 'fill':
+            maker_entry = book.entries[self._uuid(event['maker_id'])]
+            taker = in_flight[self._uuid(event['taker_id'])]
+            quantity = Decimal(event['quantity'])
+            executed_at = Order._meta.get_field('executed_at').to_python(event['executed_at'])
+
+            self._apply_fill(maker_entry.order, quantity, Decimal(event['maker_fee']), executed_at)
+            self._apply_fill(taker, quantity, Decimal(event['taker_fee']), executed_at)
+            book.reduce(maker_entry.order.id, quantity, traded=True)
+            book.last_price = Decimal(event['price'])
+        elif event_type == 'rest':
+            order = in_flight.pop(self._uuid(order_id))
+            book.add(order, Decimal(event['price']), order.remaining_quantity)
+        elif event_type == 'park':
+            book.add_stop(in_flight.pop(self._uuid(order_id)))
+        elif event_type == 'trigger':
+            order = book.remove_stop(self._uuid(order_id))
+            order.triggered_at = Order._meta.get_field('triggered_at').to_python(event['triggered_at'])
+            in_flight[order.id] = order
+        elif event_type == 'amend':
+            order = book.entries[self._uuid(order_id)].order
+            quantity = Decimal(event['quantity'])
+            remaining = quantity - order.filled_quantity
+            if event['requeue']:
+                # Matched again like a new order by the records that follow
+                book.remove(order.id)
+                in_flight[order.id] = order
+            else:
+                book.reduce(order.id, order.remaining_quantity - remaining)
+            order.quantity = quantity
+            order.price = Decimal(event['price'])
+            order.remaining_quantity = remaining
+        elif event_type == 'cancel':
+            order_id = self._uuid(order_id)
+            entry = book.remove(order_id)
+            order = entry.order if entry is not None else book.remove_stop(order_id)
+            in_flight.pop(order_id, None)
+            if order is not None:
+                # Records from before expiry have no status
+                order.status = event.get('status', 'cancelled')
+        else:
+            raise ValueError(f"Unknown journal record: {event_type}")
+
+    @staticmethod
+    def _apply_fill(order, quantity, fee, executed_at):
+        # Mirrors OrderService._execute_trade with the recorded fee
+        order.filled_quantity += quantity
+        order.remaining_quantity -= quantity
+        order.fee += fee
+        if order.remaining_quantity <= 0:
+            order.status = 'filled'
+            order.executed_at = executed_at
+        elif order.filled_quantity > 0:
+            order.status = 'partially_filled'
+
+    @staticmethod
+    def _uuid(value):
+        return Order._meta.pk.to_python(value)
+
+    def _matches_database(self, book):
+        """Compare order counts and resting quantity per side with the database"""
+        trading_pair = book.trading_pair
+        for book_side in (book.bids, book.asks):
+            totals = resting_orders_query(trading_pair, book_side.side).order_by().aggregate(
+                orders=Count('id'), quantity=Sum('remaining_quantity')
+            )
+            resting = sum(len(level) for level in book_side.levels.values())
+            if totals['orders'] != resting:
+                return False
+            if (totals['quantity'] or Decimal('0')) != book_side.total_quantity():
+                return False
+
+        return pending_stops_query(trading_pair).count() == len(book.stops)
+
+    def invalidate(self):
+        """Remove the snapshot so that the next restart loads the database"""
+        try:
+            os.remove(self.snapshot_path)
+        except FileNotFoundError:
+            pass
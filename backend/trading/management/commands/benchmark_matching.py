@@ -0,0 +1,213 @@
+import json
+import math
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from accounts.models import User
+from trading.engine import order_books
+from trading.models import Cryptocurrency, TradingPair, Trade
+from trading.reference import reference_data
+from trading.services import OrderService
+from trading.simulation import OrderFlowGenerator
+from wallet.models import Wallet
+
+
+class QueryCounter:
+    """Database execute wrapper counting the statements of each operation"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(values, scale=1):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) * scale,
+        'p50': percentile(values, 0.50) * scale,
+        'p99': percentile(values, 0.99) * scale,
+        'p999': percentile(values, 0.999) * scale,
+        'max': values[-1] * scale,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark OrderService against a synthetic order flow and report JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000, help='Number of flow steps to run')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--mid-price', default='50000')
+        parser.add_argument('--market-ratio', type=float, default=0.1)
+        parser.add_argument('--cancel-ratio', type=float, default=0.2)
+        parser.add_argument('--cross-ratio', type=float, default=0.2)
+        parser.add_argument('--warmup', type=int, default=500, help='Steps run before measuring')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        # Every pass commits as it does in production, so its commit and
+        # on-commit work (journal fsync, pushed order updates) is measured.
+        # That happens in a throwaway database, which leaves no users,
+        # orders or balances behind, and with a throwaway journal directory,
+        # whose pair ids cannot clash with the real journals.
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        journal_dir = tempfile.mkdtemp() if settings.MATCHING_JOURNAL_DIR else ''
+        trading_pair = None
+        try:
+            # Matched here, without dispatching to or notifying the shards
+            with override_settings(MATCHING_SHARDS=0, MATCHING_JOURNAL_DIR=journal_dir):
+                trading_pair, user_ids = self._setup(options)
+                report = self._run(trading_pair, user_ids, options)
+        finally:
+            if trading_pair is not None:
+                order_books.discard(trading_pair.id)
+            # The throwaway pair must not stay in the cache
+            reference_data.invalidate()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            if journal_dir:
+                shutil.rmtree(journal_dir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _setup(self, options):
+        base_currency = Cryptocurrency.objects.create(
+            symbol='ZZBENCH', name='Benchmark', name_fa='بنچمارک',
+            min_trade_amount=Decimal('0.0001')
+        )
+        quote_currency = Cryptocurrency.objects.create(
+            symbol='ZZQUOTE', name='Benchmark Quote', name_fa='بنچمارک',
+            min_trade_amount=Decimal('0.0001')
+        )
+        trading_pair = TradingPair.objects.create(
+            base_currency=base_currency,
+            quote_currency=quote_currency,
+            price_precision=2,
+            quantity_precision=4
+        )
+
+        users = User.objects.bulk_create([
+            User(
+                username=f'benchmark{i}',
+                email=f'benchmark{i}@benchmark.invalid',
+                phone_number=f'09{i:09d}',
+                first_name='Benchmark',
+                last_name=str(i)
+            )
+            for i in range(options['users'])
+        ])
+        balance = Decimal('1000000000')
+        Wallet.objects.bulk_create([
+            Wallet(user=user, cryptocurrency=currency, available_balance=balance)
+            for user in users
+            for currency in (base_currency, quote_currency)
+        ])
+
+        return trading_pair, [user.id for user in users]
+
+    def _run(self, trading_pair, user_ids, options):
+        service = OrderService()
+        users = User.objects.in_bulk(user_ids)
+        generator = OrderFlowGenerator(
+            trading_pair, user_ids, options['mid_price'],
+            seed=options['seed'],
+            market_ratio=options['market_ratio'],
+            cancel_ratio=options['cancel_ratio'],
+            cross_ratio=options['cross_ratio'],
+            min_quantity=Decimal('0.001'),
+            max_quantity=Decimal('2')
+        )
+
+        latencies = {'create': [], 'cancel': []}
+        queries = {'create': [], 'cancel': []}
+        rejected = {}
+        counter = QueryCounter()
+        trades_before = 0
+        measured_time = 0.0
+
+        with connection.execute_wrapper(counter):
+            for step in range(options['warmup'] + options['orders']):
+                if step == options['warmup']:
+                    trades_before = Trade.objects.filter(trading_pair=trading_pair).count()
+
+                action = generator.next_action()
+                counter.count = 0
+                started = time.perf_counter()
+                try:
+                    if action['action'] == 'cancel':
+                        service.cancel_order(action['order'])
+                    else:
+                        order = service.create_order(
+                            user=users[action['user_id']],
+                            trading_pair=trading_pair,
+                            order_type=action['order_type'],
+                            side=action['side'],
+                            quantity=action['quantity'],
+                            price=action['price']
+                        )
+                        if order.order_type == 'limit' and order.remaining_quantity > 0:
+                            generator.track(order)
+                except ValueError as error:
+                    if step >= options['warmup']:
+                        rejected[str(error)] = rejected.get(str(error), 0) + 1
+                    continue
+                elapsed = time.perf_counter() - started
+
+                if step >= options['warmup']:
+                    measured_time += elapsed
+                    latencies[action['action']].append(elapsed)
+                    queries[action['action']].append(counter.count)
+
+        trades = Trade.objects.filter(trading_pair=trading_pair).count() - trades_before
+        book = order_books.get(trading_pair)
+        operations = sum(len(values) for values in latencies.values())
+
+        return {
+            'database': connection.vendor,
+            'config': {
+                key: options[key]
+                for key in ('orders', 'users', 'seed', 'mid_price', 'market_ratio',
+                            'cancel_ratio', 'cross_ratio', 'warmup')
+            },
+            'operations': operations,
+            'rejected': rejected,
+            'trades': trades,
+            'elapsed_seconds': measured_time,
+            'throughput_per_second': operations / measured_time if measured_time else None,
+            'latency_ms': {
+                action: summarize(values, scale=1000) for action, values in latencies.items()
+            },
+            'queries': {
+                action: summarize(values) for action, values in queries.items()
+            },
+            'resting_orders': len(book.entries),
+            'bid_levels': len(book.bids.levels),
+            'ask_levels': len(book.asks.levels),
+        }
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from trading.models import TradingPair
+from trading.sharding import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Compare the resident order books and OrderBook rows with the open orders in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-pair', type=int, help='Trading pair id; defaults to every active pair')
+        parser.add_argument('--repair', action='store_true',
+                            help='Reload diverged books from the database and rewrite their OrderBook rows')
+
+    def handle(self, *args, **options):
+        pairs = TradingPair.objects.filter(is_active=True)
+        if options['trading_pair']:
+            pairs = TradingPair.objects.filter(id=options['trading_pair'])
+        if not pairs.exists():
+            raise CommandError("No trading pair found")
+
+        diverged = []
+        for trading_pair in pairs.order_by('id'):
+            # Run by the process owning the pair, where its book lives
+            result = dispatch(trading_pair.id, 'check_order_book', {
+                'trading_pair_id': trading_pair.id,
+                'repair': options['repair'],
+            })
+            summary = (
+                f"{trading_pair.symbol}: {result['orders']} orders, {result['levels']} levels"
+                + ("" if result['loaded'] else ", book not loaded")
+            )
+            if not result['divergences']:
+                self.stdout.write(self.style.SUCCESS(summary))
+                continue
+
+            self.stdout.write(self.style.ERROR(f"{summary}, {len(result['divergences'])} diverged"))
+            for item in result['divergences']:
+                self.stdout.write(
+                    f"  {item['kind']} {item['side']} {item['price'] or ''}: "
+                    f"database {item['database']}, found {item['found']}"
+                )
+            if result['repaired']:
+                self.stdout.write(self.style.WARNING(f"{trading_pair.symbol}: repaired"))
+            else:
+                diverged.append(trading_pair.symbol)
+
+        if diverged:
+            raise CommandError(f"Order books diverging from the database: {', '.join(diverged)}")
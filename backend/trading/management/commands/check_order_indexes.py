@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from trading.engine import resting_orders_query, pending_stops_query
+from trading.models import Order, TradingPair, OPEN_ORDER_STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Check that the open-order queries of the matching engine use their partial indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-pair', type=int, help='Trading pair id to plan the queries for')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Query plans can only be checked on PostgreSQL")
+
+        pairs = TradingPair.objects.all()
+        if options['trading_pair']:
+            pairs = pairs.filter(id=options['trading_pair'])
+        trading_pair = pairs.first()
+        if trading_pair is None:
+            raise CommandError("No trading pair found")
+
+        open_orders = Order.objects.filter(
+            trading_pair=trading_pair,
+            status__in=OPEN_ORDER_STATUSES
+        )
+        checks = [
+            ('book warm-up (bids)', resting_orders_query(trading_pair, 'buy'), 'order_open_bids_idx'),
+            ('book warm-up (asks)', resting_orders_query(trading_pair, 'sell'), 'order_open_asks_idx'),
+            ('pending stops', pending_stops_query(trading_pair), 'order_pending_stops_idx'),
+            ('mass cancel', open_orders.filter(user_id=0, side='buy'), 'order_open_user_idx'),
+        ]
+
+        failed = []
+        with transaction.atomic():
+            # Small tables are cheaper to scan sequentially, so disable that
+            # to check the indexes are usable rather than chosen by cost
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, queryset, index_name in checks:
+                plan = queryset.explain()
+                if index_name in plan:
+                    self.stdout.write(self.style.SUCCESS(f"{label}: {index_name}"))
+                else:
+                    failed.append(label)
+                    self.stdout.write(self.style.ERROR(f"{label}: {index_name} not used"))
+                    self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f"Queries not using their index: {', '.join(failed)}")
@@ -0,0 +1,179 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from trading.models import TradingPair, Trade
+from trading.replay import (
+    ReplayOrderService, events_from_database, events_from_file, serialize_event
+)
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded order flow of a trading pair through a detached matching engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-pair', type=int, required=True, help='Trading pair id')
+        parser.add_argument('--input', help='JSON lines event file; defaults to the database')
+        parser.add_argument('--since', help='ISO datetime of the first order to replay')
+        parser.add_argument('--until', help='ISO datetime to stop replaying at')
+        parser.add_argument('--export', help='Write the recorded events to this file and exit')
+        parser.add_argument('--trades', help='Write the replayed trades to this JSON lines file')
+        parser.add_argument('--states', help='Write book states to this JSON lines file')
+        parser.add_argument('--state-every', type=int, default=0,
+                            help='Events between book states; only the final state when 0')
+        parser.add_argument('--depth', type=int, default=20, help='Price levels per side in book states')
+        parser.add_argument('--compare', action='store_true',
+                            help='Compare the replayed trades with the recorded Trade table')
+
+    def handle(self, *args, **options):
+        trading_pair = TradingPair.objects.select_related(
+            'base_currency', 'quote_currency'
+        ).filter(id=options['trading_pair']).first()
+        if trading_pair is None:
+            raise CommandError("Trading pair not found")
+
+        if options['input']:
+            if options['compare'] or options['since'] or options['until']:
+                raise CommandError("--compare, --since and --until need the database as source")
+            events = events_from_file(options['input'])
+        else:
+            events = events_from_database(
+                trading_pair,
+                since=self._parse_datetime(options['since']),
+                until=self._parse_datetime(options['until'])
+            )
+
+        if options['export']:
+            count = 0
+            with open(options['export'], 'w') as export_file:
+                for event in events:
+                    export_file.write(json.dumps(serialize_event(event)) + '\n')
+                    count += 1
+            self.stdout.write(f"Exported {count} events")
+            return
+
+        trades_file = open(options['trades'], 'w') if options['trades'] else None
+        states_file = open(options['states'], 'w') if options['states'] else None
+        try:
+            report = self._replay(trading_pair, events, trades_file, states_file, options)
+        finally:
+            for output_file in (trades_file, states_file):
+                if output_file is not None:
+                    output_file.close()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _replay(self, trading_pair, events, trades_file, states_file, options):
+        service = ReplayOrderService(trading_pair)
+        counts = {'create': 0, 'amend': 0, 'cancel': 0, 'expire': 0, 'skipped': 0}
+        trade_count = 0
+        replayed_trades = [] if options['compare'] else None
+        state_every = options['state_every']
+
+        started = time.perf_counter()
+        for sequence, event in enumerate(events, start=1):
+            if service.apply(event):
+                counts[event['event']] += 1
+            else:
+                counts['skipped'] += 1
+
+            for trade in service.trades:
+                trade_count += 1
+                if trades_file is not None:
+                    trades_file.write(json.dumps(self._trade_data(trade, event)) + '\n')
+                if replayed_trades is not None:
+                    replayed_trades.append(self._trade_key(
+                        trade.maker_order.id, trade.taker_order.id, trade.quantity, trade.price
+                    ))
+            service.trades.clear()
+
+            if states_file is not None and state_every and sequence % state_every == 0:
+                state = service.book_state(options['depth'])
+                state['sequence'] = sequence
+                states_file.write(json.dumps(state) + '\n')
+        elapsed = time.perf_counter() - started
+
+        final_state = service.book_state(options['depth'])
+        if states_file is not None:
+            states_file.write(json.dumps(dict(final_state, sequence='final')) + '\n')
+
+        events_total = sum(counts.values())
+        report = {
+            'trading_pair': trading_pair.symbol,
+            'events': events_total,
+            'creates': counts['create'],
+            'amends': counts['amend'],
+            'cancels': counts['cancel'],
+            'expires': counts['expire'],
+            'skipped': counts['skipped'],
+            'trades': trade_count,
+            'elapsed_seconds': elapsed,
+            'events_per_second': events_total / elapsed if elapsed else None,
+            'book': final_state,
+        }
+        if replayed_trades is not None:
+            report['comparison'] = self._compare(trading_pair, replayed_trades, options)
+        return report
+
+    def _compare(self, trading_pair, replayed_trades, options):
+        """Find the first difference between replayed and recorded trades"""
+        recorded = Trade.objects.filter(trading_pair=trading_pair)
+        since = self._parse_datetime(options['since'])
+        until = self._parse_datetime(options['until'])
+        if since:
+            recorded = recorded.filter(taker_order__created_at__gte=since)
+        if until:
+            recorded = recorded.filter(created_at__lt=until)
+
+        recorded_count = 0
+        first_mismatch = None
+        rows = recorded.order_by('created_at', 'id').values_list(
+            'maker_order_id', 'taker_order_id', 'quantity', 'price'
+        ).iterator()
+        for index, row in enumerate(rows):
+            recorded_count += 1
+            replayed = replayed_trades[index] if index < len(replayed_trades) else None
+            recorded_trade = self._trade_key(*row)
+            if first_mismatch is None and replayed != recorded_trade:
+                first_mismatch = {'index': index, 'recorded': recorded_trade, 'replayed': replayed}
+
+        if first_mismatch is None and len(replayed_trades) > recorded_count:
+            first_mismatch = {
+                'index': recorded_count,
+                'recorded': None,
+                'replayed': replayed_trades[recorded_count],
+            }
+
+        return {
+            'recorded_trades': recorded_count,
+            'replayed_trades': len(replayed_trades),
+            'identical': first_mismatch is None,
+            'first_mismatch': first_mismatch,
+        }
+
+    @staticmethod
+    def _trade_key(maker_order_id, taker_order_id, quantity, price):
+        return [str(maker_order_id), str(taker_order_id), str(quantity.normalize()), str(price.normalize())]
+
+    @staticmethod
+    def _trade_data(trade, event):
+        return {
+            'maker_order_id': str(trade.maker_order.id),
+            'taker_order_id': str(trade.taker_order.id),
+            'price': str(trade.price),
+            'quantity': str(trade.quantity),
+            'maker_fee': str(trade.maker_fee),
+            'taker_fee': str(trade.taker_fee),
+            'timestamp': event['timestamp'].isoformat(),
+        }
+
+    @staticmethod
+    def _parse_datetime(value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid datetime: {value}")
+        return parsed
@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from crypto_platform.celery import app
+from trading.reference import reference_data
+from trading.sharding import queue_name
+from trading.tasks import execute_matching_command
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the single-process Celery worker that owns one matching shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shard', type=int, help='Shard number, from 0 to MATCHING_SHARDS - 1')
+        parser.add_argument('--loglevel', default='INFO')
+
+    def handle(self, *args, **options):
+        shard = options['shard']
+        if not 0 <= shard < settings.MATCHING_SHARDS:
+            raise CommandError(
+                f"Shard must be between 0 and {settings.MATCHING_SHARDS - 1}"
+            )
+
+        # Loaded before the worker starts so the first commands find it cached
+        reference_data.load()
+
+        threading.Thread(target=self._queue_expiries, args=(shard,), daemon=True).start()
+
+        # A shard must be consumed by exactly one process, one task at a
+        # time, so commands for a pair are applied in the order received
+        app.worker_main(argv=[
+            'worker',
+            '--queues', queue_name(shard),
+            '--concurrency', '1',
+            '--prefetch-multiplier', '1',
+            '--hostname', f'matching{shard}@%h',
+            '--loglevel', options['loglevel'],
+        ])
+
+    @staticmethod
+    def _queue_expiries(shard):
+        """Queue an expiry pass on this shard every ORDER_EXPIRY_INTERVAL seconds"""
+        # Queued rather than run here so it takes its turn with the other
+        # commands of the shard. Nobody reads the result, so none is stored
+        # for a task queued every interval.
+        while True:
+            time.sleep(settings.ORDER_EXPIRY_INTERVAL)
+            try:
+                execute_matching_command.apply_async(
+                    args=['expire_orders', {}], queue=queue_name(shard), ignore_result=True
+                )
+            except Exception:
+                logger.exception(f"Failed to queue order expiry on shard {shard}")
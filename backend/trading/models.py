@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 import uuid
@@ -95,6 +96,23 @@ class TradingPair(models.Model):
     price_precision = models.IntegerField(default=8, verbose_name="دقت قیمت")
     quantity_precision = models.IntegerField(default=8, verbose_name="دقت مقدار")
     
+    # Pre-trade risk limits, none when empty. The band is the largest
+    # fraction an order price may differ from the reference price.
+    price_band = models.DecimalField(
+        max_digits=5,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        verbose_name="محدوده مجاز قیمت"
+    )
+    max_order_notional = models.DecimalField(
+        max_digits=20,
+        decimal_places=8,
+        null=True,
+        blank=True,
+        verbose_name="حداکثر ارزش سفارش"
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -112,6 +130,13 @@ class TradingPair(models.Model):
         super().save(*args, **kwargs)
 
 
+# Orders in these statuses are still live in the matching engine
+OPEN_ORDER_STATUSES = ['pending', 'partially_filled']
+# Order types that can rest on the book (stop-limit once triggered)
+RESTING_ORDER_TYPES = ['limit', 'stop_limit']
+STOP_ORDER_TYPES = ['stop', 'stop_limit']
+
+
 class Order(models.Model):
     """Order model"""
     
@@ -133,6 +158,14 @@ class Order(models.Model):
         ('filled', 'اجرا شده'),
         ('cancelled', 'لغو شده'),
         ('rejected', 'رد شده'),
+        ('expired', 'منقضی شده'),
+    ]
+    
+    TIME_IN_FORCE = [
+        ('gtc', 'معتبر تا لغو'),
+        ('ioc', 'اجرای فوری یا لغو'),
+        ('fok', 'اجرای کامل یا لغو'),
+        ('gtd', 'معتبر تا تاریخ'),
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -142,6 +175,15 @@ class Order(models.Model):
     order_type = models.CharField(max_length=20, choices=ORDER_TYPES, verbose_name="نوع سفارش")
     side = models.CharField(max_length=10, choices=ORDER_SIDES, verbose_name="نوع معامله")
     status = models.CharField(max_length=20, choices=ORDER_STATUS, default='pending', verbose_name="وضعیت")
+    time_in_force = models.CharField(
+        max_length=3,
+        choices=TIME_IN_FORCE,
+        default='gtc',
+        verbose_name="اعتبار زمانی"
+    )
+    post_only = models.BooleanField(default=False, verbose_name="فقط سازنده")
+    # Good-til-date orders are expired by the matching engine at this time
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان انقضا")
     
     # Quantities and prices
     quantity = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="مقدار")
@@ -159,6 +201,14 @@ class Order(models.Model):
         blank=True,
         verbose_name="قیمت استاپ"
     )
+    # Iceberg orders show only this much of their quantity on the book
+    display_quantity = models.DecimalField(
+        max_digits=20,
+        decimal_places=8,
+        null=True,
+        blank=True,
+        verbose_name="مقدار نمایشی"
+    )
     
     filled_quantity = models.DecimalField(
         max_digits=20, 
@@ -187,16 +237,61 @@ class Order(models.Model):
         blank=True,
         verbose_name="ارز کارمزد"
     )
+    # Buy orders reserve quote currency for their fee at this rate on top
+    # of their cost, and are never charged more
+    reserved_fee_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=4,
+        default=Decimal('0'),
+        verbose_name="نرخ کارمزد رزرو شده"
+    )
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     executed_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان اجرا")
+    triggered_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان فعال‌سازی استاپ")
     
     class Meta:
         verbose_name = "سفارش"
         verbose_name_plural = "سفارشات"
         ordering = ['-created_at']
+        indexes = [
+            # Open orders are a small fraction of the table, so these are
+            # partial indexes ordered like the book scans for each side
+            models.Index(
+                fields=['trading_pair', 'price', 'created_at'],
+                condition=Q(
+                    side='sell',
+                    status__in=OPEN_ORDER_STATUSES,
+                    order_type__in=RESTING_ORDER_TYPES
+                ),
+                name='order_open_asks_idx'
+            ),
+            models.Index(
+                fields=['trading_pair', '-price', 'created_at'],
+                condition=Q(
+                    side='buy',
+                    status__in=OPEN_ORDER_STATUSES,
+                    order_type__in=RESTING_ORDER_TYPES
+                ),
+                name='order_open_bids_idx'
+            ),
+            models.Index(
+                fields=['trading_pair', 'created_at'],
+                condition=Q(
+                    status__in=OPEN_ORDER_STATUSES,
+                    order_type__in=STOP_ORDER_TYPES,
+                    triggered_at__isnull=True
+                ),
+                name='order_pending_stops_idx'
+            ),
+            models.Index(
+                fields=['user', 'trading_pair', 'side'],
+                condition=Q(status__in=OPEN_ORDER_STATUSES),
+                name='order_open_user_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.side} {self.quantity} {self.trading_pair.symbol}"
@@ -246,6 +341,32 @@ class Trade(models.Model):
         return f"{self.trading_pair.symbol} - {self.quantity} @ {self.price}"
 
 
+class OrderAmendment(models.Model):
+    """Change of an order's quantity or price, kept so its flow can be replayed"""
+    
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='amendments',
+        verbose_name="سفارش"
+    )
+    
+    previous_quantity = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="مقدار قبلی")
+    previous_price = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="قیمت قبلی")
+    quantity = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="مقدار")
+    price = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="قیمت")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "ویرایش سفارش"
+        verbose_name_plural = "ویرایش‌های سفارش"
+        ordering = ['created_at']
+    
+    def __str__(self):
+        return f"{self.order_id} - {self.quantity} @ {self.price}"
+
+
 class OrderBook(models.Model):
     """Order book model for real-time data"""
     
@@ -0,0 +1,81 @@
+"""
+Process-wide cache of trading pairs and cryptocurrencies.
+
+Order validation and matching read fees, precisions, trade limits and
+active flags from here instead of the database. Both tables are small, so
+they are loaded whole on first use and again after an invalidation or once
+``REFERENCE_DATA_TTL`` seconds have passed. Saving or deleting a pair or a
+currency invalidates the saving process and every matching shard when the
+transaction commits; the TTL bounds how stale any other process can be.
+
+Cached instances are shared, so callers must treat them as read-only.
+"""
+
+import threading
+import time
+from django.conf import settings
+from .models import Cryptocurrency, TradingPair
+
+
+class ReferenceDataRegistry:
+    """Trading pairs and cryptocurrencies by id, with currencies attached"""
+
+    def __init__(self):
+        self._data = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def trading_pair(self, trading_pair_id, active_only=False):
+        """Return a cached trading pair, raising DoesNotExist like a query"""
+        trading_pair = self._get(0, trading_pair_id)
+        if trading_pair is None or (active_only and not trading_pair.is_active):
+            raise TradingPair.DoesNotExist(f"Trading pair {trading_pair_id} does not exist")
+        return trading_pair
+
+    def trading_pairs(self, trading_pair_ids, active_only=False):
+        """Return the cached trading pairs among the given ids, by id"""
+        trading_pairs = {}
+        for trading_pair_id in trading_pair_ids:
+            trading_pair = self._get(0, trading_pair_id)
+            if trading_pair is not None and (trading_pair.is_active or not active_only):
+                trading_pairs[trading_pair.id] = trading_pair
+        return trading_pairs
+
+    def cryptocurrency(self, cryptocurrency_id, active_only=False):
+        """Return a cached cryptocurrency, raising DoesNotExist like a query"""
+        cryptocurrency = self._get(1, cryptocurrency_id)
+        if cryptocurrency is None or (active_only and not cryptocurrency.is_active):
+            raise Cryptocurrency.DoesNotExist(f"Cryptocurrency {cryptocurrency_id} does not exist")
+        return cryptocurrency
+
+    def load(self):
+        """Read both tables and replace the cached data"""
+        cryptocurrencies = Cryptocurrency.objects.in_bulk()
+        trading_pairs = TradingPair.objects.in_bulk()
+        for trading_pair in trading_pairs.values():
+            # Share the currency instances instead of loading them per pair
+            trading_pair.base_currency = cryptocurrencies[trading_pair.base_currency_id]
+            trading_pair.quote_currency = cryptocurrencies[trading_pair.quote_currency_id]
+
+        data = (trading_pairs, cryptocurrencies)
+        with self._lock:
+            self._data = data
+            self._loaded_at = time.monotonic()
+        return data
+
+    def invalidate(self):
+        """Drop the cached data so that the next lookup reloads it"""
+        with self._lock:
+            self._data = None
+
+    def _get(self, index, object_id):
+        data = self._data
+        if data is None or time.monotonic() - self._loaded_at > settings.REFERENCE_DATA_TTL:
+            data = self.load()
+        try:
+            return data[index].get(int(object_id))
+        except (TypeError, ValueError):
+            return None
+
+
+reference_data = ReferenceDataRegistry()
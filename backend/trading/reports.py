@@ -0,0 +1,79 @@
+"""
+Private order updates pushed to the owners of the orders.
+
+Every committed match pass publishes the final state of each order it
+changed, with the fills of that pass, to the channel group of the order's
+user. ``market.consumers.UserOrdersConsumer`` relays them to the user's
+WebSocket connections. Publishing is best effort: the pass is already
+committed, so a failure is logged and the order can still be read over
+the API.
+"""
+
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .engine import format_amount
+
+logger = logging.getLogger(__name__)
+
+
+def order_updates_group(user_id):
+    return f'orders_{user_id}'
+
+
+def order_report(order, trades=()):
+    """JSON data of an order's current state and the given fills of it"""
+    return {
+        'id': str(order.id),
+        'trading_pair_id': order.trading_pair_id,
+        'order_type': order.order_type,
+        'side': order.side,
+        'status': order.status,
+        'quantity': format_amount(order.quantity),
+        'price': format_amount(order.price),
+        'display_quantity': format_amount(order.display_quantity),
+        'filled_quantity': format_amount(order.filled_quantity),
+        'remaining_quantity': format_amount(order.remaining_quantity),
+        'fee': format_amount(order.fee),
+        'fills': [
+            {
+                'trade_id': str(trade.id),
+                'price': format_amount(trade.price),
+                'quantity': format_amount(trade.quantity),
+                'fee': format_amount(trade.maker_fee if trade.maker_order.id == order.id else trade.taker_fee),
+                'liquidity': 'maker' if trade.maker_order.id == order.id else 'taker',
+            }
+            for trade in trades
+        ],
+    }
+
+
+def publish_order_reports(reports):
+    """Send the (user id, report) pairs of one pass, one message per user"""
+    by_user = {}
+    for user_id, report in reports:
+        by_user.setdefault(user_id, []).append(report)
+
+    for user_id, orders in by_user.items():
+        _send(user_id, orders)
+
+
+def publish_order_rejection(order, error):
+    """Tell a user why an order accepted without waiting was rejected"""
+    report = order_report(order)
+    report['error'] = error
+    _send(order.user_id, [report])
+
+
+def _send(user_id, orders):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    try:
+        async_to_sync(channel_layer.group_send)(order_updates_group(user_id), {
+            'type': 'order_update',
+            'data': orders,
+        })
+    except Exception:
+        logger.exception(f"Failed to push order updates to user {user_id}")
@@ -0,0 +1,70 @@
+"""
+Pre-trade risk checks of the matching engine.
+
+Orders are checked inside their match pass, against the resident book and
+the cached trading pair and currency, so a check costs no queries:
+
+- the price must lie within the pair's ``price_band`` around the
+  reference price, the last trade price or else the middle of the book,
+- the notional must not exceed the pair's ``max_order_notional``,
+- the quantity must not exceed the base currency's ``max_trade_amount``,
+- a user may have at most ``MAX_OPEN_ORDERS_PER_PAIR`` open orders on a
+  pair, counted by the book.
+
+A failed check raises ValueError, which refuses the order like any other
+validation error of the pass.
+"""
+
+from django.conf import settings
+from .reference import reference_data
+
+
+def reference_price(book):
+    """Last trade price, or the middle of the book when nothing has traded"""
+    if book.last_price is not None:
+        return book.last_price
+
+    best_bid = book.bids.best_level()
+    best_ask = book.asks.best_level()
+    if best_bid is not None and best_ask is not None:
+        return (best_bid.price + best_ask.price) / 2
+    if best_bid is not None:
+        return best_bid.price
+    if best_ask is not None:
+        return best_ask.price
+    return None
+
+
+def check_order_limits(book, quantity, price=None, stop_price=None):
+    """Check an order's quantity, price and notional against the pair's limits"""
+    # Read through the cache so edits apply to books loaded before them
+    trading_pair = reference_data.trading_pair(book.trading_pair_id)
+
+    max_trade_amount = trading_pair.base_currency.max_trade_amount
+    if max_trade_amount is not None and quantity > max_trade_amount:
+        raise ValueError(f"مقدار نمی‌تواند بیشتر از {max_trade_amount} باشد")
+
+    reference = reference_price(book)
+    band = trading_pair.price_band
+    if band is not None and price is not None and reference is not None:
+        if not reference * (1 - band) <= price <= reference * (1 + band):
+            raise ValueError("قیمت سفارش خارج از محدوده مجاز است")
+
+    max_notional = trading_pair.max_order_notional
+    if max_notional is not None:
+        # Market orders are valued at the reference price
+        order_price = price or stop_price or reference
+        if order_price is not None and quantity * order_price > max_notional:
+            raise ValueError(f"ارزش سفارش نمی‌تواند بیشتر از {max_notional} باشد")
+
+
+def may_rest(order_type, time_in_force):
+    """Whether an order can stay open on the book after its pass"""
+    return order_type != 'market' and time_in_force not in ['ioc', 'fok']
+
+
+def check_open_orders(book, user_id, added=1):
+    """Check that a user can have ``added`` more open orders on this book"""
+    limit = settings.MAX_OPEN_ORDERS_PER_PAIR
+    if limit and len(book.user_orders.get(user_id, ())) + added > limit:
+        raise ValueError("تعداد سفارش‌های باز شما به حداکثر رسیده است")
@@ -1,6 +1,49 @@
 from rest_framework import serializers
 from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
 from .models import Cryptocurrency, TradingPair, Order, Trade, OrderBook, PriceHistory
+from .reference import reference_data
+
+def validate_execution_options(order_type, time_in_force, post_only, expires_at=None):
+    """Check time in force, expiry and post-only against the order type"""
+    if time_in_force in ['ioc', 'fok'] and order_type not in ['limit', 'market']:
+        raise serializers.ValidationError("اعتبار فوری فقط برای سفارش محدود و بازار مجاز است")
+    
+    if time_in_force == 'gtd':
+        if order_type == 'market':
+            raise serializers.ValidationError("سفارش بازار نمی‌تواند زمان انقضا داشته باشد")
+        if expires_at is None:
+            raise serializers.ValidationError("زمان انقضا برای سفارش معتبر تا تاریخ الزامی است")
+        if expires_at <= timezone.now():
+            raise serializers.ValidationError("زمان انقضا باید در آینده باشد")
+    elif expires_at is not None:
+        raise serializers.ValidationError("زمان انقضا فقط برای سفارش معتبر تا تاریخ مجاز است")
+    
+    if post_only and order_type != 'limit':
+        raise serializers.ValidationError("سفارش فقط سازنده باید از نوع محدود باشد")
+    
+    if post_only and time_in_force in ['ioc', 'fok']:
+        raise serializers.ValidationError("سفارش فقط سازنده نمی‌تواند فوری باشد")
+
+
+def validate_display_quantity(order_type, time_in_force, quantity, display_quantity):
+    """Check the shown slice of an iceberg order"""
+    if display_quantity is None:
+        return
+    
+    if order_type != 'limit':
+        raise serializers.ValidationError("سفارش کوه یخ باید از نوع محدود باشد")
+    
+    if time_in_force in ['ioc', 'fok']:
+        raise serializers.ValidationError("سفارش کوه یخ نمی‌تواند فوری باشد")
+    
+    if display_quantity <= 0:
+        raise serializers.ValidationError("مقدار نمایشی باید مثبت باشد")
+    
+    if display_quantity >= quantity:
+        raise serializers.ValidationError("مقدار نمایشی باید کمتر از مقدار سفارش باشد")
+
 
 class CryptocurrencySerializer(serializers.ModelSerializer):
     """Serializer for cryptocurrency"""
@@ -24,7 +67,8 @@ class TradingPairSerializer(serializers.ModelSerializer):
         model = TradingPair
         fields = [
             'id', 'symbol', 'base_currency', 'quote_currency', 'is_active',
-            'min_price', 'max_price', 'price_precision', 'quantity_precision'
+            'min_price', 'max_price', 'price_precision', 'quantity_precision',
+            'price_band', 'max_order_notional'
         ]
 
 
@@ -39,12 +83,13 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = [
             'id', 'user', 'trading_pair', 'trading_pair_id', 'order_type', 'side',
-            'status', 'quantity', 'price', 'stop_price', 'filled_quantity',
-            'remaining_quantity', 'fee', 'created_at', 'updated_at', 'executed_at'
+            'status', 'quantity', 'price', 'stop_price', 'display_quantity', 'time_in_force', 'post_only',
+            'expires_at', 'filled_quantity', 'remaining_quantity', 'fee', 'created_at', 'updated_at', 'executed_at',
+            'triggered_at'
         ]
         read_only_fields = [
             'id', 'user', 'status', 'filled_quantity', 'remaining_quantity',
-            'fee', 'created_at', 'updated_at', 'executed_at'
+            'fee', 'created_at', 'updated_at', 'executed_at', 'triggered_at'
         ]
     
     def validate(self, attrs):
@@ -55,7 +100,7 @@ class OrderSerializer(serializers.ModelSerializer):
         
         # Validate trading pair
         try:
-            trading_pair = TradingPair.objects.get(id=trading_pair_id, is_active=True)
+            trading_pair = reference_data.trading_pair(trading_pair_id, active_only=True)
             attrs['trading_pair'] = trading_pair
         except TradingPair.DoesNotExist:
             raise serializers.ValidationError("جفت معاملاتی نامعتبر است")
@@ -64,6 +109,15 @@ class OrderSerializer(serializers.ModelSerializer):
         if order_type in ['limit', 'stop_limit'] and not price:
             raise serializers.ValidationError("قیمت برای سفارش محدود الزامی است")
         
+        # Validate stop price for stop orders
+        if order_type in ['stop', 'stop_limit'] and not attrs.get('stop_price'):
+            raise serializers.ValidationError("قیمت استاپ برای سفارش استاپ الزامی است")
+        
+        validate_execution_options(
+            order_type, attrs.get('time_in_force', 'gtc'), attrs.get('post_only', False),
+            attrs.get('expires_at')
+        )
+        
         # Validate quantity
         if quantity <= 0:
             raise serializers.ValidationError("مقدار باید مثبت باشد")
@@ -73,6 +127,10 @@ class OrderSerializer(serializers.ModelSerializer):
                 f"مقدار نمی‌تواند کمتر از {trading_pair.base_currency.min_trade_amount} باشد"
             )
         
+        validate_display_quantity(
+            order_type, attrs.get('time_in_force', 'gtc'), quantity, attrs.get('display_quantity')
+        )
+        
         return attrs
 
 
@@ -85,6 +143,15 @@ class CreateOrderSerializer(serializers.Serializer):
     quantity = serializers.DecimalField(max_digits=20, decimal_places=8)
     price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
     stop_price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    time_in_force = serializers.ChoiceField(choices=Order.TIME_IN_FORCE, default='gtc')
+    post_only = serializers.BooleanField(default=False)
+    expires_at = serializers.DateTimeField(required=False, allow_null=True)
+    display_quantity = serializers.DecimalField(
+        max_digits=20, decimal_places=8, required=False, allow_null=True
+    )
+    # False acknowledges the order before it is matched; its fills are
+    # pushed on the private orders WebSocket
+    wait = serializers.BooleanField(default=True)
     
     def validate(self, attrs):
         # Same validation as OrderSerializer
@@ -94,7 +161,7 @@ class CreateOrderSerializer(serializers.Serializer):
         quantity = attrs.get('quantity')
         
         try:
-            trading_pair = TradingPair.objects.get(id=trading_pair_id, is_active=True)
+            trading_pair = reference_data.trading_pair(trading_pair_id, active_only=True)
             attrs['trading_pair'] = trading_pair
         except TradingPair.DoesNotExist:
             raise serializers.ValidationError("جفت معاملاتی نامعتبر است")
@@ -102,6 +169,14 @@ class CreateOrderSerializer(serializers.Serializer):
         if order_type in ['limit', 'stop_limit'] and not price:
             raise serializers.ValidationError("قیمت برای سفارش محدود الزامی است")
         
+        if order_type in ['stop', 'stop_limit'] and not attrs.get('stop_price'):
+            raise serializers.ValidationError("قیمت استاپ برای سفارش استاپ الزامی است")
+        
+        validate_execution_options(
+            order_type, attrs.get('time_in_force', 'gtc'), attrs.get('post_only', False),
+            attrs.get('expires_at')
+        )
+        
         if quantity <= 0:
             raise serializers.ValidationError("مقدار باید مثبت باشد")
         
@@ -110,9 +185,104 @@ class CreateOrderSerializer(serializers.Serializer):
                 f"مقدار نمی‌تواند کمتر از {trading_pair.base_currency.min_trade_amount} باشد"
             )
         
+        validate_display_quantity(
+            order_type, attrs.get('time_in_force', 'gtc'), quantity, attrs.get('display_quantity')
+        )
+        
         return attrs
 
 
+class BatchOrderItemSerializer(serializers.Serializer):
+    """Serializer for a single order of a batch"""
+    
+    trading_pair_id = serializers.IntegerField()
+    order_type = serializers.ChoiceField(choices=Order.ORDER_TYPES)
+    side = serializers.ChoiceField(choices=Order.ORDER_SIDES)
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=8)
+    price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    stop_price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    time_in_force = serializers.ChoiceField(choices=Order.TIME_IN_FORCE, default='gtc')
+    post_only = serializers.BooleanField(default=False)
+    expires_at = serializers.DateTimeField(required=False, allow_null=True)
+    display_quantity = serializers.DecimalField(
+        max_digits=20, decimal_places=8, required=False, allow_null=True
+    )
+    
+    def validate(self, attrs):
+        # Trading pair checks are done once for the whole batch
+        if attrs['order_type'] in ['limit', 'stop_limit'] and not attrs.get('price'):
+            raise serializers.ValidationError("قیمت برای سفارش محدود الزامی است")
+        
+        if attrs['order_type'] in ['stop', 'stop_limit'] and not attrs.get('stop_price'):
+            raise serializers.ValidationError("قیمت استاپ برای سفارش استاپ الزامی است")
+        
+        validate_execution_options(
+            attrs['order_type'], attrs['time_in_force'], attrs['post_only'], attrs.get('expires_at')
+        )
+        
+        if attrs['quantity'] <= 0:
+            raise serializers.ValidationError("مقدار باید مثبت باشد")
+        
+        validate_display_quantity(
+            attrs['order_type'], attrs['time_in_force'], attrs['quantity'], attrs.get('display_quantity')
+        )
+        
+        return attrs
+
+
+class BatchCreateOrderSerializer(serializers.Serializer):
+    """Serializer for placing several orders in one request"""
+    
+    orders = serializers.ListField(
+        child=BatchOrderItemSerializer(),
+        allow_empty=False,
+        max_length=settings.MAX_BATCH_ORDERS
+    )
+    
+    def validate_orders(self, orders):
+        pair_ids = {order['trading_pair_id'] for order in orders}
+        trading_pairs = reference_data.trading_pairs(pair_ids, active_only=True)
+        
+        for order in orders:
+            trading_pair = trading_pairs.get(order['trading_pair_id'])
+            if trading_pair is None:
+                raise serializers.ValidationError("جفت معاملاتی نامعتبر است")
+            order['trading_pair'] = trading_pair
+            
+            if order['quantity'] < trading_pair.base_currency.min_trade_amount:
+                raise serializers.ValidationError(
+                    f"مقدار نمی‌تواند کمتر از {trading_pair.base_currency.min_trade_amount} باشد"
+                )
+        
+        return orders
+
+
+class AmendOrderSerializer(serializers.Serializer):
+    """Serializer for changing the quantity or price of an open order"""
+    
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=8, required=False)
+    price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False)
+    
+    def validate(self, attrs):
+        if 'quantity' not in attrs and 'price' not in attrs:
+            raise serializers.ValidationError("مقدار یا قیمت جدید الزامی است")
+        
+        if attrs.get('quantity') is not None and attrs['quantity'] <= 0:
+            raise serializers.ValidationError("مقدار باید مثبت باشد")
+        
+        if attrs.get('price') is not None and attrs['price'] <= 0:
+            raise serializers.ValidationError("قیمت باید مثبت باشد")
+        
+        return attrs
+
+
+class MassCancelOrderSerializer(serializers.Serializer):
+    """Serializer for cancelling all open orders at once"""
+    
+    trading_pair_id = serializers.IntegerField(required=False)
+    side = serializers.ChoiceField(choices=Order.ORDER_SIDES, required=False)
+
+
 class TradeSerializer(serializers.ModelSerializer):
     """Serializer for trades"""
     
@@ -1,8 +1,27 @@
-from decimal import Decimal
+import operator
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+from functools import partial, reduce
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from .models import Order, Trade, OrderBook, TradingPair
-from wallet.services import WalletService
+from .engine import AMOUNT_SCALE, order_books
+from .journal import order_state
+from .models import Order, OrderAmendment, Trade, OrderBook, TradingPair
+from .reference import reference_data
+from .risk import check_open_orders, check_order_limits, may_rest
+from .reports import order_report, publish_order_reports
+from wallet.services import SettlementBatch, WalletService
+
+# Order fields changed by a fill, written back with bulk_update
+ORDER_FILL_FIELDS = [
+    'status', 'filled_quantity', 'remaining_quantity', 'fee', 'executed_at', 'updated_at'
+]
+
+# Headroom reserved on top of the estimated price of a market buy
+MARKET_ORDER_BUFFER = Decimal('1.01')
 
 class OrderService:
     """Service for handling order operations"""
@@ -10,15 +29,25 @@ class OrderService:
     def __init__(self):
         self.wallet_service = WalletService()
     
-    def create_order(self, user, trading_pair, order_type, side, quantity, price=None, stop_price=None):
-        """Create a new order"""
-        
-        with transaction.atomic():
+    def create_order(self, user, trading_pair, order_type, side, quantity, price=None, stop_price=None,
+                     time_in_force='gtc', post_only=False, expires_at=None, display_quantity=None,
+                     order_id=None):
+        """Create a new order, with ``order_id`` if one was handed out already"""
+        
+        with self._book_transaction(trading_pair) as book:
+            # Pre-trade risk checks, against the book and cached limits only
+            check_order_limits(book, quantity, price, stop_price)
+            if may_rest(order_type, time_in_force):
+                check_open_orders(book, user.id)
+            
             # Validate and reserve funds
-            self._validate_and_reserve_funds(user, trading_pair, side, quantity, price)
+            reserved_fee_rate = self._reserved_fee_rate(trading_pair, order_type, side)
+            reserved_amount = self._validate_and_reserve_funds(
+                user, book, side, quantity, price, stop_price, reserved_fee_rate
+            )
             
             # Create order
-            order = Order.objects.create(
+            order = Order(
                 user=user,
                 trading_pair=trading_pair,
                 order_type=order_type,
@@ -26,187 +55,651 @@ class OrderService:
                 quantity=quantity,
                 price=price,
                 stop_price=stop_price,
+                time_in_force=time_in_force,
+                post_only=post_only,
+                expires_at=expires_at,
+                display_quantity=display_quantity,
+                reserved_fee_rate=reserved_fee_rate,
                 remaining_quantity=quantity
             )
+            if order_id is not None:
+                order.id = order_id
+            order.save(force_insert=True)
             
-            # Try to match order immediately for market orders
-            if order_type == 'market':
-                self._match_market_order(order)
-            elif order_type == 'limit':
-                self._match_limit_order(order)
+            self._submit_order(order, book, reserved_amount)
             
             return order
     
+    def create_orders(self, user, trading_pair, orders):
+        """Create several orders for one trading pair in a single transaction.
+        
+        Funds are reserved once per currency for the whole batch, the orders
+        are inserted with one statement and then matched in sequence.
+        """
+        
+        with self._book_transaction(trading_pair) as book:
+            reserved_amounts = []
+            reserved_fee_rates = []
+            totals = {}
+            resting = 0
+            for order_data in orders:
+                check_order_limits(
+                    book, order_data['quantity'],
+                    order_data.get('price'), order_data.get('stop_price')
+                )
+                if may_rest(order_data['order_type'], order_data.get('time_in_force', 'gtc')):
+                    resting += 1
+                reserved_fee_rate = self._reserved_fee_rate(
+                    trading_pair, order_data['order_type'], order_data['side']
+                )
+                currency, amount = self._required_funds(
+                    book, order_data['side'], order_data['quantity'],
+                    order_data.get('price'), order_data.get('stop_price'), reserved_fee_rate
+                )
+                reserved_amounts.append(amount)
+                reserved_fee_rates.append(reserved_fee_rate)
+                totals[currency] = totals.get(currency, Decimal('0')) + amount
+            if resting:
+                check_open_orders(book, user.id, resting)
+            
+            for currency, total in totals.items():
+                if not self.wallet_service.has_sufficient_balance(user, currency, total):
+                    raise ValueError("موجودی کافی نیست")
+                book.settlement.reserve(user.id, currency.id, total, "Batch order reservation")
+            
+            created_orders = Order.objects.bulk_create([
+                Order(
+                    # Ids handed out before the batch was dispatched are kept
+                    id=order_data.get('order_id') or uuid.uuid4(),
+                    user=user,
+                    trading_pair=trading_pair,
+                    order_type=order_data['order_type'],
+                    side=order_data['side'],
+                    quantity=order_data['quantity'],
+                    price=order_data.get('price'),
+                    stop_price=order_data.get('stop_price'),
+                    time_in_force=order_data.get('time_in_force', 'gtc'),
+                    post_only=order_data.get('post_only', False),
+                    expires_at=order_data.get('expires_at'),
+                    display_quantity=order_data.get('display_quantity'),
+                    reserved_fee_rate=reserved_fee_rate,
+                    remaining_quantity=order_data['quantity']
+                )
+                for order_data, reserved_fee_rate in zip(orders, reserved_fee_rates)
+            ])
+            
+            for order, reserved_amount in zip(created_orders, reserved_amounts):
+                self._submit_order(order, book, reserved_amount)
+            
+            return created_orders
+    
     def cancel_order(self, order):
         """Cancel an existing order"""
         
-        with transaction.atomic():
+        with self._book_transaction(order.trading_pair) as book:
             if order.status not in ['pending', 'partially_filled']:
                 raise ValueError("سفارش قابل لغو نیست")
+            # Orders expired as this pass started are off the book already
+            if order.id not in book and order.id not in book.stops:
+                raise ValueError("سفارش قابل لغو نیست")
             
             # Release reserved funds
-            self._release_reserved_funds(order)
+            self._release_reserved_funds(book, order)
             
             # Update order status
             order.status = 'cancelled'
             order.save()
             
             # Update order book
-            self._update_order_book(order.trading_pair)
+            book.remove(order.id)
+            book.remove_stop(order.id)
+            self._journal(book, 'cancel', order_id=order.id)
+            self._report(book, order)
+    
+    def amend_order(self, order, quantity=None, price=None):
+        """Change the quantity or price of a resting limit order.
+        
+        ``quantity`` is the new total quantity, filled part included. A
+        smaller quantity at the same price keeps the order's place in its
+        queue; a new price or a larger quantity re-queues it behind the
+        orders already waiting, and at a new price it may trade right away.
+        Only the difference in reservation is reserved or released.
+        """
+        
+        with self._book_transaction(order.trading_pair) as book:
+            entry = book.entries.get(order.id)
+            if entry is None:
+                raise ValueError("فقط سفارش‌های محدود باز قابل ویرایش هستند")
+            # The resident instance holds the order's current state
+            order = entry.order
+            
+            new_quantity = order.quantity if quantity is None else quantity
+            new_price = order.price if price is None else price
+            new_remaining = new_quantity - order.filled_quantity
+            if new_remaining <= 0:
+                raise ValueError("مقدار جدید باید بیشتر از مقدار اجرا شده باشد")
+            if new_quantity == order.quantity and new_price == order.price:
+                raise ValueError("تغییری در سفارش داده نشده است")
+            if order.display_quantity is not None and order.display_quantity >= new_quantity:
+                raise ValueError("مقدار نمایشی باید کمتر از مقدار سفارش باشد")
+            check_order_limits(book, new_quantity, new_price)
+            
+            requeue = self._amendment_requeues(order, new_quantity, new_price)
+            if requeue and order.post_only and self._crosses_book(book, order.side, new_price):
+                raise ValueError("سفارش فقط سازنده با قیمت جدید فوراً اجرا می‌شود")
+            
+            # Reserve or release only the difference
+            currency, old_amount = self._open_reservation(order)
+            if order.side == 'buy':
+                new_amount = self._buy_reservation(new_remaining, new_price, order.reserved_fee_rate)
+            else:
+                new_amount = new_remaining
+            difference = new_amount - old_amount
+            if difference > 0:
+                if not self.wallet_service.has_sufficient_balance(order.user, currency, difference):
+                    raise ValueError("موجودی کافی نیست")
+                book.settlement.reserve(order.user_id, currency.id, difference, "Order amendment")
+            elif difference < 0:
+                book.settlement.add(order.user_id, currency.id, available=-difference, reserved=difference)
+            
+            self._apply_amendment(order, book, new_quantity, new_price)
+            
+            return order
+    
+    def _amendment_requeues(self, order, quantity, price):
+        """Whether an amendment costs a resting order its place in the queue"""
+        
+        return price != order.price or quantity - order.filled_quantity > order.remaining_quantity
+    
+    def _apply_amendment(self, order, book, quantity, price):
+        """Change a resting order on the book, matching it again if re-queued"""
+        
+        requeue = self._amendment_requeues(order, quantity, price)
+        remaining_quantity = quantity - order.filled_quantity
+        if requeue:
+            book.remove(order.id)
+        else:
+            book.reduce(order.id, order.remaining_quantity - remaining_quantity)
+        self._journal(
+            book, 'amend', order_id=order.id,
+            quantity=quantity, price=price, requeue=requeue
+        )
+        
+        previous_quantity, previous_price = order.quantity, order.price
+        order.quantity = quantity
+        order.price = price
+        order.remaining_quantity = remaining_quantity
+        self._record_amendment(order, previous_quantity, previous_price)
+        self._report(book, order)
+        
+        if requeue:
+            # Matched like an incoming limit order, resting again with
+            # whatever is left
+            self._match_limit_order(order, book, None)
+            self._process_stop_triggers(book)
+    
+    def _record_amendment(self, order, previous_quantity, previous_price):
+        """Save an amended order and the quantity and price it had before"""
+        
+        order.save(update_fields=['quantity', 'price', 'remaining_quantity', 'updated_at'])
+        OrderAmendment.objects.create(
+            order=order,
+            previous_quantity=previous_quantity,
+            previous_price=previous_price,
+            quantity=order.quantity,
+            price=order.price
+        )
+    
+    def cancel_orders(self, user, trading_pair, side=None):
+        """Cancel all open orders of a user on a trading pair.
+        
+        Orders are taken off the book in one pass, reserved funds are
+        released with one update per currency and the orders are marked
+        cancelled with a single UPDATE. Returns the number of cancelled orders.
+        """
+        
+        with self._book_transaction(trading_pair) as book:
+            orders = book.open_orders_for_user(user.id, side)
+            self._remove_open_orders(book, orders)
+            
+            # Only the rows of the orders taken off the book, whose
+            # reservations were released
+            return Order.objects.filter(id__in=[order.id for order in orders]).update(
+                status='cancelled', updated_at=timezone.now()
+            )
+    
+    def get_grouped_depth(self, trading_pair, tick, depth=20):
+        """Return the best bid and ask buckets of the book grouped at a tick size"""
+        
+        with self._locked_book(trading_pair) as book:
+            if tick not in book.bids.grouped:
+                raise ValueError("اندازه گروه‌بندی قیمت پشتیبانی نمی‌شود")
+            
+            return {
+                'bids': book.bids.grouped[tick].top(depth),
+                'asks': book.asks.grouped[tick].top(depth),
+            }
+    
+    def expire_orders(self, trading_pair):
+        """Expire the good-til-date orders of a pair whose time has passed.
+        
+        Every pass over a book expires its due orders as it starts, so this
+        only has work to do for books without other traffic.
+        """
+        
+        with self._book_transaction(trading_pair):
+            pass
+    
+    def _expire_orders(self, book):
+        """Take the orders due to expire off the book in one batch"""
+        
+        now = timezone.now()
+        orders = book.pop_expired(now)
+        if not orders:
+            return
+        
+        self._remove_open_orders(book, orders, status='expired')
+        Order.objects.filter(id__in=[order.id for order in orders]).update(
+            status='expired', updated_at=now
+        )
+    
+    def _remove_open_orders(self, book, orders, status='cancelled'):
+        """Take orders off the book and release their reservations in bulk"""
+        
+        for order in orders:
+            book.remove(order.id)
+            book.remove_stop(order.id)
+            self._journal(book, 'cancel', order_id=order.id, status=status)
+            # The rows themselves are updated by the caller
+            order.status = status
+            self._report(book, order)
+            
+            currency, amount = self._open_reservation(order)
+            if amount > 0:
+                book.settlement.add(order.user_id, currency.id, available=amount, reserved=-amount)
+    
+    @contextmanager
+    def _locked_book(self, trading_pair):
+        """Hold the lock of the book currently registered for a pair.
+        
+        A book discarded by a failed pass while this thread waited for its
+        lock no longer matches the database, so the wait is repeated on the
+        book loaded in its place.
+        """
+        
+        while True:
+            book = order_books.get(trading_pair)
+            with book.lock:
+                if order_books.find(trading_pair.id) is book:
+                    yield book
+                    return
+    
+    @contextmanager
+    def _book_transaction(self, trading_pair):
+        """Run a database transaction while holding the pair's book lock.
+        
+        Orders whose expiry time has passed are expired first, so they never
+        trade again. Wallet changes of the pass are collected in one
+        settlement batch and applied together, so the transaction locks its
+        wallets once and in canonical order. Price levels touched by the
+        pass are written to the OrderBook table before commit. If the
+        transaction fails after the in-memory book was mutated, the book is
+        dropped so it gets reloaded on next use.
+        """
+        
+        with self._locked_book(trading_pair) as book:
+            version = book.version
+            book.settlement = SettlementBatch()
+            try:
+                with transaction.atomic():
+                    self._expire_orders(book)
+                    yield book
+                    self.wallet_service.settle(book.settlement)
+                    self._update_order_book(trading_pair, book)
+                    self._flush_journal(book)
+                    self._flush_reports(book)
+            except Exception:
+                book.journal_events.clear()
+                book.order_reports.clear()
+                if book.version != version:
+                    order_books.discard(trading_pair.id)
+                raise
+            finally:
+                book.settlement = None
+    
+    def _journal(self, book, event_type, order=None, **data):
+        """Queue a journal record for the current pass"""
+        
+        if book.journal is None:
+            return
+        if order is not None:
+            data['order'] = order_state(order)
+        data['type'] = event_type
+        book.journal_events.append(data)
+    
+    def _flush_journal(self, book):
+        """Append the records of the pass to the journal once it commits"""
+        
+        if not book.journal_events:
+            return
+        events, book.journal_events = book.journal_events, []
+        transaction.on_commit(partial(book.journal.append, book, events, book.version))
+    
+    def _report(self, book, order, trade=None):
+        """Queue a private update of an order for the current pass"""
+        
+        if not settings.PUSH_ORDER_UPDATES:
+            return
+        trades = book.order_reports.setdefault(order.id, (order, []))[1]
+        if trade is not None:
+            trades.append(trade)
+    
+    def _flush_reports(self, book):
+        """Push the order updates of the pass to their owners once it commits"""
+        
+        if not book.order_reports:
+            return
+        # Built now, while the orders still hold the state of this pass
+        reports = [
+            (order.user_id, order_report(order, trades))
+            for order, trades in book.order_reports.values()
+        ]
+        book.order_reports = {}
+        transaction.on_commit(partial(publish_order_reports, reports))
+    
+    def _submit_order(self, order, book, reserved_amount):
+        """Run a newly created order through the matching engine"""
+        
+        self._report(book, order)
+        
+        refused_status = self._execution_refusal(order, book)
+        if refused_status:
+            # Never reaches the book, so its whole reservation is released
+            order.status = refused_status
+            self._persist_match(book, order, [], [], reserved_amount)
+            return
+        
+        self._journal(book, 'accept', order=order)
+        
+        # Try to match order immediately for market orders
+        if order.order_type == 'market':
+            self._match_market_order(order, book, reserved_amount)
+        elif order.order_type == 'limit':
+            self._match_limit_order(order, book, reserved_amount)
+        else:
+            self._place_stop_order(order, book)
+        
+        # Trades of this pass may have crossed pending stop orders
+        self._process_stop_triggers(book)
+    
+    def _execution_refusal(self, order, book):
+        """Return the status of an order whose conditions keep it from executing"""
+        
+        opposite_side = book.opposite(order.side)
+        
+        # Post-only orders must not take liquidity
+        if order.post_only and self._crosses_book(book, order.side, order.price):
+            return 'rejected'
+        
+        # Fill-or-kill orders need enough resting quantity within their price
+        if order.time_in_force == 'fok':
+            if order.price:
+                available_quantity = opposite_side.quantity_within(order.price)
+            else:
+                available_quantity = opposite_side.total_quantity()
+            if available_quantity < order.quantity:
+                return 'cancelled'
+        
+        return None
     
-    def _validate_and_reserve_funds(self, user, trading_pair, side, quantity, price):
+    def _crosses_book(self, book, side, price):
+        """Whether a limit order at this price would trade on arrival"""
+        
+        best_level = book.opposite(side).best_level()
+        if best_level is None:
+            return False
+        if side == 'buy':
+            return best_level.price <= price
+        return best_level.price >= price
+    
+    def _validate_and_reserve_funds(self, user, book, side, quantity, price, stop_price=None,
+                                    reserved_fee_rate=Decimal('0')):
         """Validate user has sufficient funds and reserve them"""
         
+        currency, required_amount = self._required_funds(
+            book, side, quantity, price, stop_price, reserved_fee_rate
+        )
+        
+        # Checked now so a refused order never touches the book; the
+        # settlement of the pass checks again under the wallet lock
+        if not self.wallet_service.has_sufficient_balance(user, currency, required_amount):
+            raise ValueError("موجودی کافی نیست")
+        
+        book.settlement.reserve(user.id, currency.id, required_amount, "Order reservation")
+        
+        return required_amount
+    
+    def _reserved_fee_rate(self, trading_pair, order_type, side):
+        """Fee rate a new buy order reserves quote currency for"""
+        
+        if side != 'buy':
+            return Decimal('0')
+        base_currency = reference_data.cryptocurrency(trading_pair.base_currency_id)
+        # Market orders only ever take, in the pass they arrive in; anything
+        # that can rest may end up paying either rate
+        if order_type == 'market':
+            return base_currency.taker_fee
+        return max(base_currency.maker_fee, base_currency.taker_fee)
+    
+    def _required_funds(self, book, side, quantity, price, stop_price=None, reserved_fee_rate=Decimal('0')):
+        """Return the currency and amount an order has to reserve"""
+        
+        trading_pair = book.trading_pair
         if side == 'buy':
-            # For buy orders, need quote currency
+            # For buy orders, need quote currency, fee included
             currency = trading_pair.quote_currency
             if price:
-                required_amount = quantity * price
+                required_amount = self._buy_reservation(quantity, price, reserved_fee_rate)
+            elif stop_price:
+                # Stop market orders are sized from their trigger price
+                required_amount = self._buy_reservation(
+                    quantity, stop_price * MARKET_ORDER_BUFFER, reserved_fee_rate
+                )
             else:
-                # For market orders, estimate based on current market price
-                last_trade = Trade.objects.filter(
-                    trading_pair=trading_pair
-                ).order_by('-created_at').first()
-                if not last_trade:
+                # Market buys reserve the exact cost of walking the resting
+                # asks, read from the book's cumulative depth, plus the taker
+                # fee on it. What the fill leaves unused is released with it.
+                fillable_quantity, cost = book.asks.cost_to_fill(quantity)
+                if not fillable_quantity:
                     raise ValueError("قیمت بازار موجود نیست")
-                required_amount = quantity * last_trade.price * Decimal('1.01')  # 1% buffer
+                required_amount = (cost * (1 + reserved_fee_rate)).quantize(AMOUNT_SCALE, rounding=ROUND_UP)
         else:
             # For sell orders, need base currency
             currency = trading_pair.base_currency
             required_amount = quantity
         
-        # Check and reserve funds
-        if not self.wallet_service.has_sufficient_balance(user, currency, required_amount):
-            raise ValueError("موجودی کافی نیست")
-        
-        self.wallet_service.reserve_funds(user, currency, required_amount, f"Order reservation")
+        return currency, required_amount
     
-    def _release_reserved_funds(self, order):
+    def _release_reserved_funds(self, book, order):
         """Release reserved funds when order is cancelled"""
         
-        if order.side == 'buy':
-            currency = order.trading_pair.quote_currency
-            if order.price:
-                amount = order.remaining_quantity * order.price
-            else:
-                # Calculate based on average fill price or market price
-                amount = order.remaining_quantity * order.price if order.price else Decimal('0')
-        else:
-            currency = order.trading_pair.base_currency
-            amount = order.remaining_quantity
+        currency, amount = self._open_reservation(order)
         
         if amount > 0:
-            self.wallet_service.release_reserved_funds(
-                order.user, currency, amount, f"Order {order.id} cancelled"
-            )
+            book.settlement.add(order.user_id, currency.id, available=amount, reserved=-amount)
+    
+    def _open_reservation(self, order):
+        """Return the currency and amount still reserved for an open order"""
+        
+        trading_pair = order.trading_pair
+        if order.order_type == 'market' or (order.order_type == 'stop' and order.triggered_at):
+            # Market executions release whatever they did not use right away
+            return None, Decimal('0')
+        
+        if order.side == 'sell':
+            return trading_pair.base_currency, order.remaining_quantity
+        price = order.price or order.stop_price * MARKET_ORDER_BUFFER
+        return (
+            trading_pair.quote_currency,
+            self._buy_reservation(order.remaining_quantity, price, order.reserved_fee_rate)
+        )
     
-    def _match_market_order(self, order):
-        """Match a market order against existing orders"""
+    def _buy_reservation(self, quantity, price, reserved_fee_rate):
+        """Quote amount reserved for buying ``quantity`` at ``price``, fee included"""
         
-        opposite_side = 'sell' if order.side == 'buy' else 'buy'
+        # Rounded up to the stored scale. Fills release the difference
+        # between the reservation before and after them, so the released
+        # parts always add up to what was reserved.
+        return (quantity * price * (1 + reserved_fee_rate)).quantize(AMOUNT_SCALE, rounding=ROUND_UP)
+    
+    def _place_stop_order(self, order, book):
+        """Park a stop order until the trade price crosses its stop price"""
         
-        # Get matching orders from order book
-        if order.side == 'buy':
-            matching_orders = Order.objects.filter(
-                trading_pair=order.trading_pair,
-                side=opposite_side,
-                status__in=['pending', 'partially_filled'],
-                order_type='limit'
-            ).order_by('price', 'created_at')
+        # A stop already crossed by the last price is triggered by the
+        # trigger pass that follows in the same transaction
+        book.add_stop(order)
+        self._journal(book, 'park', order_id=order.id)
+    
+    def _process_stop_triggers(self, book):
+        """Inject the stop orders crossed by the last trade price into the book"""
+        
+        # Each triggered order can trade and move the price again
+        triggered_orders = book.pop_triggered_stops()
+        while triggered_orders:
+            for order in triggered_orders:
+                self._trigger_stop_order(order, book)
+            triggered_orders = book.pop_triggered_stops()
+    
+    def _trigger_stop_order(self, order, book):
+        """Convert a triggered stop into a market or limit order and match it"""
+        
+        # Taken before triggering, while the stop still holds its reservation
+        _, reserved_amount = self._open_reservation(order)
+        
+        self._record_stop_trigger(order)
+        self._journal(book, 'trigger', order_id=order.id, triggered_at=order.triggered_at)
+        self._report(book, order)
+        
+        if order.order_type == 'stop':
+            self._match_market_order(order, book, reserved_amount)
         else:
-            matching_orders = Order.objects.filter(
-                trading_pair=order.trading_pair,
-                side=opposite_side,
-                status__in=['pending', 'partially_filled'],
-                order_type='limit'
-            ).order_by('-price', 'created_at')
+            self._match_limit_order(order, book, reserved_amount)
+    
+    def _record_stop_trigger(self, order):
+        """Mark a stop order as triggered"""
         
-        remaining_quantity = order.remaining_quantity
+        order.triggered_at = timezone.now()
+        Order.objects.filter(id=order.id).update(triggered_at=order.triggered_at)
+    
+    def _match_market_order(self, order, book, reserved_amount):
+        """Match a market order against the resident order book"""
         
-        for matching_order in matching_orders:
-            if remaining_quantity <= 0:
-                break
-            
-            # Calculate trade quantity
-            trade_quantity = min(remaining_quantity, matching_order.remaining_quantity)
-            trade_price = matching_order.price
-            
-            # Execute trade
-            self._execute_trade(order, matching_order, trade_quantity, trade_price)
-            
-            remaining_quantity -= trade_quantity
+        # Walk the best opposite levels with no price limit. A buy never
+        # spends more than it reserved, less the fee reserved on top.
+        budget = reserved_amount / (1 + order.reserved_fee_rate) if order.side == 'buy' else None
+        fills = book.match(order.side, order.remaining_quantity, budget=budget)
+        trades = self._build_trades(book, order, fills)
         
-        # Update order status
+        remaining_quantity = order.remaining_quantity
+        
+        # Update order status. Market orders never rest, so what they could
+        # not fill is cancelled like the rest of an immediate-or-cancel limit
+        # order, and the reservation it leaves is released with the pass.
         if remaining_quantity <= 0:
             order.status = 'filled'
-        elif remaining_quantity < order.quantity:
-            order.status = 'partially_filled'
+        elif remaining_quantity < order.quantity or order.time_in_force in ['ioc', 'fok']:
+            order.status = 'cancelled'
         else:
             order.status = 'rejected'  # No matching orders found
         
-        order.remaining_quantity = remaining_quantity
-        order.save()
+        self._persist_match(book, order, fills, trades, reserved_amount)
     
-    def _match_limit_order(self, order):
-        """Match a limit order against existing orders"""
+    def _match_limit_order(self, order, book, reserved_amount):
+        """Match a limit order against the resident order book"""
         
-        opposite_side = 'sell' if order.side == 'buy' else 'buy'
-        
-        # Get matching orders
-        if order.side == 'buy':
-            # Buy order matches with sell orders at or below the buy price
-            matching_orders = Order.objects.filter(
-                trading_pair=order.trading_pair,
-                side=opposite_side,
-                status__in=['pending', 'partially_filled'],
-                order_type='limit',
-                price__lte=order.price
-            ).order_by('price', 'created_at')
-        else:
-            # Sell order matches with buy orders at or above the sell price
-            matching_orders = Order.objects.filter(
-                trading_pair=order.trading_pair,
-                side=opposite_side,
-                status__in=['pending', 'partially_filled'],
-                order_type='limit',
-                price__gte=order.price
-            ).order_by('-price', 'created_at')
+        # Buy orders match asks at or below the limit price, sell orders
+        # match bids at or above it
+        fills = book.match(order.side, order.remaining_quantity, limit_price=order.price)
+        trades = self._build_trades(book, order, fills)
         
         remaining_quantity = order.remaining_quantity
         
-        for matching_order in matching_orders:
-            if remaining_quantity <= 0:
-                break
-            
-            trade_quantity = min(remaining_quantity, matching_order.remaining_quantity)
-            trade_price = matching_order.price  # Use maker's price
-            
-            self._execute_trade(matching_order, order, trade_quantity, trade_price)
-            
-            remaining_quantity -= trade_quantity
-        
         # Update order status
         if remaining_quantity <= 0:
             order.status = 'filled'
         elif remaining_quantity < order.quantity:
             order.status = 'partially_filled'
         
-        order.remaining_quantity = remaining_quantity
-        order.save()
+        if order.time_in_force in ['ioc', 'fok'] and order.status in ['pending', 'partially_filled']:
+            # Immediate-or-cancel orders never rest: the rest is cancelled
+            # and its reservation released in the same pass
+            order.status = 'cancelled'
+            self._persist_match(book, order, fills, trades, reserved_amount)
+        elif trades:
+            self._persist_match(book, order, fills, trades)
         
         # Add to order book if not fully filled
         if order.status in ['pending', 'partially_filled']:
-            self._update_order_book(order.trading_pair)
+            book.add(order, order.price, remaining_quantity)
+            self._journal(book, 'rest', order_id=order.id, price=order.price)
+    
+    def _build_trades(self, book, taker_order, fills):
+        """Apply the fills of a match pass to the orders and build their trades"""
+        
+        now = timezone.now()
+        trades = []
+        for fill in fills:
+            # Resting orders are always the maker side of the trade
+            trade = self._execute_trade(fill.maker.order, taker_order, fill.quantity, fill.price, now)
+            trades.append(trade)
+            self._report(book, fill.maker.order, trade)
+            self._report(book, taker_order, trade)
+            self._journal(
+                book, 'fill',
+                maker_id=trade.maker_order.id,
+                taker_id=taker_order.id,
+                quantity=trade.quantity,
+                price=trade.price,
+                maker_fee=trade.maker_fee,
+                taker_fee=trade.taker_fee,
+                executed_at=now
+            )
+        return trades
     
-    def _execute_trade(self, maker_order, taker_order, quantity, price):
-        """Execute a trade between two orders"""
+    def _persist_match(self, book, taker_order, fills, trades, reserved_amount=None):
+        """Write a whole match pass with one statement per table"""
+        
+        now = timezone.now()
+        touched_orders = {taker_order.id: taker_order}
+        for fill in fills:
+            touched_orders[fill.maker.order.id] = fill.maker.order
+        for touched_order in touched_orders.values():
+            touched_order.updated_at = now
         
-        # Calculate fees
-        maker_fee = quantity * price * maker_order.trading_pair.base_currency.maker_fee
-        taker_fee = quantity * price * taker_order.trading_pair.base_currency.taker_fee
+        Trade.objects.bulk_create(trades)
+        Order.objects.bulk_update(touched_orders.values(), ORDER_FILL_FIELDS)
         
-        # Create trade record
-        trade = Trade.objects.create(
+        # Update wallets
+        self._settle_match(book.settlement, taker_order, trades, reserved_amount)
+    
+    def _execute_trade(self, maker_order, taker_order, quantity, price, executed_at):
+        """Apply a trade between two orders and return the unsaved trade"""
+        
+        # Calculate fees, with rates current even for orders resting since
+        # before an edit of the currency
+        base_currency = reference_data.cryptocurrency(maker_order.trading_pair.base_currency_id)
+        # Rounded down to the stored scale, so the fee accounts are credited
+        # exactly what the users are charged and a buyer never pays more
+        # than it reserved
+        maker_fee = (
+            quantity * price * self._charged_fee_rate(maker_order, base_currency.maker_fee)
+        ).quantize(AMOUNT_SCALE, rounding=ROUND_DOWN)
+        taker_fee = (
+            quantity * price * self._charged_fee_rate(taker_order, base_currency.taker_fee)
+        ).quantize(AMOUNT_SCALE, rounding=ROUND_DOWN)
+        
+        # Build trade record, saved in bulk with the rest of the pass
+        trade = Trade(
             trading_pair=maker_order.trading_pair,
             maker_order=maker_order,
             taker_order=taker_order,
@@ -228,105 +721,170 @@ class OrderService:
         # Update order statuses
         if maker_order.remaining_quantity <= 0:
             maker_order.status = 'filled'
-            maker_order.executed_at = timezone.now()
+            maker_order.executed_at = executed_at
         elif maker_order.filled_quantity > 0:
             maker_order.status = 'partially_filled'
         
         if taker_order.remaining_quantity <= 0:
             taker_order.status = 'filled'
-            taker_order.executed_at = timezone.now()
+            taker_order.executed_at = executed_at
         elif taker_order.filled_quantity > 0:
             taker_order.status = 'partially_filled'
         
-        maker_order.save()
-        taker_order.save()
-        
-        # Update wallets
-        self._update_wallets_after_trade(trade)
-        
         return trade
     
-    def _update_wallets_after_trade(self, trade):
-        """Update user wallets after a trade"""
-        
-        base_currency = trade.trading_pair.base_currency
-        quote_currency = trade.trading_pair.quote_currency
+    def _charged_fee_rate(self, order, rate):
+        """Fee rate charged to an order, capped at the rate a buy reserved for"""
         
-        # Maker gets base currency (if selling) or gives base currency (if buying)
-        # Taker gives base currency (if buying) or gets base currency (if selling)
-        
-        if trade.maker_order.side == 'sell':
-            # Maker sells base currency, gets quote currency
-            self.wallet_service.transfer_funds(
-                trade.maker_order.user, base_currency, -trade.quantity,
-                f"Trade {trade.id} - Sell {base_currency.symbol}"
-            )
-            self.wallet_service.transfer_funds(
-                trade.maker_order.user, quote_currency, 
-                trade.quantity * trade.price - trade.maker_fee,
-                f"Trade {trade.id} - Receive {quote_currency.symbol}"
+        if order.side == 'buy':
+            return min(rate, order.reserved_fee_rate)
+        return rate
+    
+    def _settle_match(self, batch, taker_order, trades, reserved_amount=None):
+        """Add the wallet updates of a taker's trades to the pass's settlement"""
+        
+        trading_pair = taker_order.trading_pair
+        base_currency = trading_pair.base_currency
+        quote_currency = trading_pair.quote_currency
+        
+        # Remaining quantity of the limit buys before the trades of the pass
+        remaining = {}
+        for trade in trades:
+            for order in (trade.maker_order, trade.taker_order):
+                if order.side == 'buy' and order.price:
+                    remaining[order.id] = remaining.get(order.id, order.remaining_quantity) + trade.quantity
+        
+        used_amount = Decimal('0')
+        for trade in trades:
+            if trade.maker_order.side == 'buy':
+                buy_order, buyer_fee = trade.maker_order, trade.maker_fee
+                sell_order, seller_fee = trade.taker_order, trade.taker_fee
+            else:
+                buy_order, buyer_fee = trade.taker_order, trade.taker_fee
+                sell_order, seller_fee = trade.maker_order, trade.maker_fee
+            
+            notional = trade.quantity * trade.price
+            if buy_order.price:
+                # Limit buys reserved at their own price plus the fee, so
+                # any price improvement and unused fee go back to the
+                # available balance
+                before = remaining[buy_order.id]
+                remaining[buy_order.id] = before - trade.quantity
+                reserved_cost = (
+                    self._buy_reservation(before, buy_order.price, buy_order.reserved_fee_rate)
+                    - self._buy_reservation(before - trade.quantity, buy_order.price, buy_order.reserved_fee_rate)
+                )
+            else:
+                reserved_cost = notional
+            if buy_order is taker_order:
+                used_amount += reserved_cost
+            
+            # Seller delivers base currency out of its reservation, gets quote currency
+            batch.add(sell_order.user_id, base_currency.id, reserved=-trade.quantity)
+            batch.add(sell_order.user_id, quote_currency.id, available=notional - seller_fee)
+            
+            # Buyer gets base currency, pays quote currency and its fee out
+            # of its reservation, never out of spare balance
+            batch.add(buy_order.user_id, base_currency.id, available=trade.quantity)
+            batch.add(
+                buy_order.user_id, quote_currency.id,
+                available=reserved_cost - notional - buyer_fee,
+                reserved=-reserved_cost
             )
             
-            # Taker buys base currency, gives quote currency
-            self.wallet_service.transfer_funds(
-                trade.taker_order.user, base_currency, trade.quantity,
-                f"Trade {trade.id} - Buy {base_currency.symbol}"
+            # Both fees go to the exchange's fee account
+            batch.collect_fee(quote_currency.id, seller_fee + buyer_fee, trading_pair.id)
+            
+            metadata = {'trade_id': str(trade.id)}
+            batch.record(
+                sell_order.user_id, base_currency.id, -trade.quantity,
+                f"Trade {trade.id} - Sell {base_currency.symbol}", metadata=metadata
             )
-            self.wallet_service.transfer_funds(
-                trade.taker_order.user, quote_currency, 
-                -(trade.quantity * trade.price + trade.taker_fee),
-                f"Trade {trade.id} - Pay {quote_currency.symbol}"
+            batch.record(
+                sell_order.user_id, quote_currency.id, notional,
+                f"Trade {trade.id} - Receive {quote_currency.symbol}", metadata=metadata
             )
-        else:
-            # Maker buys base currency, gives quote currency
-            self.wallet_service.transfer_funds(
-                trade.maker_order.user, base_currency, trade.quantity,
-                f"Trade {trade.id} - Buy {base_currency.symbol}"
+            batch.record(
+                buy_order.user_id, base_currency.id, trade.quantity,
+                f"Trade {trade.id} - Buy {base_currency.symbol}", metadata=metadata
             )
-            self.wallet_service.transfer_funds(
-                trade.maker_order.user, quote_currency, 
-                -(trade.quantity * trade.price + trade.maker_fee),
-                f"Trade {trade.id} - Pay {quote_currency.symbol}"
+            batch.record(
+                buy_order.user_id, quote_currency.id, -notional,
+                f"Trade {trade.id} - Pay {quote_currency.symbol}", metadata=metadata
             )
+            for user_id, fee in ((sell_order.user_id, seller_fee), (buy_order.user_id, buyer_fee)):
+                if fee:
+                    batch.record(
+                        user_id, quote_currency.id, -fee,
+                        f"Trade {trade.id} - Fee", transaction_type='fee', metadata=metadata
+                    )
+        
+        # Orders that never rest on the book (market, immediate-or-cancel,
+        # refused) release whatever they reserved and did not use right away
+        if reserved_amount is not None:
+            if taker_order.side == 'buy':
+                currency = quote_currency
+            else:
+                currency = base_currency
+                used_amount = taker_order.filled_quantity
             
-            # Taker sells base currency, gets quote currency
-            self.wallet_service.transfer_funds(
-                trade.taker_order.user, base_currency, -trade.quantity,
-                f"Trade {trade.id} - Sell {base_currency.symbol}"
-            )
-            self.wallet_service.transfer_funds(
-                trade.taker_order.user, quote_currency, 
-                trade.quantity * trade.price - trade.taker_fee,
-                f"Trade {trade.id} - Receive {quote_currency.symbol}"
-            )
+            unused_amount = reserved_amount - used_amount
+            if unused_amount > 0:
+                batch.add(
+                    taker_order.user_id, currency.id,
+                    available=unused_amount, reserved=-unused_amount
+                )
     
-    def _update_order_book(self, trading_pair):
-        """Update order book aggregated data"""
+    def resync_order_book(self, trading_pair):
+        """Rewrite the whole OrderBook table of a pair from its book"""
         
-        # Clear existing order book data
-        OrderBook.objects.filter(trading_pair=trading_pair).delete()
-        
-        # Aggregate pending orders by price and side
-        pending_orders = Order.objects.filter(
-            trading_pair=trading_pair,
-            status__in=['pending', 'partially_filled'],
-            order_type='limit'
-        )
-        
-        # Group by side and price
-        from django.db.models import Sum, Count
-        
-        aggregated_orders = pending_orders.values('side', 'price').annotate(
-            total_quantity=Sum('remaining_quantity'),
-            order_count=Count('id')
-        )
-        
-        # Create order book entries
-        for order_data in aggregated_orders:
-            OrderBook.objects.create(
-                trading_pair=trading_pair,
-                side=order_data['side'],
-                price=order_data['price'],
-                quantity=order_data['total_quantity'],
-                order_count=order_data['order_count']
-            )
\ No newline at end of file
+        with self._locked_book(trading_pair) as book:
+            with transaction.atomic():
+                book.needs_full_sync = True
+                self._update_order_book(trading_pair, book)
+    
+    def _update_order_book(self, trading_pair, book):
+        """Write the price levels changed by a match pass to the OrderBook table"""
+        
+        if book.needs_full_sync:
+            # First write after loading the book: replace the whole table
+            OrderBook.objects.filter(trading_pair=trading_pair).delete()
+            book.pop_touched_levels()
+            book.needs_full_sync = False
+            touched_levels = [
+                (book_side.side, level.price)
+                for book_side in (book.bids, book.asks)
+                for level in book_side.iter_levels()
+            ]
+        else:
+            touched_levels = book.pop_touched_levels()
+        
+        upserts = []
+        removed = []
+        for side, price in touched_levels:
+            level = book.side(side).level_at(price)
+            if level:
+                upserts.append(OrderBook(
+                    trading_pair=trading_pair,
+                    side=side,
+                    price=price,
+                    quantity=level.quantity,
+                    order_count=len(level)
+                ))
+            else:
+                removed.append(Q(side=side, price=price))
+        
+        # Levels emptied by the pass are deleted, the rest upserted in place
+        if removed:
+            OrderBook.objects.filter(
+                reduce(operator.or_, removed),
+                trading_pair=trading_pair
+            ).delete()
+        
+        if upserts:
+            OrderBook.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=['trading_pair', 'side', 'price'],
+                update_fields=['quantity', 'order_count', 'updated_at']
+            )
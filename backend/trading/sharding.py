@@ -0,0 +1,119 @@
+"""
+Routing of matching work to single-writer shards.
+
+Every trading pair is owned by exactly one matching shard, chosen with a
+consistent hash ring so that changing the shard count only moves a small
+share of the pairs. Each shard is a Celery queue consumed by a single worker
+process, which makes that process the only writer of the pairs it owns.
+
+With ``MATCHING_SHARDS = 0`` commands run in the calling process instead,
+which is only allowed with ``MATCHING_IN_PROCESS`` since several processes
+would each match against their own copy of the books.
+"""
+
+import hashlib
+from bisect import bisect
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+VIRTUAL_NODES = 128
+
+
+class CommandTimeout(Exception):
+    """No result in time from a command that may still run on its shard"""
+
+
+class ConsistentHashRing:
+    """Consistent hash ring mapping keys to shard numbers"""
+
+    def __init__(self, shard_count, virtual_nodes=VIRTUAL_NODES):
+        self.shard_count = shard_count
+        self._points = []
+        self._shards = []
+
+        ring = sorted(
+            (self._hash(f"matching.{shard}#{replica}"), shard)
+            for shard in range(shard_count)
+            for replica in range(virtual_nodes)
+        )
+        for point, shard in ring:
+            self._points.append(point)
+            self._shards.append(shard)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def shard_for(self, key):
+        index = bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._shards[index]
+
+
+_ring = None
+
+
+def get_ring():
+    global _ring
+    if _ring is None or _ring.shard_count != settings.MATCHING_SHARDS:
+        _ring = ConsistentHashRing(settings.MATCHING_SHARDS)
+    return _ring
+
+
+def sharding_enabled():
+    return settings.MATCHING_SHARDS > 0
+
+
+def queue_name(shard):
+    return f"matching.{shard}"
+
+
+def shard_for_pair(trading_pair_id):
+    """Return the shard number owning a trading pair"""
+    return get_ring().shard_for(trading_pair_id)
+
+
+def queue_for_pair(trading_pair_id):
+    return queue_name(shard_for_pair(trading_pair_id))
+
+
+def dispatch(trading_pair_id, command, payload, wait=True):
+    """Run a matching command on the process that owns the trading pair.
+
+    Blocks for the command result unless ``wait`` is false. Errors raised
+    by the command are re-raised in the caller. Raises CommandTimeout when
+    the shard does not answer within ``MATCHING_COMMAND_TIMEOUT``; the
+    command is still queued or running then, so its outcome is unknown.
+    """
+    from . import commands
+
+    if not sharding_enabled():
+        if not settings.MATCHING_IN_PROCESS:
+            raise ImproperlyConfigured(
+                "In-process matching needs MATCHING_IN_PROCESS; use MATCHING_SHARDS with several processes"
+            )
+        return commands.execute(command, payload)
+
+    from celery.exceptions import TimeoutError
+    from .tasks import execute_matching_command
+
+    result = execute_matching_command.apply_async(
+        args=[command, payload],
+        queue=queue_for_pair(trading_pair_id)
+    )
+    if not wait:
+        return None
+    try:
+        return result.get(timeout=settings.MATCHING_COMMAND_TIMEOUT)
+    except TimeoutError:
+        raise CommandTimeout(f"Matching command {command} timed out on {queue_for_pair(trading_pair_id)}")
+
+
+def broadcast(command, payload):
+    """Queue a matching command on every shard without waiting for it"""
+    if not sharding_enabled():
+        return
+
+    from .tasks import execute_matching_command
+
+    for shard in range(settings.MATCHING_SHARDS):
+        execute_matching_command.apply_async(args=[command, payload], queue=queue_name(shard))
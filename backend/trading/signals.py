@@ -0,0 +1,23 @@
+"""
+Signal handlers of the trading app.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Cryptocurrency, TradingPair
+from .reference import reference_data
+from .sharding import broadcast
+
+
+def _reload_reference_data():
+    reference_data.invalidate()
+    broadcast('reload_reference_data', {})
+
+
+@receiver([post_save, post_delete], sender=TradingPair)
+@receiver([post_save, post_delete], sender=Cryptocurrency)
+def invalidate_reference_data(sender, **kwargs):
+    """Drop cached pairs and currencies once an edit is committed"""
+    # Queryset updates send no signal and are only picked up after the TTL
+    transaction.on_commit(_reload_reference_data)
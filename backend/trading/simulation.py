@@ -0,0 +1,103 @@
+"""
+Synthetic order flow for exercising the matching engine.
+
+The generator only produces order parameters, so the same flow can drive
+the service layer in a benchmark or a pure in-memory book.
+"""
+
+import math
+import random
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from .models import OPEN_ORDER_STATUSES
+
+
+class OrderFlowGenerator:
+    """Seeded random order flow around a random-walk mid price.
+
+    Each step is either a new order or the cancellation of one of the
+    orders the caller has handed back with ``track``. Limit prices are
+    placed a geometrically distributed number of ticks away from the mid,
+    and a share of them cross it so that they trade on arrival.
+    """
+
+    def __init__(self, trading_pair, user_ids, mid_price, seed=None,
+                 market_ratio=0.1, cancel_ratio=0.2, cross_ratio=0.2,
+                 volatility=0.0005, mean_depth_ticks=10,
+                 min_quantity=Decimal('0.001'), max_quantity=Decimal('1')):
+        self.user_ids = list(user_ids)
+        self.random = random.Random(seed)
+        self.market_ratio = market_ratio
+        self.cancel_ratio = cancel_ratio
+        self.cross_ratio = cross_ratio
+        self.volatility = volatility
+        self.mean_depth_ticks = mean_depth_ticks
+        self.min_quantity = min_quantity
+        self.max_quantity = max_quantity
+
+        self.tick = Decimal(1).scaleb(-trading_pair.price_precision)
+        self.quantity_step = Decimal(1).scaleb(-trading_pair.quantity_precision)
+        self.min_price = max(trading_pair.min_price, self.tick)
+        self.mid_price = self._to_tick(Decimal(mid_price))
+
+        self._tracked = []
+
+    def track(self, order):
+        """Make an order a candidate for later cancellation"""
+        self._tracked.append(order)
+
+    def next_action(self):
+        """Return the next step of the flow as a dict"""
+        self._walk()
+
+        if self._tracked and self.random.random() < self.cancel_ratio:
+            order = self._pop_tracked()
+            if order is not None:
+                return {'action': 'cancel', 'order': order}
+
+        side = self.random.choice(('buy', 'sell'))
+        order = {
+            'action': 'create',
+            'user_id': self.random.choice(self.user_ids),
+            'side': side,
+            'quantity': self._quantity(),
+            'price': None,
+        }
+        if self.random.random() < self.market_ratio:
+            order['order_type'] = 'market'
+        else:
+            order['order_type'] = 'limit'
+            order['price'] = self._limit_price(side)
+        return order
+
+    def _walk(self):
+        step = Decimal(str(math.exp(self.random.gauss(0, self.volatility))))
+        self.mid_price = max(self._to_tick(self.mid_price * step), self.min_price)
+
+    def _pop_tracked(self):
+        # Swap-remove a random tracked order, skipping ones already closed
+        while self._tracked:
+            index = self.random.randrange(len(self._tracked))
+            self._tracked[index], self._tracked[-1] = self._tracked[-1], self._tracked[index]
+            order = self._tracked.pop()
+            if order.status in OPEN_ORDER_STATUSES:
+                return order
+        return None
+
+    def _limit_price(self, side):
+        ticks = 1 + int(self.random.expovariate(1 / self.mean_depth_ticks))
+        if self.random.random() < self.cross_ratio:
+            ticks = -ticks
+        offset = self.tick * ticks
+        price = self.mid_price - offset if side == 'buy' else self.mid_price + offset
+        return max(price, self.min_price)
+
+    def _quantity(self):
+        # Log-uniform sizes: many small orders, a few large ones
+        low = math.log(self.min_quantity)
+        high = math.log(self.max_quantity)
+        quantity = Decimal(str(math.exp(self.random.uniform(low, high))))
+        quantity = quantity.quantize(self.quantity_step, rounding=ROUND_DOWN)
+        return max(quantity, self.quantity_step)
+
+    def _to_tick(self, price):
+        return price.quantize(self.tick, rounding=ROUND_HALF_UP)
@@ -0,0 +1,17 @@
+from celery import shared_task
+
+
+@shared_task(name='trading.execute_matching_command')
+def execute_matching_command(command, payload):
+    """Run a matching command inside the shard worker owning its pair"""
+    from . import commands
+    return commands.execute(command, payload)
+
+
+@shared_task(name='trading.check_order_books')
+def check_order_books():
+    """Queue a consistency check of every active pair on its owning process"""
+    from .models import TradingPair
+    from .sharding import dispatch
+    for trading_pair_id in TradingPair.objects.filter(is_active=True).values_list('id', flat=True):
+        dispatch(trading_pair_id, 'check_order_book', {'trading_pair_id': trading_pair_id}, wait=False)
@@ -0,0 +1,129 @@
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from wallet.models import Wallet
+from trading.engine import order_books, to_units
+from trading.models import Cryptocurrency, Order, TradingPair
+from trading.reference import reference_data
+from trading.services import OrderService
+
+User = get_user_model()
+
+
+def book_state(book):
+    """Queues of every level best price first, with the resting orders' state"""
+    levels = [
+        [
+            (
+                entry.order.id, entry.lots, entry.hidden, entry.order.status,
+                entry.order.filled_quantity, entry.order.remaining_quantity, entry.order.fee
+            )
+            for entry in level.orders
+        ]
+        for book_side in (book.bids, book.asks)
+        for level in book_side.iter_levels()
+    ]
+    return levels, sorted(book.stops.orders), book.last_price
+
+
+@override_settings(
+    MATCHING_SHARDS=0,
+    MATCHING_IN_PROCESS=True,
+    MATCHING_JOURNAL_DIR='',
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class TradingTestCase(TestCase):
+    """BTC/USDT pair, four funded users and a fresh resident book per test"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.btc = Cryptocurrency.objects.create(
+            symbol='BTC', name='Bitcoin', name_fa='بیت‌کوین',
+            maker_fee=Decimal('0.001'), taker_fee=Decimal('0.002')
+        )
+        cls.usdt = Cryptocurrency.objects.create(symbol='USDT', name='Tether', name_fa='تتر')
+        cls.pair = TradingPair.objects.create(
+            base_currency=cls.btc, quote_currency=cls.usdt, price_precision=2, quantity_precision=4
+        )
+        cls.users = []
+        for index in range(4):
+            user = User.objects.create(
+                username=f'trader{index}', email=f'trader{index}@example.com',
+                phone_number=f'0912000000{index}', first_name='Test', last_name='Trader'
+            )
+            Wallet.objects.create(user=user, cryptocurrency=cls.btc, available_balance=Decimal('100'))
+            Wallet.objects.create(user=user, cryptocurrency=cls.usdt, available_balance=Decimal('1000000'))
+            cls.users.append(user)
+
+    def setUp(self):
+        order_books.clear()
+        reference_data.invalidate()
+        self.addCleanup(order_books.clear)
+        self.service = OrderService()
+
+    def order(self, side, quantity, price=None, user=None, **fields):
+        """Unsaved limit order, for books used without the service"""
+        fields.setdefault('order_type', 'limit')
+        return Order(
+            user=user or self.users[0], trading_pair=self.pair, side=side,
+            quantity=Decimal(quantity), price=Decimal(price) if price else None,
+            remaining_quantity=Decimal(quantity), **fields
+        )
+
+    def queue(self, book, side, price):
+        """Order ids queued at a price, first in line first"""
+        level = book.side(side).levels[to_units(Decimal(price))]
+        return [entry.order.id for entry in level.orders]
+
+    def resident(self):
+        return order_books.get(self.pair)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def wallet(self, user, currency):
+        return Wallet.objects.get(user=user, cryptocurrency=currency)
+
+    def random_flow(self, count, seed):
+        """Limit, iceberg, market and stop orders with cancels and amendments"""
+        generator = random.Random(seed)
+        for _ in range(count):
+            user = generator.choice(self.users)
+            side = generator.choice(['buy', 'sell'])
+            quantity = Decimal(generator.randint(1, 40)) / 10
+            price = Decimal(generator.randint(9900, 10100)) / 100
+            action = generator.random()
+            try:
+                if action < 0.1:
+                    self.service.create_order(user, self.pair, 'market', side, quantity)
+                elif action < 0.15:
+                    last_price = self.resident().last_price or Decimal('100')
+                    offset = Decimal('0.5') if side == 'buy' else Decimal('-0.5')
+                    self.service.create_order(
+                        user, self.pair, 'stop', side, quantity, stop_price=last_price + offset
+                    )
+                elif action < 0.3 and self.resident().entries:
+                    order_id = generator.choice(list(self.resident().entries))
+                    self.service.cancel_order(Order.objects.get(id=order_id))
+                elif action < 0.4 and self.resident().entries:
+                    order = generator.choice(list(self.resident().entries.values())).order
+                    if generator.random() < 0.5:
+                        self.service.amend_order(order, quantity=order.quantity - Decimal('0.1'))
+                    else:
+                        self.service.amend_order(order, price=order.price + Decimal('0.5'))
+                else:
+                    display_quantity = None
+                    if quantity > 1 and generator.random() < 0.3:
+                        display_quantity = Decimal(generator.randint(1, 5)) / 10
+                    self.service.create_order(
+                        user, self.pair, 'limit', side, quantity, price,
+                        display_quantity=display_quantity
+                    )
+            except ValueError:
+                # Refused orders and amendments are part of the flow
+                pass
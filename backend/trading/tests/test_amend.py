@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+from .base import TradingTestCase
+
+
+class AmendTests(TradingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = (
+            self.service.create_order(user, self.pair, 'limit', 'sell', Decimal('2'), Decimal('101'))
+            for user in self.users[:2]
+        )
+
+    def test_lower_quantity_keeps_queue_position(self):
+        self.service.amend_order(self.first, quantity=Decimal('1'))
+
+        self.assertEqual(self.queue(self.resident(), 'sell', '101'), [self.first.id, self.second.id])
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('1'))
+
+    def test_higher_quantity_requeues(self):
+        self.service.amend_order(self.first, quantity=Decimal('3'))
+
+        self.assertEqual(self.queue(self.resident(), 'sell', '101'), [self.second.id, self.first.id])
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('3'))
+
+    def test_new_price_requeues_and_may_trade(self):
+        self.service.create_order(self.users[2], self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+
+        order = self.service.amend_order(self.second, price=Decimal('100'))
+
+        self.assertEqual(order.remaining_quantity, Decimal('1'))
+        self.assertEqual(self.queue(self.resident(), 'sell', '100'), [self.second.id])
+        self.assertEqual(self.queue(self.resident(), 'sell', '101'), [self.first.id])
+
+    def test_amendment_is_recorded(self):
+        self.service.amend_order(self.first, price=Decimal('102'))
+
+        amendment = self.first.amendments.get()
+        self.assertEqual(
+            (amendment.previous_quantity, amendment.previous_price, amendment.quantity, amendment.price),
+            (Decimal('2'), Decimal('101'), Decimal('2'), Decimal('102'))
+        )
+
+
+class AmendViewTests(TradingTestCase):
+
+    def patch(self, user, order, **data):
+        return self.client_for(user).patch(f'/api/trading/orders/{order.id}/amend/', data, format='json')
+
+    def test_order_is_amended_on_the_book(self):
+        order = self.service.create_order(self.users[0], self.pair, 'limit', 'sell', Decimal('2'), Decimal('101'))
+
+        response = self.patch(self.users[0], order, quantity='1.5', price='102')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['remaining_quantity']), Decimal('1.5'))
+        self.assertEqual(self.queue(self.resident(), 'sell', '102'), [order.id])
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('1.5'))
+
+    def test_another_users_order_is_not_found(self):
+        order = self.service.create_order(self.users[0], self.pair, 'limit', 'sell', Decimal('2'), Decimal('101'))
+
+        response = self.patch(self.users[1], order, quantity='1')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.resident().entries[order.id].order.remaining_quantity, Decimal('2'))
+
+    def test_stop_and_closed_orders_cannot_be_amended(self):
+        stop = self.service.create_order(
+            self.users[0], self.pair, 'stop', 'buy', Decimal('1'), stop_price=Decimal('110')
+        )
+        closed = self.service.create_order(self.users[0], self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+        self.service.cancel_order(closed)
+
+        for order in (stop, closed):
+            response = self.patch(self.users[0], order, quantity='0.5')
+            self.assertEqual(response.status_code, 400)
+
+    def test_refused_amendment_leaves_the_order(self):
+        order = self.service.create_order(self.users[0], self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+
+        # More than the buyer's quote balance can reserve
+        response = self.patch(self.users[0], order, quantity='20000')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.resident().entries[order.id].order.remaining_quantity, Decimal('1'))
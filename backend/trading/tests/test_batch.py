@@ -0,0 +1,61 @@
+import uuid
+from decimal import Decimal
+
+from wallet.models import Wallet
+from trading.models import Cryptocurrency, Order, TradingPair
+from .base import TradingTestCase
+
+
+class BatchOrderTests(TradingTestCase):
+
+    def post(self, user, orders):
+        return self.client_for(user).post('/api/trading/orders/batch/', {'orders': orders}, format='json')
+
+    def limit(self, side, quantity, price, trading_pair=None):
+        return {
+            'trading_pair_id': (trading_pair or self.pair).id, 'order_type': 'limit', 'side': side,
+            'quantity': quantity, 'price': price,
+        }
+
+    def test_batch_is_placed_in_order_and_matched(self):
+        response = self.post(self.users[0], [
+            self.limit('sell', '1', '101'), self.limit('buy', '1', '99'), self.limit('buy', '0.5', '101'),
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([order['status'] for order in response.data], ['partially_filled', 'pending', 'filled'])
+        ids = [uuid.UUID(order['id']) for order in response.data]
+        self.assertEqual(sorted(self.resident().entries), sorted(ids[:2]))
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('0.5'))
+
+    def test_batch_without_funds_for_every_order_places_none(self):
+        Wallet.objects.filter(user=self.users[0], cryptocurrency=self.btc).update(available_balance=Decimal('1.5'))
+
+        response = self.post(self.users[0], [self.limit('sell', '1', '101'), self.limit('sell', '1', '102')])
+
+        self.assertEqual(response.status_code, 207)
+        self.assertTrue(all('error' in result for result in response.data))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('0'))
+
+    def test_open_order_limit_counts_the_whole_batch(self):
+        with self.settings(MAX_OPEN_ORDERS_PER_PAIR=2):
+            self.post(self.users[0], [self.limit('sell', '1', '101')])
+
+            response = self.post(self.users[0], [self.limit('sell', '1', '102'), self.limit('sell', '1', '103')])
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_orders_of_another_pair_are_placed_apart(self):
+        eth = Cryptocurrency.objects.create(symbol='ETH', name='Ethereum', name_fa='اتریوم')
+        other_pair = TradingPair.objects.create(base_currency=eth, quote_currency=self.usdt)
+
+        response = self.post(self.users[0], [
+            self.limit('buy', '1', '100'), self.limit('sell', '1', '100', trading_pair=other_pair),
+        ])
+
+        # No ETH to sell: only the other pair's part of the batch fails
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data[0]['status'], 'pending')
+        self.assertIn('error', response.data[1])
@@ -0,0 +1,16 @@
+from django.test import SimpleTestCase
+
+from trading.management.commands.benchmark_matching import percentile
+
+
+class PercentileTests(SimpleTestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 11))
+
+        self.assertEqual(percentile(values, 0.5), 5)
+        self.assertEqual(percentile(values, 0.25), 3)
+        self.assertEqual(percentile(values, 0.99), 10)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([7], 0.999), 7)
+        self.assertIsNone(percentile([], 0.5))
@@ -0,0 +1,50 @@
+import uuid
+from decimal import Decimal
+
+from trading import commands
+from trading.models import Order
+from .base import TradingTestCase
+
+
+class CommandTests(TradingTestCase):
+    """Matching commands, with the JSON payloads views and shards pass around"""
+
+    def payload(self, user=None, **fields):
+        payload = {
+            'user_id': (user or self.users[0]).id,
+            'trading_pair_id': self.pair.id,
+            'order_type': 'limit',
+            'side': 'buy',
+            'quantity': '1',
+            'price': '100',
+            'order_id': str(uuid.uuid4()),
+        }
+        payload.update(fields)
+        return payload
+
+    def test_order_created_with_a_handed_out_id_can_be_cancelled_and_amended(self):
+        payload = self.payload()
+        commands.execute('create_order', payload)
+        other = commands.execute('create_order', self.payload(quantity='2'))
+
+        self.assertEqual(list(self.resident().entries), [uuid.UUID(payload['order_id']), uuid.UUID(other['id'])])
+        order = commands.execute('amend_order', {'order_id': payload['order_id'], 'quantity': '0.5'})
+        self.assertEqual(Decimal(order['remaining_quantity']), Decimal('0.5'))
+        self.assertEqual(commands.execute('check_order_book', {'trading_pair_id': self.pair.id})['divergences'], [])
+
+        order = commands.execute('cancel_order', {'order_id': payload['order_id']})
+        self.assertEqual(order['status'], 'cancelled')
+        self.assertEqual(commands.execute('check_order_book', {'trading_pair_id': self.pair.id})['divergences'], [])
+
+    def test_batch_orders_keep_their_handed_out_ids(self):
+        orders = [self.payload(price=price) for price in ('99', '100')]
+        commands.execute('create_orders', {
+            'user_id': self.users[0].id,
+            'trading_pair_id': self.pair.id,
+            'orders': orders,
+        })
+
+        self.assertEqual(sorted(self.resident().entries), sorted(uuid.UUID(order['order_id']) for order in orders))
+        commands.execute('cancel_order', {'order_id': orders[0]['order_id']})
+        self.assertEqual(Order.objects.get(id=orders[0]['order_id']).status, 'cancelled')
+        self.assertEqual(commands.execute('check_order_book', {'trading_pair_id': self.pair.id})['divergences'], [])
@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+from trading.engine import PairOrderBook
+from .base import TradingTestCase
+
+
+class OrderBookTests(TradingTestCase):
+
+    def test_depth_sums_count_hidden_reserves(self):
+        book = PairOrderBook(self.pair)
+        book.add(self.order('buy', '1', '100'), Decimal('100'), Decimal('1'))
+        iceberg = self.order('buy', '2.5', '100', display_quantity=Decimal('1'))
+        book.add(iceberg, Decimal('100'), Decimal('2.5'))
+        book.add(self.order('buy', '2', '99'), Decimal('99'), Decimal('2'))
+        book.add(self.order('sell', '1', '101'), Decimal('101'), Decimal('1'))
+        book.add(self.order('sell', '3', '102'), Decimal('102'), Decimal('3'))
+
+        self.assertEqual(book.bids.best_level().quantity, Decimal('2'))
+        self.assertEqual(book.bids.total_quantity(), Decimal('5.5'))
+        self.assertEqual(book.bids.quantity_within(Decimal('100')), Decimal('3.5'))
+        self.assertEqual(book.asks.cost_to_fill(Decimal('2')), (Decimal('2'), Decimal('203')))
+        self.assertEqual(book.asks.cost_to_fill(Decimal('10')), (Decimal('4'), Decimal('407')))
+
+    def test_orders_at_a_price_fill_first_in_first_out(self):
+        book = PairOrderBook(self.pair)
+        first, second, third = (self.order('buy', '1', '100') for _ in range(3))
+        for order in (first, second, third):
+            book.add(order, Decimal('100'), Decimal('1'))
+
+        fills = book.match('sell', Decimal('1.5'))
+
+        self.assertEqual(
+            [(fill.maker.order.id, fill.quantity) for fill in fills],
+            [(first.id, Decimal('1')), (second.id, Decimal('0.5'))]
+        )
+        self.assertEqual(self.queue(book, 'buy', '100'), [second.id, third.id])
+        self.assertEqual(book.bids.total_quantity(), Decimal('1.5'))
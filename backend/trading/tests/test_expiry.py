@@ -0,0 +1,52 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from trading.engine import PairOrderBook
+from trading.management.commands.run_matching_worker import Command
+from trading.models import Order
+from trading.tasks import execute_matching_command
+from .base import TradingTestCase
+
+
+class ExpiryTests(TradingTestCase):
+
+    def test_orders_expire_once_their_time_has_passed(self):
+        book = PairOrderBook(self.pair)
+        now = timezone.now()
+        expiring = self.order('buy', '1', '100', expires_at=now + timedelta(seconds=5))
+        cancelled = self.order('buy', '1', '99', expires_at=now + timedelta(seconds=5))
+        book.add(expiring, Decimal('100'), Decimal('1'))
+        book.add(cancelled, Decimal('99'), Decimal('1'))
+        book.remove(cancelled.id)
+
+        self.assertEqual(book.pop_expired(now), [])
+        self.assertEqual(book.pop_expired(now + timedelta(seconds=10)), [expiring])
+
+    def test_expired_order_never_trades_and_releases_its_reservation(self):
+        # Due already, so the next pass over the book expires it first
+        order = self.service.create_order(
+            self.users[0], self.pair, 'limit', 'sell', Decimal('1'), Decimal('100'),
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        taker = self.service.create_order(self.users[1], self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+
+        self.assertEqual(Order.objects.get(id=order.id).status, 'expired')
+        self.assertEqual(taker.status, 'pending')
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('0'))
+
+
+class ExpiryTimerTests(SimpleTestCase):
+
+    def test_expiry_passes_are_queued_without_results(self):
+        with mock.patch('time.sleep', side_effect=[None, StopIteration]), \
+                mock.patch.object(execute_matching_command, 'apply_async') as apply_async:
+            with self.assertRaises(StopIteration):
+                Command._queue_expiries(3)
+
+        apply_async.assert_called_once_with(
+            args=['expire_orders', {}], queue='matching.3', ignore_result=True
+        )
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from trading.consistency import check_order_book
+from trading.engine import PairOrderBook, split_display, to_units
+from .base import TradingTestCase
+
+
+class IcebergTests(TradingTestCase):
+
+    def test_slices_are_cut_from_the_start_of_the_order(self):
+        book = PairOrderBook(self.pair)
+        iceberg = self.order('buy', '2.5', '100', display_quantity=Decimal('1'))
+        other = self.order('buy', '1', '100')
+        book.add(iceberg, Decimal('100'), Decimal('2.5'))
+        book.add(other, Decimal('100'), Decimal('1'))
+        entry = book.entries[iceberg.id]
+        self.assertEqual((entry.lots, entry.hidden), (to_units(Decimal('1')), to_units(Decimal('1.5'))))
+
+        book.match('sell', Decimal('0.3'))
+        self.assertEqual((entry.lots, entry.hidden), (to_units(Decimal('0.7')), to_units(Decimal('1.5'))))
+        self.assertEqual(self.queue(book, 'buy', '100'), [iceberg.id, other.id])
+
+        # A traded up slice is refilled behind the orders already waiting
+        book.match('sell', Decimal('0.7'))
+        self.assertEqual((entry.lots, entry.hidden), (to_units(Decimal('1')), to_units(Decimal('0.5'))))
+        self.assertEqual(self.queue(book, 'buy', '100'), [other.id, iceberg.id])
+
+        book.match('sell', Decimal('2'))
+        self.assertEqual((entry.lots, entry.hidden), (to_units(Decimal('0.5')), 0))
+
+    def test_slice_split_only_depends_on_filled_and_remaining_quantity(self):
+        display = to_units(Decimal('1'))
+        self.assertEqual(split_display(to_units(Decimal('2.5')), display), (display, to_units(Decimal('1.5'))))
+        self.assertEqual(
+            split_display(to_units(Decimal('2.2')), display, to_units(Decimal('0.3'))),
+            (to_units(Decimal('0.7')), to_units(Decimal('1.5')))
+        )
+        self.assertEqual(
+            split_display(to_units(Decimal('0.5')), display, to_units(Decimal('2'))),
+            (to_units(Decimal('0.5')), 0)
+        )
+        self.assertEqual(split_display(to_units(Decimal('3')), 0), (to_units(Decimal('3')), 0))
+
+    def test_lower_quantity_keeps_queue_position(self):
+        book = PairOrderBook(self.pair)
+        iceberg = self.order('buy', '2.5', '100', display_quantity=Decimal('1'))
+        other = self.order('buy', '1', '100')
+        book.add(iceberg, Decimal('100'), Decimal('2.5'))
+        book.add(other, Decimal('100'), Decimal('1'))
+        book.match('sell', Decimal('0.3'))
+
+        book.reduce(iceberg.id, Decimal('1.5'))
+
+        entry = book.entries[iceberg.id]
+        self.assertEqual((entry.lots, entry.hidden), (to_units(Decimal('0.7')), 0))
+        self.assertEqual(self.queue(book, 'buy', '100'), [iceberg.id, other.id])
+
+    def test_database_agrees_with_resident_slices(self):
+        self.random_flow(200, seed=3)
+
+        self.assertEqual(check_order_book(self.pair)['divergences'], [])
+
+    def test_amendment_keeps_display_below_quantity(self):
+        order = self.service.create_order(
+            self.users[0], self.pair, 'limit', 'buy', Decimal('2'), Decimal('50'),
+            display_quantity=Decimal('0.5')
+        )
+
+        with self.assertRaises(ValueError):
+            self.service.amend_order(order, quantity=Decimal('0.5'))
+        self.assertEqual(self.service.amend_order(order, quantity=Decimal('1')).quantity, Decimal('1'))
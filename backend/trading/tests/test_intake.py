@@ -0,0 +1,62 @@
+import uuid
+from decimal import Decimal
+from rest_framework.test import APIClient
+
+from wallet.models import Wallet
+from trading import commands
+from trading.models import Order
+from .base import TradingTestCase
+
+
+class AsyncIntakeTests(TradingTestCase):
+
+    def payload(self, **fields):
+        payload = {
+            'user_id': str(self.users[0].id),
+            'trading_pair_id': self.pair.id,
+            'order_type': 'limit',
+            'side': 'buy',
+            'quantity': '1',
+            'price': '100',
+            'order_id': str(uuid.uuid4()),
+        }
+        payload.update(fields)
+        return payload
+
+    def test_order_is_acknowledged_with_its_id(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+
+        response = client.post('/api/trading/orders/create/', {
+            'trading_pair_id': self.pair.id, 'order_type': 'limit', 'side': 'buy',
+            'quantity': '1', 'price': '100', 'wait': False,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'accepted')
+        order_id = uuid.UUID(response.data['id'])
+        self.assertEqual(Order.objects.get(id=order_id).status, 'pending')
+        self.assertIn(order_id, self.resident())
+
+    def test_refused_order_is_recorded_rejected(self):
+        payload = self.payload(quantity='100000')
+
+        commands.execute('submit_order', payload)
+
+        order = Order.objects.get(id=payload['order_id'])
+        self.assertEqual((order.status, order.remaining_quantity), ('rejected', Decimal('100000')))
+        self.assertEqual(self.wallet(self.users[0], self.usdt).reserved_balance, Decimal('0'))
+
+    def test_redelivered_order_is_created_once(self):
+        # Enough for the first delivery only, so a second create would fail
+        Wallet.objects.filter(user=self.users[0], cryptocurrency=self.usdt).update(
+            available_balance=Decimal('100.2')
+        )
+        payload = self.payload()
+
+        commands.execute('submit_order', payload)
+        commands.execute('submit_order', payload)
+
+        order = Order.objects.get(id=payload['order_id'])
+        self.assertEqual(order.status, 'pending')
+        self.assertEqual(self.wallet(self.users[0], self.usdt).reserved_balance, Decimal('100.2'))
@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from trading.engine import PairOrderBook, order_books
+from trading.journal import PairJournal
+from trading.models import Order
+from .base import TradingTestCase, book_state
+
+
+class JournalRecoveryTests(TradingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir, ignore_errors=True)
+        self.journal_dir = journal_dir
+
+    def recovered_after_flow(self, snapshot_interval):
+        with self.settings(MATCHING_JOURNAL_DIR=self.journal_dir, MATCHING_SNAPSHOT_INTERVAL=snapshot_interval):
+            # Committed in chunks, so snapshots are taken along the way
+            for seed in range(25):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.random_flow(10, seed=seed)
+            recovered = PairJournal(self.pair.id).recover(PairOrderBook(self.pair))
+        self.assertIsNotNone(recovered)
+        return recovered
+
+    def test_journal_tail_rebuilds_the_book(self):
+        recovered = self.recovered_after_flow(snapshot_interval=10 ** 9)
+
+        self.assertEqual(book_state(recovered), book_state(self.resident()))
+
+    def test_snapshot_and_tail_rebuild_the_book(self):
+        recovered = self.recovered_after_flow(snapshot_interval=50)
+
+        self.assertEqual(book_state(recovered), book_state(self.resident()))
+
+
+class RestartTests(TradingTestCase):
+    """Books reloaded by the registry after a restart of the matching process"""
+
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        journal_settings = self.settings(MATCHING_JOURNAL_DIR=self.journal_dir, MATCHING_SNAPSHOT_INTERVAL=50)
+        journal_settings.enable()
+        self.addCleanup(journal_settings.disable)
+        for seed in range(10):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.random_flow(10, seed=seed)
+        self.before_restart = book_state(self.resident())
+
+    def restart(self):
+        order_books.clear()
+        return self.resident()
+
+    def test_book_is_recovered_from_the_journal(self):
+        with mock.patch('trading.engine.resting_orders_query') as resting_orders_query:
+            book = self.restart()
+
+        resting_orders_query.assert_not_called()
+        self.assertTrue(book.entries)
+        self.assertEqual(book_state(book), self.before_restart)
+        self.assertIsNotNone(book.journal)
+
+    def test_torn_final_record_is_cut(self):
+        journal = PairJournal(self.pair.id)
+        with open(journal.journal_path, 'a') as journal_file:
+            journal_file.write('{"seq": ')
+
+        book = self.restart()
+
+        self.assertEqual(book_state(book), self.before_restart)
+        with open(journal.journal_path) as journal_file:
+            tail = journal_file.read()
+        self.assertFalse(tail and not tail.endswith('\n'))
+
+    def test_book_disagreeing_with_the_database_is_loaded_from_it(self):
+        order_id = next(iter(self.resident().entries))
+        # Cancelled behind the engine's back, so the journal does not know
+        Order.objects.filter(id=order_id).update(status='cancelled')
+
+        book = self.restart()
+
+        self.assertNotIn(order_id, book.entries)
+        self.assertEqual(sorted(book.entries), sorted(
+            Order.objects.filter(
+                trading_pair=self.pair, order_type='limit', status__in=['pending', 'partially_filled']
+            ).values_list('id', flat=True)
+        ))
+        # Started afresh from a snapshot of the database's book
+        self.assertEqual(book_state(PairJournal(self.pair.id).recover(PairOrderBook(self.pair))), book_state(book))
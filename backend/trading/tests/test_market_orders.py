@@ -0,0 +1,27 @@
+from decimal import Decimal
+
+from wallet.models import Wallet
+from .base import TradingTestCase
+
+
+class MarketOrderTests(TradingTestCase):
+
+    def test_market_buy_reserves_the_taker_fee(self):
+        buyer, seller = self.users[0], self.users[1]
+        self.service.create_order(seller, self.pair, 'limit', 'sell', Decimal('0.5'), Decimal('100'))
+        self.service.create_order(seller, self.pair, 'limit', 'sell', Decimal('0.5'), Decimal('101'))
+
+        Wallet.objects.filter(user=buyer, cryptocurrency=self.usdt).update(available_balance=Decimal('100.7'))
+        with self.assertRaises(ValueError):
+            self.service.create_order(buyer, self.pair, 'market', 'buy', Decimal('1'))
+
+        Wallet.objects.filter(user=buyer, cryptocurrency=self.usdt).update(available_balance=Decimal('100.701'))
+        order = self.service.create_order(buyer, self.pair, 'market', 'buy', Decimal('1'))
+        self.assertEqual((order.status, order.fee), ('filled', Decimal('0.201')))
+        wallet = self.wallet(buyer, self.usdt)
+        self.assertEqual((wallet.available_balance, wallet.reserved_balance), (Decimal('0'), Decimal('0')))
+
+    def test_market_buy_without_asks_is_refused(self):
+        with self.assertRaises(ValueError):
+            self.service.create_order(self.users[0], self.pair, 'market', 'buy', Decimal('1'))
+        self.assertEqual(self.wallet(self.users[0], self.usdt).reserved_balance, Decimal('0'))
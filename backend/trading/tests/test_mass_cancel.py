@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+from trading.models import Order
+from .base import TradingTestCase
+
+
+class MassCancelTests(TradingTestCase):
+
+    def post(self, user, **data):
+        return self.client_for(user).post('/api/trading/orders/cancel-all/', data, format='json')
+
+    def test_only_the_users_orders_on_the_side_are_cancelled(self):
+        bids = [self.service.create_order(self.users[0], self.pair, 'limit', 'buy', Decimal('1'), price)
+                for price in (Decimal('98'), Decimal('99'))]
+        ask = self.service.create_order(self.users[0], self.pair, 'limit', 'sell', Decimal('1'), Decimal('101'))
+        other = self.service.create_order(self.users[1], self.pair, 'limit', 'buy', Decimal('1'), Decimal('99'))
+
+        response = self.post(self.users[0], trading_pair_id=self.pair.id, side='buy')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'cancelled': 2})
+        self.assertEqual(
+            set(Order.objects.filter(status='cancelled').values_list('id', flat=True)), {order.id for order in bids}
+        )
+        self.assertEqual(sorted(self.resident().entries), sorted([ask.id, other.id]))
+        self.assertEqual(self.wallet(self.users[0], self.usdt).reserved_balance, Decimal('0'))
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('1'))
+
+    def test_orders_of_every_pair_are_cancelled_without_a_pair(self):
+        self.service.create_order(self.users[0], self.pair, 'limit', 'buy', Decimal('1'), Decimal('99'))
+        self.service.create_order(self.users[0], self.pair, 'limit', 'sell', Decimal('1'), Decimal('101'))
+
+        response = self.post(self.users[0])
+
+        self.assertEqual(response.data, {'cancelled': 2})
+        self.assertEqual(self.resident().entries, {})
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('0'))
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from trading.models import Order
+from .base import TradingTestCase
+
+
+class TimeInForceTests(TradingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.service.create_order(self.users[1], self.pair, 'limit', 'sell', Decimal('1'), Decimal('100'))
+
+    def assertNothingReserved(self, user):
+        for currency in (self.btc, self.usdt):
+            self.assertEqual(self.wallet(user, currency).reserved_balance, Decimal('0'))
+
+    def test_limit_ioc_remainder_is_cancelled_and_released(self):
+        order = self.service.create_order(
+            self.users[0], self.pair, 'limit', 'buy', Decimal('3'), Decimal('100'), time_in_force='ioc'
+        )
+
+        order = Order.objects.get(id=order.id)
+        self.assertEqual((order.status, order.filled_quantity), ('cancelled', Decimal('1')))
+        self.assertNotIn(order.id, self.resident())
+        self.assertNothingReserved(self.users[0])
+
+    def test_market_remainder_is_cancelled_and_released(self):
+        self.service.create_order(self.users[0], self.pair, 'limit', 'buy', Decimal('1'), Decimal('99'))
+
+        order = self.service.create_order(
+            self.users[2], self.pair, 'market', 'sell', Decimal('3'), time_in_force='ioc'
+        )
+
+        order = Order.objects.get(id=order.id)
+        self.assertEqual((order.status, order.filled_quantity), ('cancelled', Decimal('1')))
+        self.assertNothingReserved(self.users[2])
+
+    def test_market_buy_remainder_is_cancelled_and_released(self):
+        order = self.service.create_order(self.users[0], self.pair, 'market', 'buy', Decimal('3'))
+
+        order = Order.objects.get(id=order.id)
+        self.assertEqual((order.status, order.filled_quantity), ('cancelled', Decimal('1')))
+        self.assertNothingReserved(self.users[0])
+
+    def test_fok_without_enough_depth_is_cancelled_untouched(self):
+        order = self.service.create_order(
+            self.users[0], self.pair, 'limit', 'buy', Decimal('2'), Decimal('100'), time_in_force='fok'
+        )
+
+        self.assertEqual((order.status, order.filled_quantity), ('cancelled', Decimal('0')))
+        self.assertEqual(self.queue(self.resident(), 'sell', '100')[0], Order.objects.get(side='sell').id)
+        self.assertNothingReserved(self.users[0])
+
+    def test_crossing_post_only_is_rejected(self):
+        order = self.service.create_order(
+            self.users[0], self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'), post_only=True
+        )
+
+        self.assertEqual(order.status, 'rejected')
+        self.assertNothingReserved(self.users[0])
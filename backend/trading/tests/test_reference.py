@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from trading.models import Cryptocurrency, TradingPair
+from trading.reference import reference_data
+from .base import TradingTestCase
+
+
+class ReferenceDataTests(TradingTestCase):
+
+    def test_cached_lookups_make_no_queries(self):
+        reference_data.load()
+
+        with self.assertNumQueries(0):
+            trading_pair = reference_data.trading_pair(self.pair.id)
+            self.assertEqual(trading_pair.base_currency.symbol, 'BTC')
+            self.assertEqual(reference_data.cryptocurrency(str(self.usdt.id)).symbol, 'USDT')
+            self.assertEqual(reference_data.trading_pairs([self.pair.id, 0]), {self.pair.id: trading_pair})
+
+    def test_saving_a_currency_reloads_the_cache_on_commit(self):
+        reference_data.load()
+        currency = Cryptocurrency.objects.get(id=self.btc.id)
+        currency.taker_fee = Decimal('0.005')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            currency.save()
+            # Not before the transaction commits
+            self.assertEqual(reference_data.cryptocurrency(self.btc.id).taker_fee, Decimal('0.002'))
+
+        self.assertEqual(reference_data.trading_pair(self.pair.id).base_currency.taker_fee, Decimal('0.005'))
+
+    def test_cache_is_reloaded_after_the_ttl(self):
+        reference_data.load()
+        TradingPair.objects.filter(id=self.pair.id).update(price_precision=4)
+
+        self.assertEqual(reference_data.trading_pair(self.pair.id).price_precision, 2)
+        with self.settings(REFERENCE_DATA_TTL=-1):
+            self.assertEqual(reference_data.trading_pair(self.pair.id).price_precision, 4)
+
+    def test_inactive_and_unknown_pairs_raise_does_not_exist(self):
+        TradingPair.objects.filter(id=self.pair.id).update(is_active=False)
+        reference_data.invalidate()
+
+        self.assertFalse(reference_data.trading_pair(self.pair.id).is_active)
+        with self.assertRaises(TradingPair.DoesNotExist):
+            reference_data.trading_pair(self.pair.id, active_only=True)
+        with self.assertRaises(TradingPair.DoesNotExist):
+            reference_data.trading_pair('unknown')
+        self.assertEqual(reference_data.trading_pairs([self.pair.id], active_only=True), {})
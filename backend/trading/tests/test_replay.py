@@ -0,0 +1,85 @@
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.utils import timezone
+
+from trading import commands
+from .base import TradingTestCase
+
+
+class ReplayTests(TradingTestCase):
+
+    def record_flow(self, count, seed):
+        """Random flow with the orders the engine refuses, cancels or expires itself"""
+        generator = random.Random(seed)
+        for _ in range(count // 10):
+            self.random_flow(10, seed=generator.random())
+            user = generator.choice(self.users)
+            side = generator.choice(['buy', 'sell'])
+            price = Decimal(generator.randint(9900, 10100)) / 100
+            action = generator.random()
+            try:
+                if action < 0.2:
+                    self.service.create_order(
+                        user, self.pair, 'limit', side, Decimal('2'), price,
+                        time_in_force=generator.choice(['ioc', 'fok'])
+                    )
+                elif action < 0.4:
+                    self.service.create_order(
+                        user, self.pair, 'limit', side, Decimal('1'), price, time_in_force='gtd',
+                        expires_at=timezone.now() + timedelta(milliseconds=generator.randint(1, 50))
+                    )
+                elif action < 0.5:
+                    self.service.create_order(user, self.pair, 'limit', side, Decimal('1'), price, post_only=True)
+                elif action < 0.6:
+                    self.service.cancel_orders(user, self.pair, side=side)
+                elif action < 0.8:
+                    self.service.create_orders(user, self.pair, [
+                        {'order_type': 'limit', 'side': order_side, 'quantity': Decimal('1'), 'price': price}
+                        for order_side in ('buy', 'sell', 'buy')
+                    ])
+                else:
+                    # Refused for funds, recorded as rejected
+                    commands.execute('submit_order', {
+                        'user_id': str(user.id), 'trading_pair_id': self.pair.id, 'order_type': 'limit',
+                        'side': side, 'quantity': '100000', 'price': str(price), 'order_id': str(uuid.uuid4()),
+                    })
+            except ValueError:
+                pass
+
+    def replay_output(self, *args):
+        output = io.StringIO()
+        call_command('replay_orders', '--trading-pair', str(self.pair.id), *args, stdout=output)
+        return output.getvalue()
+
+    def replay(self, *args):
+        return json.loads(self.replay_output(*args))
+
+    def test_replay_reproduces_the_recorded_trades(self):
+        with self.settings(MAX_OPEN_ORDERS_PER_PAIR=1000):
+            self.record_flow(400, seed=5)
+
+        report = self.replay('--compare')
+
+        self.assertGreater(report['comparison']['recorded_trades'], 100)
+        self.assertTrue(report['comparison']['identical'], report['comparison'])
+        self.assertGreater(report['expires'], 0)
+        self.assertEqual(report['skipped'], 0)
+
+    def test_exported_events_replay_the_same_book(self):
+        self.record_flow(100, seed=6)
+        export_path = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(export_path))
+
+        self.replay_output('--export', export_path)
+        replayed = self.replay('--input', export_path)
+
+        self.assertEqual(replayed['book'], self.replay()['book'])
+        self.assertEqual(replayed['trades'], self.replay()['trades'])
@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+from trading.models import Cryptocurrency, Order, TradingPair
+from trading.reference import reference_data
+from .base import TradingTestCase
+
+
+class RiskCheckTests(TradingTestCase):
+
+    def limit(self, side, quantity, price, user=None):
+        return self.service.create_order(
+            user or self.users[0], self.pair, 'limit', side, Decimal(quantity), Decimal(price)
+        )
+
+    def update_pair(self, **fields):
+        TradingPair.objects.filter(id=self.pair.id).update(**fields)
+        reference_data.invalidate()
+
+    def test_price_outside_the_band_around_the_last_price_is_refused(self):
+        self.update_pair(price_band=Decimal('0.1'))
+        self.limit('sell', '1', '100')
+        self.limit('buy', '1', '100', user=self.users[1])
+
+        with self.assertRaisesMessage(ValueError, 'خارج از محدوده'):
+            self.limit('sell', '1', '111')
+        with self.assertRaisesMessage(ValueError, 'خارج از محدوده'):
+            self.limit('buy', '1', '89')
+        self.limit('buy', '1', '90')
+
+    def test_notional_above_the_pair_limit_is_refused(self):
+        self.update_pair(max_order_notional=Decimal('1000'))
+        self.limit('sell', '10', '100')
+
+        with self.assertRaisesMessage(ValueError, 'ارزش سفارش'):
+            self.limit('sell', '10.01', '100')
+        # Market orders are valued at the reference price
+        with self.assertRaisesMessage(ValueError, 'ارزش سفارش'):
+            self.service.create_order(self.users[1], self.pair, 'market', 'buy', Decimal('11'))
+
+    def test_quantity_above_the_currency_limit_is_refused_through_the_view(self):
+        Cryptocurrency.objects.filter(id=self.btc.id).update(max_trade_amount=Decimal('5'))
+        reference_data.invalidate()
+
+        response = self.client_for(self.users[0]).post('/api/trading/orders/create/', {
+            'trading_pair_id': self.pair.id, 'order_type': 'limit', 'side': 'buy',
+            'quantity': '6', 'price': '100',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.wallet(self.users[0], self.usdt).reserved_balance, Decimal('0'))
+
+    def test_amendment_is_checked_against_the_limits(self):
+        self.update_pair(max_order_notional=Decimal('1000'))
+        order = self.limit('buy', '5', '100')
+
+        with self.assertRaisesMessage(ValueError, 'ارزش سفارش'):
+            self.service.amend_order(order, price=Decimal('250'))
+
+    def test_open_orders_per_pair_are_limited(self):
+        with self.settings(MAX_OPEN_ORDERS_PER_PAIR=2):
+            self.limit('buy', '1', '98')
+            self.limit('buy', '1', '99')
+            with self.assertRaisesMessage(ValueError, 'حداکثر'):
+                self.limit('sell', '1', '101')
+            # Orders that cannot rest are not counted
+            self.service.create_order(self.users[0], self.pair, 'market', 'sell', Decimal('0.5'))
+            # Other users are counted apart
+            self.limit('sell', '1', '101', user=self.users[1])
@@ -0,0 +1,81 @@
+from decimal import Decimal
+
+from wallet.models import Wallet
+from wallet.services import WalletService
+from trading.models import Cryptocurrency, Order, Trade
+from trading.reference import reference_data
+from .base import TradingTestCase
+
+
+class SettlementTests(TradingTestCase):
+
+    def totals(self):
+        """Available plus reserved balance of every user, per currency id"""
+        # Summed here rather than with Sum(), which SQLite adds up as floats
+        totals = {}
+        for wallet in Wallet.objects.all():
+            balance = wallet.available_balance + wallet.reserved_balance
+            totals[wallet.cryptocurrency_id] = totals.get(wallet.cryptocurrency_id, Decimal('0')) + balance
+        return totals
+
+    def test_balances_and_fees_are_conserved(self):
+        before = self.totals()
+
+        self.random_flow(300, seed=1)
+
+        # Folded first: fee_balances() adds unfolded postings up in SQL
+        WalletService().fold_fee_postings()
+        fees = WalletService().fee_balances()
+        after = self.totals()
+        self.assertTrue(Trade.objects.exists())
+        for currency_id, total in before.items():
+            self.assertEqual(after[currency_id] + fees.get(currency_id, Decimal('0')), total)
+        self.assertEqual(
+            fees[self.usdt.id],
+            sum(trade.maker_fee + trade.taker_fee for trade in Trade.objects.all())
+        )
+
+    def test_reservations_match_the_open_orders(self):
+        self.random_flow(300, seed=2)
+
+        expected = {}
+        book = self.resident()
+        for order in book.open_orders_for_user(self.users[0].id) + book.open_orders_for_user(self.users[1].id):
+            currency, amount = self.service._open_reservation(order)
+            key = (order.user_id, currency.id)
+            expected[key] = expected.get(key, Decimal('0')) + amount
+        for user in self.users[:2]:
+            for currency in (self.btc, self.usdt):
+                self.assertEqual(
+                    self.wallet(user, currency).reserved_balance,
+                    expected.get((user.id, currency.id), Decimal('0'))
+                )
+
+    def test_resting_buyer_pays_its_fee_out_of_its_reservation(self):
+        buyer, seller = self.users[0], self.users[1]
+        Wallet.objects.filter(user=buyer, cryptocurrency=self.usdt).update(available_balance=Decimal('100.2'))
+        bid = self.service.create_order(buyer, self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+        self.assertEqual(self.wallet(buyer, self.usdt).available_balance, Decimal('0'))
+
+        self.service.create_order(seller, self.pair, 'limit', 'sell', Decimal('0.3'), Decimal('99'))
+
+        # 30 paid plus the 0.1% maker fee, the rest still reserved
+        wallet = self.wallet(buyer, self.usdt)
+        self.assertEqual((wallet.available_balance, wallet.reserved_balance), (Decimal('0.03'), Decimal('70.14')))
+        self.service.cancel_order(Order.objects.get(id=bid.id))
+        wallet = self.wallet(buyer, self.usdt)
+        self.assertEqual((wallet.available_balance, wallet.reserved_balance), (Decimal('70.17'), Decimal('0')))
+
+    def test_fee_raised_after_reservation_is_capped(self):
+        buyer, seller = self.users[0], self.users[1]
+        Wallet.objects.filter(user=buyer, cryptocurrency=self.usdt).update(available_balance=Decimal('100.2'))
+        self.service.create_order(buyer, self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+        Cryptocurrency.objects.filter(id=self.btc.id).update(maker_fee=Decimal('0.01'), taker_fee=Decimal('0.01'))
+        reference_data.invalidate()
+
+        sell = self.service.create_order(seller, self.pair, 'market', 'sell', Decimal('1'))
+
+        trade = Trade.objects.get(taker_order_id=sell.id)
+        self.assertEqual((trade.maker_fee, trade.taker_fee), (Decimal('0.2'), Decimal('1')))
+        wallet = self.wallet(buyer, self.usdt)
+        self.assertEqual((wallet.available_balance, wallet.reserved_balance), (Decimal('0'), Decimal('0')))
@@ -0,0 +1,64 @@
+from unittest import mock
+from celery.exceptions import TimeoutError
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from trading.sharding import CommandTimeout, ConsistentHashRing, dispatch, queue_for_pair
+from trading.tasks import execute_matching_command
+from .base import TradingTestCase
+
+
+class HashRingTests(SimpleTestCase):
+
+    def test_pairs_spread_over_every_shard(self):
+        ring = ConsistentHashRing(4)
+
+        shards = [ring.shard_for(pair_id) for pair_id in range(400)]
+
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+        self.assertEqual(shards, [ConsistentHashRing(4).shard_for(pair_id) for pair_id in range(400)])
+
+    def test_adding_a_shard_moves_a_small_share_of_pairs(self):
+        before, after = ConsistentHashRing(4), ConsistentHashRing(5)
+
+        moved = [pair_id for pair_id in range(1000) if before.shard_for(pair_id) != after.shard_for(pair_id)]
+
+        self.assertLess(len(moved), 350)
+        self.assertTrue(all(after.shard_for(pair_id) == 4 for pair_id in moved))
+
+
+class DispatchTests(TradingTestCase):
+
+    @override_settings(MATCHING_SHARDS=0, MATCHING_IN_PROCESS=False)
+    def test_in_process_matching_must_be_allowed(self):
+        with self.assertRaises(ImproperlyConfigured):
+            dispatch(self.pair.id, 'reload_reference_data', {})
+
+    @override_settings(MATCHING_SHARDS=4)
+    def test_commands_go_to_the_queue_owning_the_pair(self):
+        with mock.patch.object(execute_matching_command, 'apply_async') as apply_async:
+            apply_async.return_value.get.return_value = {'cancelled': 2}
+
+            result = dispatch(self.pair.id, 'cancel_orders', {'trading_pair_id': self.pair.id})
+
+        self.assertEqual(result, {'cancelled': 2})
+        apply_async.assert_called_once_with(
+            args=['cancel_orders', {'trading_pair_id': self.pair.id}], queue=queue_for_pair(self.pair.id)
+        )
+
+    @override_settings(MATCHING_SHARDS=4)
+    def test_unanswered_order_is_reported_with_unknown_status(self):
+        with mock.patch.object(execute_matching_command, 'apply_async') as apply_async:
+            apply_async.return_value.get.side_effect = TimeoutError
+
+            with self.assertRaises(CommandTimeout):
+                dispatch(self.pair.id, 'reload_reference_data', {})
+
+            response = self.client_for(self.users[0]).post('/api/trading/orders/create/', {
+                'trading_pair_id': self.pair.id, 'order_type': 'limit', 'side': 'buy',
+                'quantity': '1', 'price': '100',
+            }, format='json')
+
+        self.assertEqual((response.status_code, response.data['status']), (504, 'unknown'))
+        payload = apply_async.call_args.kwargs['args'][1]
+        self.assertEqual(response.data['id'], payload['order_id'])
@@ -0,0 +1,39 @@
+from decimal import Decimal
+
+from trading.engine import PairOrderBook
+from trading.models import Order
+from .base import TradingTestCase
+
+
+class StopOrderTests(TradingTestCase):
+
+    def test_stops_trigger_when_the_price_crosses_them(self):
+        book = PairOrderBook(self.pair)
+        sell_stop = self.order('sell', '1', order_type='stop', stop_price=Decimal('95'))
+        buy_stop = self.order('buy', '1', order_type='stop', stop_price=Decimal('105'))
+        book.add_stop(sell_stop)
+        book.add_stop(buy_stop)
+        book.add(self.order('buy', '1', '96'), Decimal('96'), Decimal('1'))
+        book.add(self.order('buy', '1', '95'), Decimal('95'), Decimal('1'))
+
+        book.match('sell', Decimal('1'))
+        self.assertEqual(book.pop_triggered_stops(), [])
+
+        book.match('sell', Decimal('1'))
+        self.assertEqual(book.pop_triggered_stops(), [sell_stop])
+        self.assertEqual(sorted(book.stops.orders), [buy_stop.id])
+
+    def test_triggered_stop_trades_in_the_same_pass(self):
+        buyer, seller = self.users[0], self.users[1]
+        self.service.create_order(buyer, self.pair, 'limit', 'buy', Decimal('1'), Decimal('100'))
+        self.service.create_order(buyer, self.pair, 'limit', 'buy', Decimal('1'), Decimal('95'))
+        stop = self.service.create_order(
+            self.users[2], self.pair, 'stop', 'sell', Decimal('1'), stop_price=Decimal('100')
+        )
+
+        self.service.create_order(seller, self.pair, 'market', 'sell', Decimal('1'))
+
+        stop = Order.objects.get(id=stop.id)
+        self.assertIsNotNone(stop.triggered_at)
+        self.assertEqual((stop.status, stop.filled_quantity), ('filled', Decimal('1')))
+        self.assertEqual(self.resident().last_price, Decimal('95'))
@@ -0,0 +1,55 @@
+import uuid
+from decimal import Decimal
+
+from trading.models import Order, Trade
+from .base import TradingTestCase
+
+
+class OrderViewTests(TradingTestCase):
+
+    def place(self, user, side, quantity, price, **fields):
+        return self.client_for(user).post('/api/trading/orders/create/', {
+            'trading_pair_id': self.pair.id, 'order_type': 'limit', 'side': side,
+            'quantity': quantity, 'price': price, **fields,
+        }, format='json')
+
+    def test_orders_placed_through_the_api_trade(self):
+        response = self.place(self.users[0], 'sell', '1', '100')
+        self.assertEqual((response.status_code, response.data['status']), (201, 'pending'))
+
+        response = self.place(self.users[1], 'buy', '0.4', '101')
+
+        self.assertEqual((response.status_code, response.data['status']), (201, 'filled'))
+        trade = Trade.objects.get()
+        self.assertEqual((trade.quantity, trade.price), (Decimal('0.4'), Decimal('100')))
+        book = self.client_for(self.users[2]).get(f'/api/trading/pairs/{self.pair.id}/orderbook/').data
+        self.assertEqual(
+            [(Decimal(level['price']), Decimal(level['quantity'])) for level in book['asks']],
+            [(Decimal('100'), Decimal('0.6'))]
+        )
+        self.assertEqual(book['bids'], [])
+
+    def test_refused_order_is_reported(self):
+        response = self.place(self.users[0], 'buy', '100000', '100')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_takes_the_order_off_the_book(self):
+        order_id = uuid.UUID(self.place(self.users[0], 'sell', '1', '100').data['id'])
+
+        response = self.client_for(self.users[0]).patch(f'/api/trading/orders/{order_id}/cancel/')
+
+        self.assertEqual((response.status_code, response.data['status']), (200, 'cancelled'))
+        self.assertNotIn(order_id, self.resident())
+        self.assertEqual(self.wallet(self.users[0], self.btc).reserved_balance, Decimal('0'))
+
+    def test_cancel_refuses_other_users_and_closed_orders(self):
+        order_id = self.place(self.users[0], 'sell', '1', '100').data['id']
+
+        response = self.client_for(self.users[1]).patch(f'/api/trading/orders/{order_id}/cancel/')
+        self.assertEqual(response.status_code, 404)
+
+        self.place(self.users[1], 'buy', '1', '100')
+        response = self.client_for(self.users[0]).patch(f'/api/trading/orders/{order_id}/cancel/')
+        self.assertEqual(response.status_code, 400)
@@ -9,8 +9,11 @@ urlpatterns = [
     
     # Orders
     path('orders/create/', views.CreateOrderView.as_view(), name='create_order'),
+    path('orders/batch/', views.BatchCreateOrderView.as_view(), name='batch_create_order'),
     path('orders/', views.UserOrdersView.as_view(), name='user_orders'),
+    path('orders/cancel-all/', views.MassCancelOrderView.as_view(), name='mass_cancel_orders'),
     path('orders/<uuid:order_id>/cancel/', views.CancelOrderView.as_view(), name='cancel_order'),
+    path('orders/<uuid:order_id>/amend/', views.AmendOrderView.as_view(), name='amend_order'),
     
     # Trades
     path('trades/', views.UserTradesView.as_view(), name='user_trades'),
@@ -4,15 +4,33 @@ from rest_framework.response import Response
 from django.db.models import Q, Sum, Avg, Max, Min
 from django.utils import timezone
 from datetime import timedelta
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+import uuid
 
 from .models import Cryptocurrency, TradingPair, Order, Trade, OrderBook, PriceHistory
 from .serializers import (
     CryptocurrencySerializer, TradingPairSerializer, OrderSerializer,
-    CreateOrderSerializer, TradeSerializer, OrderBookSerializer,
-    PriceHistorySerializer, MarketStatsSerializer
+    CreateOrderSerializer, BatchCreateOrderSerializer, AmendOrderSerializer, MassCancelOrderSerializer,
+    TradeSerializer, OrderBookSerializer, PriceHistorySerializer, MarketStatsSerializer
 )
-from .services import OrderService
+from .reference import reference_data
+from .sharding import CommandTimeout, dispatch
+
+
+def _str_or_none(value):
+    return str(value) if value is not None else None
+
+
+def _status_unknown(**data):
+    """Response to a command its shard did not answer in time, which may still run"""
+    return Response(
+        {'error': 'پاسخی از موتور معاملات دریافت نشد، وضعیت درخواست نامشخص است', 'status': 'unknown', **data},
+        status=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
+def _isoformat_or_none(value):
+    return value.isoformat() if value is not None else None
 
 
 class CryptocurrencyListView(generics.ListAPIView):
@@ -50,23 +68,122 @@ class CreateOrderView(generics.CreateAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Create order using service
-        order_service = OrderService()
+        # Create order on the process owning the trading pair
+        validated_data = serializer.validated_data
+        trading_pair = validated_data['trading_pair']
+        payload = {
+            'user_id': str(request.user.id),
+            'trading_pair_id': trading_pair.id,
+            'order_type': validated_data['order_type'],
+            'side': validated_data['side'],
+            'quantity': str(validated_data['quantity']),
+            'price': _str_or_none(validated_data.get('price')),
+            'stop_price': _str_or_none(validated_data.get('stop_price')),
+            'time_in_force': validated_data['time_in_force'],
+            'post_only': validated_data['post_only'],
+            'expires_at': _isoformat_or_none(validated_data.get('expires_at')),
+            'display_quantity': _str_or_none(validated_data.get('display_quantity')),
+            # Handed out now so that pushed updates, later API reads and a
+            # timed out request can be matched to this order
+            'order_id': str(uuid.uuid4()),
+        }
+        
+        if not validated_data['wait']:
+            return self._submit(trading_pair, payload)
+        
         try:
-            order = order_service.create_order(
-                user=request.user,
-                **serializer.validated_data
-            )
+            order_data = dispatch(trading_pair.id, 'create_order', payload)
             
             return Response(
-                OrderSerializer(order).data,
+                order_data,
                 status=status.HTTP_201_CREATED
             )
+        except CommandTimeout:
+            return _status_unknown(id=payload['order_id'])
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
+    
+    def _submit(self, trading_pair, payload):
+        """Queue the order on its shard and acknowledge it with its id"""
+        
+        try:
+            dispatch(trading_pair.id, 'submit_order', payload, wait=False)
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        return Response(
+            {'id': payload['order_id'], 'trading_pair_id': trading_pair.id, 'status': 'accepted'},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class BatchCreateOrderView(generics.CreateAPIView):
+    """Create several orders in one request"""
+    
+    serializer_class = BatchCreateOrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        # Check if user can trade
+        if not request.user.is_trading_enabled:
+            return Response(
+                {'error': 'معاملات برای حساب شما غیرفعال است'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        # Each trading pair's orders go to its owning process as one batch
+        orders = serializer.validated_data['orders']
+        orders_by_pair = {}
+        for index, order in enumerate(orders):
+            orders_by_pair.setdefault(order['trading_pair'].id, []).append(index)
+        
+        results = [None] * len(orders)
+        # Handed out now so that orders of a timed out batch can be looked up
+        order_ids = [str(uuid.uuid4()) for _ in orders]
+        for trading_pair_id, indexes in orders_by_pair.items():
+            try:
+                orders_data = dispatch(trading_pair_id, 'create_orders', {
+                    'user_id': str(request.user.id),
+                    'trading_pair_id': trading_pair_id,
+                    'orders': [
+                        {
+                            'order_type': orders[index]['order_type'],
+                            'side': orders[index]['side'],
+                            'quantity': str(orders[index]['quantity']),
+                            'price': _str_or_none(orders[index].get('price')),
+                            'stop_price': _str_or_none(orders[index].get('stop_price')),
+                            'time_in_force': orders[index]['time_in_force'],
+                            'post_only': orders[index]['post_only'],
+                            'expires_at': _isoformat_or_none(orders[index].get('expires_at')),
+                            'display_quantity': _str_or_none(orders[index].get('display_quantity')),
+                            'order_id': order_ids[index],
+                        }
+                        for index in indexes
+                    ],
+                })
+                for index, order_data in zip(indexes, orders_data):
+                    results[index] = order_data
+            except CommandTimeout:
+                for index in indexes:
+                    results[index] = _status_unknown(id=order_ids[index]).data
+            except Exception as e:
+                for index in indexes:
+                    results[index] = {'error': str(e)}
+        
+        failed = any('error' in result for result in results)
+        return Response(
+            results,
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+        )
 
 
 class UserOrdersView(generics.ListAPIView):
@@ -113,14 +230,70 @@ class CancelOrderView(generics.UpdateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Cancel order using service
-        order_service = OrderService()
+        # Cancel order on the process owning the trading pair
+        try:
+            order_data = dispatch(order.trading_pair_id, 'cancel_order', {
+                'order_id': str(order.id),
+            })
+            return Response(
+                order_data,
+                status=status.HTTP_200_OK
+            )
+        except CommandTimeout:
+            return _status_unknown(id=str(order.id))
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+
+class AmendOrderView(generics.GenericAPIView):
+    """Change the quantity or price of an open limit order"""
+    
+    serializer_class = AmendOrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def patch(self, request, order_id):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            order = Order.objects.get(id=order_id, user=request.user)
+        except Order.DoesNotExist:
+            return Response(
+                {'error': 'سفارش یافت نشد'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        if order.status not in ['pending', 'partially_filled'] or order.order_type != 'limit':
+            return Response(
+                {'error': 'این سفارش قابل ویرایش نیست'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        quantity = serializer.validated_data.get('quantity')
+        trading_pair = reference_data.trading_pair(order.trading_pair_id)
+        min_trade_amount = trading_pair.base_currency.min_trade_amount
+        if quantity is not None and quantity < min_trade_amount:
+            return Response(
+                {'error': f"مقدار نمی‌تواند کمتر از {min_trade_amount} باشد"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Amend the order on the process owning the trading pair
         try:
-            order_service.cancel_order(order)
+            order_data = dispatch(order.trading_pair_id, 'amend_order', {
+                'order_id': str(order.id),
+                'quantity': _str_or_none(quantity),
+                'price': _str_or_none(serializer.validated_data.get('price')),
+            })
             return Response(
-                OrderSerializer(order).data,
+                order_data,
                 status=status.HTTP_200_OK
             )
+        except CommandTimeout:
+            return _status_unknown(id=str(order.id))
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -128,6 +301,51 @@ class CancelOrderView(generics.UpdateAPIView):
             )
 
 
+class MassCancelOrderView(generics.GenericAPIView):
+    """Cancel all open orders, optionally filtered by trading pair and side"""
+    
+    serializer_class = MassCancelOrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        trading_pair_id = serializer.validated_data.get('trading_pair_id')
+        side = serializer.validated_data.get('side')
+        
+        if trading_pair_id:
+            trading_pair_ids = [trading_pair_id]
+        else:
+            open_orders = Order.objects.filter(
+                user=request.user,
+                status__in=['pending', 'partially_filled']
+            )
+            if side:
+                open_orders = open_orders.filter(side=side)
+            trading_pair_ids = open_orders.order_by().values_list('trading_pair_id', flat=True).distinct()
+        
+        # Each pair is cancelled by the process owning its order book
+        cancelled = 0
+        try:
+            for pair_id in trading_pair_ids:
+                result = dispatch(pair_id, 'cancel_orders', {
+                    'user_id': str(request.user.id),
+                    'trading_pair_id': pair_id,
+                    'side': side,
+                })
+                cancelled += result['cancelled']
+        except CommandTimeout:
+            return _status_unknown(cancelled=cancelled)
+        except Exception as e:
+            return Response(
+                {'error': str(e), 'cancelled': cancelled},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({'cancelled': cancelled}, status=status.HTTP_200_OK)
+
+
 class UserTradesView(generics.ListAPIView):
     """List user's trades"""
     
@@ -163,6 +381,10 @@ class OrderBookView(generics.ListAPIView):
         ).order_by('side', '-price')
     
     def list(self, request, *args, **kwargs):
+        tick = request.query_params.get('tick')
+        if tick is not None:
+            return self.grouped_list(tick)
+        
         queryset = self.get_queryset()
         
         # Separate bids and asks
@@ -173,6 +395,36 @@ class OrderBookView(generics.ListAPIView):
             'bids': OrderBookSerializer(bids, many=True).data,
             'asks': OrderBookSerializer(asks, many=True).data
         })
+    
+    def grouped_list(self, tick):
+        """Order book grouped at a coarser price tick, kept by the matching engine"""
+        
+        try:
+            if Decimal(tick) <= 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            return Response(
+                {'error': 'اندازه گروه‌بندی قیمت نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        trading_pair_id = self.kwargs.get('trading_pair_id')
+        try:
+            depth = dispatch(trading_pair_id, 'order_book_depth', {
+                'trading_pair_id': trading_pair_id,
+                'tick': tick,
+            })
+            return Response(depth)
+        except CommandTimeout as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
 
 class RecentTradesView(generics.ListAPIView):
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Wallet, Transaction, DepositAddress, WithdrawalRequest, WalletReservation
+from .models import (
+    Wallet, Transaction, DepositAddress, WithdrawalRequest, WalletReservation, FeeAccount, FeePosting
+)
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
@@ -80,4 +82,16 @@ class WalletReservationAdmin(admin.ModelAdmin):
     list_display = ['wallet', 'amount', 'reason', 'reference_id', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['wallet__user__email', 'reason', 'reference_id']
-    readonly_fields = ['created_at', 'released_at']
\ No newline at end of file
+    readonly_fields = ['created_at', 'released_at']
+
+@admin.register(FeeAccount)
+class FeeAccountAdmin(admin.ModelAdmin):
+    list_display = ['cryptocurrency', 'balance', 'updated_at']
+    readonly_fields = ['balance', 'updated_at']
+
+
+@admin.register(FeePosting)
+class FeePostingAdmin(admin.ModelAdmin):
+    list_display = ['cryptocurrency', 'trading_pair', 'amount', 'trade_count', 'folded', 'created_at']
+    list_filter = ['cryptocurrency', 'trading_pair', 'folded', 'created_at']
+    readonly_fields = ['created_at']
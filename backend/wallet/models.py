@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 import uuid
@@ -223,4 +224,72 @@ class WalletReservation(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.wallet} - {self.amount} - {self.reason}"
\ No newline at end of file
+        return f"{self.wallet} - {self.amount} - {self.reason}"
+
+
+class FeeAccount(models.Model):
+    """Exchange account collecting the trading fees of one currency"""
+    
+    cryptocurrency = models.OneToOneField(
+        'trading.Cryptocurrency',
+        on_delete=models.CASCADE,
+        verbose_name="ارز دیجیتال"
+    )
+    # Postings not folded in yet are not included
+    balance = models.DecimalField(
+        max_digits=30,
+        decimal_places=8,
+        default=Decimal('0'),
+        verbose_name="موجودی"
+    )
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "حساب کارمزد"
+        verbose_name_plural = "حساب‌های کارمزد"
+    
+    def __str__(self):
+        return f"{self.cryptocurrency.symbol} - {self.balance}"
+
+
+class FeePosting(models.Model):
+    """Fees of one settlement in one currency, credited to its fee account.
+    
+    Settlements only insert postings, so they never wait on each other for
+    a shared balance row. Postings are folded into the account balances
+    periodically.
+    """
+    
+    cryptocurrency = models.ForeignKey(
+        'trading.Cryptocurrency',
+        on_delete=models.CASCADE,
+        verbose_name="ارز دیجیتال"
+    )
+    trading_pair = models.ForeignKey(
+        'trading.TradingPair',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="جفت معاملاتی"
+    )
+    amount = models.DecimalField(max_digits=20, decimal_places=8, verbose_name="مقدار")
+    trade_count = models.IntegerField(default=0, verbose_name="تعداد معاملات")
+    folded = models.BooleanField(default=False, verbose_name="اعمال شده در حساب")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "ثبت کارمزد"
+        verbose_name_plural = "ثبت‌های کارمزد"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['cryptocurrency'],
+                condition=Q(folded=False),
+                name='fee_posting_unfolded_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.cryptocurrency.symbol} - {self.amount}"
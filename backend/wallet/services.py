@@ -1,12 +1,211 @@
+import operator
 from decimal import Decimal
+from functools import reduce
 from django.db import transaction
+from django.db.models import Q, Sum
 from django.utils import timezone
-from .models import Wallet, Transaction, DepositAddress, WithdrawalRequest, WalletReservation
+from .models import (
+    Wallet, Transaction, DepositAddress, WithdrawalRequest, WalletReservation, FeeAccount, FeePosting
+)
 from trading.models import Cryptocurrency
 
+class SettlementBatch:
+    """Balance changes netted per (user, currency), applied in one go"""
+    
+    def __init__(self):
+        # (user_id, cryptocurrency_id) -> [available delta, reserved delta]
+        self.deltas = {}
+        self.ledger = []
+        self.reservations = []
+        # (cryptocurrency_id, trading_pair_id) -> [fee total, trade count]
+        self.fees = {}
+    
+    def __bool__(self):
+        return bool(self.deltas or self.fees)
+    
+    def add(self, user_id, cryptocurrency_id, available=Decimal('0'), reserved=Decimal('0')):
+        """Add a balance change for a user's wallet"""
+        delta = self.deltas.setdefault((user_id, cryptocurrency_id), [Decimal('0'), Decimal('0')])
+        delta[0] += available
+        delta[1] += reserved
+    
+    def reserve(self, user_id, cryptocurrency_id, amount, reason):
+        """Move funds from available to reserved, with a reservation record"""
+        self.add(user_id, cryptocurrency_id, available=-amount, reserved=amount)
+        self.reservations.append((user_id, cryptocurrency_id, amount, reason))
+    
+    def record(self, user_id, cryptocurrency_id, amount, description,
+               transaction_type='trade', metadata=None):
+        """Queue a ledger entry, written along with the balance changes"""
+        self.ledger.append(
+            (user_id, cryptocurrency_id, amount, description, transaction_type, metadata or {})
+        )
+    
+    def collect_fee(self, cryptocurrency_id, amount, trading_pair_id=None):
+        """Add the fees of one trade to the exchange's fee account"""
+        fee = self.fees.setdefault((cryptocurrency_id, trading_pair_id), [Decimal('0'), 0])
+        fee[0] += amount
+        fee[1] += 1
+
+
 class WalletService:
     """Service for wallet operations"""
     
+    def settle(self, batch):
+        """Apply a settlement batch.
+        
+        All wallets of the batch are locked with one SELECT ... FOR UPDATE
+        in (user, currency) order, so settlements sharing wallets queue up
+        behind each other instead of deadlocking. The netted deltas are
+        checked against the locked balances, so none can go negative, and
+        written with one UPDATE. Ledger entries are inserted with one bulk
+        statement, and collected fees as one posting per currency and pair.
+        """
+        if not batch:
+            return
+        
+        with transaction.atomic(savepoint=False):
+            wallets = self._lock_wallets(batch.deltas.keys())
+            now = timezone.now()
+            
+            changed_wallets = []
+            for key, (available, reserved) in batch.deltas.items():
+                if not available and not reserved:
+                    continue
+                
+                wallet = wallets[key]
+                if wallet.available_balance + available < 0:
+                    raise ValueError("موجودی کافی نیست")
+                if wallet.reserved_balance + reserved < 0:
+                    raise ValueError("موجودی رزرو شده کافی نیست")
+                wallet.available_balance += available
+                wallet.reserved_balance += reserved
+                wallet.updated_at = now
+                changed_wallets.append(wallet)
+            
+            Wallet.objects.bulk_update(
+                changed_wallets, ['available_balance', 'reserved_balance', 'updated_at']
+            )
+            
+            Transaction.objects.bulk_create([
+                Transaction(
+                    wallet_id=wallets[(user_id, cryptocurrency_id)].id,
+                    transaction_type=transaction_type,
+                    status='completed',
+                    amount=amount,
+                    description=description,
+                    metadata=metadata,
+                    completed_at=now
+                )
+                for user_id, cryptocurrency_id, amount, description, transaction_type, metadata
+                in batch.ledger
+            ])
+            
+            if batch.reservations:
+                WalletReservation.objects.bulk_create([
+                    WalletReservation(
+                        wallet_id=wallets[(user_id, cryptocurrency_id)].id,
+                        amount=amount,
+                        reason=reason
+                    )
+                    for user_id, cryptocurrency_id, amount, reason in batch.reservations
+                ])
+            
+            if batch.fees:
+                FeePosting.objects.bulk_create([
+                    FeePosting(
+                        cryptocurrency_id=cryptocurrency_id,
+                        trading_pair_id=trading_pair_id,
+                        amount=amount,
+                        trade_count=trade_count
+                    )
+                    for (cryptocurrency_id, trading_pair_id), (amount, trade_count)
+                    in batch.fees.items()
+                    if amount
+                ])
+    
+    def fold_fee_postings(self):
+        """Add the unfolded fee postings to their fee account balances.
+        
+        Only the postings locked here are marked folded, so postings
+        committed meanwhile are left for the next run. Returns the number
+        of postings folded.
+        """
+        with transaction.atomic():
+            postings = list(
+                FeePosting.objects.select_for_update(skip_locked=True).filter(
+                    folded=False
+                ).values_list('id', 'cryptocurrency_id', 'amount')
+            )
+            if not postings:
+                return 0
+            
+            totals = {}
+            for _, cryptocurrency_id, amount in postings:
+                totals[cryptocurrency_id] = totals.get(cryptocurrency_id, Decimal('0')) + amount
+            
+            for cryptocurrency_id in sorted(totals):
+                account, _ = FeeAccount.objects.select_for_update().get_or_create(
+                    cryptocurrency_id=cryptocurrency_id
+                )
+                account.balance += totals[cryptocurrency_id]
+                account.save(update_fields=['balance', 'updated_at'])
+            
+            FeePosting.objects.filter(
+                id__in=[posting_id for posting_id, _, _ in postings]
+            ).update(folded=True)
+            return len(postings)
+    
+    def fee_balances(self):
+        """Collected fees per cryptocurrency id, unfolded postings included"""
+        balances = dict(FeeAccount.objects.values_list('cryptocurrency_id', 'balance'))
+        unfolded = FeePosting.objects.filter(folded=False).values('cryptocurrency_id').annotate(
+            total=Sum('amount')
+        ).order_by()
+        for row in unfolded:
+            balances[row['cryptocurrency_id']] = (
+                balances.get(row['cryptocurrency_id'], Decimal('0')) + row['total']
+            )
+        return balances
+    
+    def _lock_wallets(self, keys):
+        """Lock the wallets of (user_id, cryptocurrency_id) pairs, creating missing ones.
+        
+        Rows are locked in the order of the (user, currency) index, the same
+        canonical order for every caller. Must run inside a transaction.
+        """
+        keys = list(keys)
+        lookup = reduce(operator.or_, (
+            Q(user_id=user_id, cryptocurrency_id=cryptocurrency_id)
+            for user_id, cryptocurrency_id in keys
+        ))
+        
+        def fetch():
+            return {
+                (wallet.user_id, wallet.cryptocurrency_id): wallet
+                for wallet in Wallet.objects.select_for_update().filter(
+                    lookup
+                ).order_by('user_id', 'cryptocurrency_id')
+            }
+        
+        wallets = fetch()
+        missing = [key for key in keys if key not in wallets]
+        if missing:
+            # New rows are not visible to anyone else yet, so locking them
+            # after the existing ones cannot take part in a deadlock
+            Wallet.objects.bulk_create([
+                Wallet(user_id=user_id, cryptocurrency_id=cryptocurrency_id)
+                for user_id, cryptocurrency_id in missing
+            ], ignore_conflicts=True)
+            wallets = fetch()
+        
+        return wallets
+    
+    def _lock_wallet(self, user, cryptocurrency):
+        """Lock a single wallet for a read-modify-write, creating it if missing"""
+        key = (user.id, cryptocurrency.id)
+        return self._lock_wallets([key])[key]
+    
     def get_or_create_wallet(self, user, cryptocurrency):
         """Get or create wallet for user and cryptocurrency"""
         wallet, created = Wallet.objects.get_or_create(
@@ -27,7 +226,7 @@ class WalletService:
     def reserve_funds(self, user, cryptocurrency, amount, reason, reference_id=None):
         """Reserve funds in user's wallet"""
         with transaction.atomic():
-            wallet = self.get_or_create_wallet(user, cryptocurrency)
+            wallet = self._lock_wallet(user, cryptocurrency)
             
             if wallet.available_balance < amount:
                 raise ValueError("موجودی کافی نیست")
@@ -48,7 +247,7 @@ class WalletService:
     def release_reserved_funds(self, user, cryptocurrency, amount, reason, reference_id=None):
         """Release reserved funds back to available balance"""
         with transaction.atomic():
-            wallet = self.get_or_create_wallet(user, cryptocurrency)
+            wallet = self._lock_wallet(user, cryptocurrency)
             
             if wallet.reserved_balance < amount:
                 raise ValueError("موجودی رزرو شده کافی نیست")
@@ -73,7 +272,7 @@ class WalletService:
     def transfer_funds(self, user, cryptocurrency, amount, description):
         """Transfer funds (positive for credit, negative for debit)"""
         with transaction.atomic():
-            wallet = self.get_or_create_wallet(user, cryptocurrency)
+            wallet = self._lock_wallet(user, cryptocurrency)
             
             if amount < 0 and wallet.available_balance < abs(amount):
                 raise ValueError("موجودی کافی نیست")
@@ -117,7 +316,7 @@ class WalletService:
                 raise ValueError("تراکنش قابل تایید نیست")
             
             # Add funds to wallet
-            wallet = transaction_obj.wallet
+            wallet = Wallet.objects.select_for_update().get(id=transaction_obj.wallet_id)
             wallet.available_balance += transaction_obj.amount
             wallet.save()
             
@@ -218,7 +417,7 @@ class WalletService:
                 withdrawal_request.transaction.save()
             
             # Remove reserved funds (they were already debited when approved)
-            wallet = self.get_or_create_wallet(withdrawal_request.user, withdrawal_request.cryptocurrency)
+            wallet = self._lock_wallet(withdrawal_request.user, withdrawal_request.cryptocurrency)
             wallet.reserved_balance -= withdrawal_request.amount
             wallet.save()
     
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+
+@shared_task(name='wallet.fold_fee_postings')
+def fold_fee_postings():
+    """Fold the trading fee postings into the exchange fee accounts"""
+    from .services import WalletService
+    return WalletService().fold_fee_postings()